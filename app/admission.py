@@ -0,0 +1,237 @@
+# app/admission.py
+# Control de admisión y degradación de calidad para /api/recommend.
+#
+# Cada request completo consulta Google Maps, la red neuronal y CLIPS. En un pico
+# de tráfico eso hace que la latencia suba para todos hasta que los clientes
+# cortan por timeout. Acá se limita la cantidad de requests en curso, los que
+# no entran esperan en una cola acotada (si está llena o la espera se pasa del
+# máximo se responde 503) y, según la profundidad de la cola o la espera en
+# cola reciente, se sirve con un nivel de degradación:
+#
+#   0 completo      pipeline completo
+#   1 sin_google    tiempos de viaje del cache o estimados por distancia
+#   2 sin_nn        además, pesos del usuario en lugar de los de la red
+#   3 cache         respuesta cacheada del mismo request (si no hay, nivel 2)
+#
+# Mejor una recomendación un poco peor y rápida que un timeout.
+#
+# La señal de latencia es la espera en la cola de admisión, no el tiempo total
+# del request: con las consultas a Google Maps en serie un request completo
+# puede tardar más de 2 s con el servidor vacío, y los requests degradados
+# (más rápidos) bajaban el p90 y el nivel oscilaba. La espera se mide antes de
+# elegir el nivel, así que no depende de cómo se sirvió cada request. El nivel
+# por espera sube apenas se pasa un umbral y baja recién cuando la espera cae
+# por debajo de HISTERESIS veces el umbral; las esperas viejas (más de
+# `ventana_s` segundos) no cuentan.
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+NIVELES = ('completo', 'sin_google', 'sin_nn', 'cache')
+COMPLETO, SIN_GOOGLE, SIN_NN, CACHE = range(len(NIVELES))
+
+# Velocidades medias (km/h) para estimar el tiempo de viaje sin Google, por modo
+# de Google Maps. La distancia en línea recta se multiplica por FACTOR_RECORRIDO.
+VELOCIDADES_KMH = {'walking': 4.5, 'bicycling': 14.0, 'driving': 22.0, 'transit': 16.0}
+FACTOR_RECORRIDO = 1.3
+# Umbrales de la espera p90 (en múltiplos del objetivo) para los niveles 1, 2 y 3
+UMBRALES_ESPERA = (1.0, 2.0, 4.0)
+HISTERESIS = 0.5
+MIN_MUESTRAS = 10
+
+
+class Saturado(Exception):
+    """La cola de admisión está llena o la espera superó el máximo."""
+
+    def __init__(self, motivo: str, retry_after: int = 1):
+        super().__init__(motivo)
+        self.retry_after = retry_after
+
+
+class Turno:
+    """Lugar obtenido en el control de admisión, con el nivel con el que servir."""
+
+    def __init__(self, nivel: int, espera: float):
+        self.nivel = nivel
+        self.espera = espera
+
+    @property
+    def nombre(self) -> str:
+        return NIVELES[self.nivel]
+
+
+class ControlAdmision:
+    """Semáforo con cola de espera acotada y niveles de degradación."""
+
+    def __init__(
+        self,
+        max_concurrentes: int = 16,
+        max_cola: int = 64,
+        espera_max: float = 5.0,
+        espera_objetivo_ms: float = 250.0,
+        degradar: bool = True,
+        ventana: int = 50,
+        ventana_s: float = 30.0,
+    ):
+        self.max_concurrentes = max(1, max_concurrentes)
+        self.max_cola = max(0, max_cola)
+        self.espera_max = espera_max
+        self.espera_objetivo_ms = espera_objetivo_ms
+        self.degradar = degradar
+        self.ventana_s = ventana_s
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._esperas = deque(maxlen=ventana)  # (momento, ms de espera en cola) de los últimos requests
+        self._nivel_espera = COMPLETO  # nivel por espera, con histéresis
+        self.en_curso = 0
+        self.esperando = 0
+        self.rechazados = 0
+        self.por_nivel = [0] * len(NIVELES)
+
+    def _semaforo(self) -> asyncio.Semaphore:
+        # Se crea en el primer uso para quedar asociado al loop que corre la app
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrentes)
+        return self._sem
+
+    # ---------- Niveles ----------
+    def _esperas_recientes(self) -> List[float]:
+        limite = time.monotonic() - self.ventana_s
+        while self._esperas and self._esperas[0][0] < limite:
+            self._esperas.popleft()
+        return [ms for _, ms in self._esperas]
+
+    def espera_p90(self) -> float:
+        esperas = self._esperas_recientes()
+        if not esperas:
+            return 0.0
+        ordenadas = sorted(esperas)
+        return ordenadas[min(len(ordenadas) - 1, int(0.9 * len(ordenadas)))]
+
+    def nivel_por_espera(self) -> int:
+        """Nivel según la espera p90 en cola (1x, 2x, 4x el objetivo), con histéresis al bajar."""
+        if not self.espera_objetivo_ms or len(self._esperas_recientes()) < MIN_MUESTRAS:
+            self._nivel_espera = COMPLETO
+            return self._nivel_espera
+        relacion = self.espera_p90() / self.espera_objetivo_ms
+        sube = sum(relacion >= u for u in UMBRALES_ESPERA)
+        baja = sum(relacion >= u * HISTERESIS for u in UMBRALES_ESPERA)
+        if sube > self._nivel_espera:
+            self._nivel_espera = sube
+        elif baja < self._nivel_espera:
+            self._nivel_espera = baja
+        return self._nivel_espera
+
+    def nivel_actual(self, esperando: Optional[int] = None) -> int:
+        """Nivel según la profundidad de la cola (1/4, 1/2, 3/4) y la espera en cola (ver nivel_por_espera)."""
+        if not self.degradar:
+            return COMPLETO
+        esperando = self.esperando if esperando is None else esperando
+        nivel = 0
+        if self.max_cola:
+            ocupacion = esperando / self.max_cola
+            nivel = 3 if ocupacion >= 0.75 else 2 if ocupacion >= 0.5 else 1 if ocupacion >= 0.25 else 0
+        return max(nivel, self.nivel_por_espera())
+
+    # ---------- Admisión ----------
+    @contextlib.asynccontextmanager
+    async def turno(self):
+        """
+        `async with control.turno() as turno:` espera un lugar (a lo sumo
+        espera_max segundos) y lo libera al salir. Lanza Saturado si la cola
+        está llena o se agotó la espera.
+        """
+        sem = self._semaforo()
+        inicio = time.perf_counter()
+        esperando_al_llegar = self.esperando
+        if sem.locked():
+            if self.esperando >= self.max_cola:
+                self.rechazados += 1
+                raise Saturado("cola de admisión llena")
+            self.esperando += 1
+            try:
+                await asyncio.wait_for(sem.acquire(), self.espera_max)
+            except asyncio.TimeoutError:
+                self.rechazados += 1
+                raise Saturado("tiempo de espera agotado", retry_after=max(1, math.ceil(self.espera_max)))
+            finally:
+                self.esperando -= 1
+        else:
+            await sem.acquire()
+        espera = time.perf_counter() - inicio
+        self._esperas.append((time.monotonic(), espera * 1000))
+        self.en_curso += 1
+        nivel = self.nivel_actual(esperando_al_llegar)
+        self.por_nivel[nivel] += 1
+        try:
+            yield Turno(nivel, espera)
+        finally:
+            self.en_curso -= 1
+            sem.release()
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            'en_curso': self.en_curso,
+            'esperando': self.esperando,
+            'max_concurrentes': self.max_concurrentes,
+            'max_cola': self.max_cola,
+            'espera_p90_ms': round(self.espera_p90(), 1),
+            'nivel_actual': NIVELES[self.nivel_actual()],
+            'rechazados': self.rechazados,
+            'por_nivel': dict(zip(NIVELES, self.por_nivel)),
+        }
+
+
+# ---------- Caches para los niveles degradados ----------
+
+class CacheLRU:
+    """Dict acotado con vencimiento por entrada."""
+
+    def __init__(self, capacidad: int = 1000, ttl: float = 300.0):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._datos: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def obtener(self, clave) -> Optional[Any]:
+        item = self._datos.get(clave)
+        if item is None:
+            return None
+        momento, valor = item
+        if time.time() - momento > self.ttl:
+            del self._datos[clave]
+            return None
+        self._datos.move_to_end(clave)
+        return valor
+
+    def guardar(self, clave, valor):
+        self._datos[clave] = (time.time(), valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.capacidad:
+            self._datos.popitem(last=False)
+
+    def eliminar(self, clave) -> bool:
+        return self._datos.pop(clave, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._datos)
+
+
+def clave_request(body: Dict) -> str:
+    """Clave estable de un body de /api/recommend para el cache de respuestas."""
+    return hashlib.sha1(json.dumps(body, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def estimar_tiempo(usuario: Dict, restaurante: Dict, modo: str) -> Optional[float]:
+    """Minutos de viaje estimados por distancia (haversine) y velocidad media del modo."""
+    coords = (usuario.get('latitud'), usuario.get('longitud'), restaurante.get('latitud'), restaurante.get('longitud'))
+    if not all(coords):
+        return None
+    lat1, lon1, lat2, lon2 = map(math.radians, coords)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    km = 2 * 6371.0 * math.asin(math.sqrt(a)) * FACTOR_RECORRIDO
+    return km / VELOCIDADES_KMH.get(modo, VELOCIDADES_KMH['walking']) * 60
@@ -0,0 +1,495 @@
+# app/bulk_import.py
+# Importación masiva del catálogo en streaming.
+#
+# POST /api/restaurantes valida la lista completa en memoria y geocodifica una
+# dirección por vez antes de reescribir el archivo, lo que con miles de
+# restaurantes no termina dentro del timeout. Acá el archivo (NDJSON o un array
+# JSON) se lee de a pedazos, se valida en lotes, las direcciones sin coordenadas
+# se geocodifican con concurrencia acotada y un cache de direcciones, y cada
+# lote se escribe en el catálogo (alta/modificación, no reemplazo).
+#
+# Cada importación es un trabajo con un checkpoint en disco (IMPORT_DIR/<id>.json)
+# con el progreso, los errores por fila y las filas ya confirmadas en el
+# catálogo. Si el proceso se corta, al reanudar se saltean esas filas.
+#
+# Uso desde la línea de comandos (con el servidor corriendo o no; el servidor
+# recarga restaurantes.json al detectar el cambio):
+#   python -m app.bulk_import restaurantes.ndjson --lote 500 --concurrencia 8
+#   python -m app.bulk_import --reanudar <id>
+
+import argparse
+import asyncio
+import codecs
+import itertools
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from pydantic import ValidationError
+
+from .catalog import CatalogStore
+from .models import Restaurante
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+TAMANO_LECTURA = 64 * 1024
+MAX_ERRORES_GUARDADOS = 1000  # por trabajo; el total se sigue contando
+MAX_REGISTRO = 1024 * 1024  # un elemento del array JSON no puede ocupar más que esto
+REINTENTOS_GEOCODING = 3
+
+
+class ErrorFormato(Exception):
+    """El archivo no se puede seguir leyendo (JSON roto dentro de un array)."""
+
+
+def falta_coordenadas(r: Dict) -> bool:
+    """Mismo criterio que load_restaurantes para decidir si geocodificar."""
+    return bool(r.get("direccion")) and (
+        not r.get("latitud") or not r.get("longitud") or r.get("latitud") == 0.0 or r.get("longitud") == 0.0
+    )
+
+
+def normalizar_direccion(direccion: str) -> str:
+    return " ".join(direccion.lower().split())
+
+
+# ---------- Lectura en streaming ----------
+
+class LectorRegistros:
+    """
+    Itera los registros de un archivo NDJSON o de un array JSON sin cargarlo
+    entero. El formato se detecta por el primer carácter ('[' = array).
+
+    Produce (fila, registro) con fila desde 1; si una línea NDJSON no es JSON
+    válido el registro es la excepción, y la lectura sigue con la próxima línea.
+    En un array no hay forma de resincronizar, así que se corta con ErrorFormato.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.bytes_totales = self.path.stat().st_size
+        self.bytes_leidos = 0
+        self.formato: Optional[str] = None
+
+    def _pedazos(self, f) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        while True:
+            datos = f.read(TAMANO_LECTURA)
+            self.bytes_leidos += len(datos)
+            texto = decoder.decode(datos, final=not datos)
+            if texto:
+                yield texto
+            if not datos:
+                return
+
+    def __iter__(self) -> Iterator[Tuple[int, Any]]:
+        with open(self.path, "rb") as f:
+            pedazos = self._pedazos(f)
+            buffer = ""
+            for pedazo in pedazos:
+                buffer += pedazo
+                if buffer.strip():
+                    break
+            inicio = buffer.lstrip()[:1]
+            if not inicio:
+                self.formato = "ndjson"
+                return
+            self.formato = "json" if inicio == "[" else "ndjson"
+            if self.formato == "json":
+                yield from self._array(buffer, pedazos)
+            else:
+                yield from self._ndjson(buffer, pedazos)
+
+    def _ndjson(self, buffer: str, pedazos: Iterator[str]) -> Iterator[Tuple[int, Any]]:
+        fila = 0
+
+        def lineas(texto):
+            nonlocal fila
+            for linea in texto:
+                if not linea.strip():
+                    continue
+                fila += 1
+                try:
+                    yield fila, json.loads(linea)
+                except ValueError as e:
+                    yield fila, e
+
+        resto = ""
+        for pedazo in itertools.chain([buffer], pedazos):
+            *completas, resto = (resto + pedazo).split("\n")
+            yield from lineas(completas)
+        yield from lineas([resto])
+
+    def _array(self, buffer: str, pedazos: Iterator[str]) -> Iterator[Tuple[int, Any]]:
+        decoder = json.JSONDecoder()
+        pos = buffer.index("[") + 1
+        fila = 0
+        esperando_valor = True  # después de '[' o de ','
+        fin_archivo = False
+        while True:
+            # Saltear espacios y separadores
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos >= len(buffer):
+                if fin_archivo:
+                    raise ErrorFormato(f"el array JSON termina sin ']' (después de la fila {fila})")
+                siguiente = next(pedazos, None)
+                if siguiente is None:
+                    fin_archivo = True
+                else:
+                    buffer, pos = buffer[pos:] + siguiente, 0
+                continue
+            c = buffer[pos]
+            if c == "]" and (esperando_valor is False or fila == 0):
+                return
+            if not esperando_valor:
+                if c != ",":
+                    raise ErrorFormato(f"se esperaba ',' o ']' después de la fila {fila}")
+                pos += 1
+                esperando_valor = True
+                continue
+            try:
+                valor, fin = decoder.raw_decode(buffer, pos)
+            except ValueError as e:
+                # Puede ser un registro que todavía no terminó de llegar
+                if fin_archivo or len(buffer) - pos > MAX_REGISTRO:
+                    raise ErrorFormato(f"JSON inválido en la fila {fila + 1}: {e}")
+                siguiente = next(pedazos, None)
+                if siguiente is None:
+                    fin_archivo = True
+                else:
+                    buffer, pos = buffer[pos:] + siguiente, 0
+                continue
+            fila += 1
+            yield fila, valor
+            pos = fin  # el buffer se recorta al pedir el próximo pedazo
+            esperando_valor = False
+
+
+# ---------- Geocodificación ----------
+
+class Geocodificador:
+    """
+    Geocodifica con un cliente HTTP compartido, a lo sumo `concurrencia`
+    consultas a la vez y un cache de direcciones persistido en disco. Las
+    direcciones que Google no encuentra también se cachean (como None).
+    """
+
+    def __init__(self, api_key: str, cache_file: Path, concurrencia: int = 8):
+        self.api_key = api_key
+        self.cache_file = Path(cache_file)
+        self.concurrencia = max(1, concurrencia)
+        self.cache: Dict[str, Optional[List[float]]] = {}
+        self._cambios = False
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._en_curso: Dict[str, asyncio.Future] = {}
+        self.consultas = 0
+        self.aciertos_cache = 0
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"DEBUG: No se pudo leer el cache de geocodificación ({e}), se empieza vacío")
+
+    async def __aenter__(self):
+        self._sem = asyncio.Semaphore(self.concurrencia)
+        self._client = httpx.AsyncClient(timeout=10.0)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self.guardar_cache()
+
+    def guardar_cache(self):
+        if not self._cambios:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.cache, f, ensure_ascii=False)
+        os.replace(tmp, self.cache_file)
+        self._cambios = False
+
+    async def geocodificar(self, direccion: str) -> Optional[Tuple[float, float]]:
+        clave = normalizar_direccion(direccion)
+        if clave in self.cache:
+            self.aciertos_cache += 1
+            coords = self.cache[clave]
+            return tuple(coords) if coords else None
+        if not self.api_key:
+            return None
+        # Misma dirección repetida dentro del lote: una sola consulta
+        tarea = self._en_curso.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._consultar(clave, direccion))
+            self._en_curso[clave] = tarea
+            tarea.add_done_callback(lambda _: self._en_curso.pop(clave, None))
+        else:
+            self.aciertos_cache += 1
+        return await tarea
+
+    async def _consultar(self, clave: str, direccion: str) -> Optional[Tuple[float, float]]:
+        async with self._sem:
+            for intento in range(REINTENTOS_GEOCODING):
+                try:
+                    self.consultas += 1
+                    response = await self._client.get(
+                        GEOCODE_URL, params={"address": direccion, "key": self.api_key, "language": "es"})
+                    data = response.json()
+                except Exception as e:
+                    print(f"DEBUG: Error geocodificando '{direccion}': {e}")
+                    await asyncio.sleep(2 ** intento)
+                    continue
+                status = data.get("status")
+                if status == "OK" and data.get("results"):
+                    location = data["results"][0]["geometry"]["location"]
+                    self.cache[clave] = [location["lat"], location["lng"]]
+                    self._cambios = True
+                    return location["lat"], location["lng"]
+                if status == "ZERO_RESULTS":
+                    self.cache[clave] = None
+                    self._cambios = True
+                    return None
+                if status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR"):
+                    await asyncio.sleep(2 ** intento)
+                    continue
+                print(f"DEBUG: Error geocodificando - Status: {status}, Error: {data.get('error_message', 'N/A')}")
+                return None
+        return None
+
+
+# ---------- Trabajos de importación ----------
+
+def _error_validacion(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+class ImportadorCatalogo:
+    """Crea, ejecuta y reanuda trabajos de importación sobre un CatalogStore."""
+
+    def __init__(
+        self,
+        catalogo: CatalogStore,
+        directorio: Path,
+        api_key: str = "",
+        lote: int = 500,
+        concurrencia: int = 8,
+    ):
+        self.catalogo = catalogo
+        self.directorio = Path(directorio)
+        self.api_key = api_key
+        self.lote = max(1, lote)
+        self.concurrencia = concurrencia
+        self._tareas: Dict[str, asyncio.Task] = {}
+
+    # ---------- Estado ----------
+    def _path_estado(self, trabajo_id: str) -> Path:
+        return self.directorio / f"{trabajo_id}.json"
+
+    def archivo_subida(self, trabajo_id: str) -> Path:
+        return self.directorio / f"{trabajo_id}.upload"
+
+    def _guardar_estado(self, estado: Dict):
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        path = self._path_estado(estado["id"])
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def estado(self, trabajo_id: str) -> Optional[Dict]:
+        # Evitar rutas fuera del directorio con ids armados a mano
+        if not trabajo_id or Path(trabajo_id).name != trabajo_id:
+            return None
+        path = self._path_estado(trabajo_id)
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            estado = json.load(f)
+        estado["activo"] = trabajo_id in self._tareas
+        return estado
+
+    def crear(self, archivo: Optional[Path] = None) -> Dict:
+        """Registra un trabajo nuevo. Sin `archivo` se usa el de subida del trabajo."""
+        trabajo_id = uuid.uuid4().hex[:12]
+        estado = {
+            "id": trabajo_id,
+            "archivo": str(archivo) if archivo else str(self.archivo_subida(trabajo_id)),
+            "formato": None,
+            "estado": "pendiente",  # pendiente, en_curso, completado, fallido
+            "creado": time.time(),
+            "actualizado": time.time(),
+            "bytes_totales": None,
+            "bytes_leidos": 0,
+            "filas_leidas": 0,
+            "filas_confirmadas": 0,  # filas ya escritas en el catálogo (se saltean al reanudar)
+            "importados": 0,
+            "modificados": 0,  # altas o cambios reales en el catálogo
+            "filas_con_error": 0,
+            "errores": [],  # [{fila, id, error}] (los primeros MAX_ERRORES_GUARDADOS)
+            "geocodificados": 0,
+            "sin_coordenadas": 0,
+            "geocoding_consultas": 0,
+            "geocoding_cache": 0,
+            "error": None,
+        }
+        self._guardar_estado(estado)
+        return estado
+
+    # ---------- Ejecución ----------
+    def lanzar(self, trabajo_id: str) -> asyncio.Task:
+        """Ejecuta el trabajo en segundo plano (para la API)."""
+        if trabajo_id in self._tareas:
+            return self._tareas[trabajo_id]
+        tarea = asyncio.create_task(self.ejecutar(trabajo_id))
+        self._tareas[trabajo_id] = tarea
+        tarea.add_done_callback(lambda _: self._tareas.pop(trabajo_id, None))
+        return tarea
+
+    async def ejecutar(self, trabajo_id: str, al_progresar=None) -> Dict:
+        """Corre (o reanuda) un trabajo hasta el final del archivo."""
+        estado = self.estado(trabajo_id)
+        if estado is None:
+            raise KeyError(trabajo_id)
+        estado.pop("activo", None)
+        if estado["estado"] == "completado":
+            return estado
+        lector = LectorRegistros(Path(estado["archivo"]))
+        saltear = estado["filas_confirmadas"]
+        estado.update({"estado": "en_curso", "error": None, "bytes_totales": lector.bytes_totales})
+        self._guardar_estado(estado)
+        if saltear:
+            print(f"DEBUG: Reanudando importación {trabajo_id} desde la fila {saltear + 1}")
+
+        geocodificador = Geocodificador(self.api_key, self.directorio / "geocache.json", self.concurrencia)
+        if not self.api_key:
+            print("WARNING: GOOGLE_MAPS_API_KEY no configurada, solo se usarán coordenadas del cache")
+        try:
+            async with geocodificador:
+                lote: List[Tuple[int, Any]] = []
+                for fila, registro in lector:
+                    if fila <= saltear:
+                        continue
+                    lote.append((fila, registro))
+                    if len(lote) >= self.lote:
+                        await self._procesar_lote(estado, lote, geocodificador, lector)
+                        lote = []
+                        if al_progresar:
+                            al_progresar(estado)
+                        # Ceder el loop entre lotes para no frenar los requests
+                        await asyncio.sleep(0)
+                if lote:
+                    await self._procesar_lote(estado, lote, geocodificador, lector)
+                    if al_progresar:
+                        al_progresar(estado)
+            estado["formato"] = lector.formato
+            estado["estado"] = "completado"
+        except Exception as e:
+            print(f"Error en importación {trabajo_id}: {e}")
+            estado["estado"] = "fallido"
+            estado["error"] = str(e)
+        estado["actualizado"] = time.time()
+        self._guardar_estado(estado)
+        return estado
+
+    async def _procesar_lote(self, estado: Dict, lote: List[Tuple[int, Any]], geocodificador: Geocodificador,
+                             lector: LectorRegistros):
+        # Los contadores y errores del lote se aplican al estado recién cuando el
+        # lote quedó en el catálogo: si falla, al reanudar no se cuentan dos veces
+        validos: List[Dict] = []
+        errores: List[Dict] = []
+        for fila, registro in lote:
+            if isinstance(registro, Exception):
+                errores.append({"fila": fila, "id": None, "error": f"JSON inválido: {registro}"})
+                continue
+            if not isinstance(registro, dict):
+                errores.append({"fila": fila, "id": None, "error": "se esperaba un objeto"})
+                continue
+            try:
+                validos.append(Restaurante(**registro).dict())
+            except ValidationError as e:
+                errores.append({"fila": fila, "id": registro.get("id"), "error": _error_validacion(e)})
+
+        pendientes = [r for r in validos if falta_coordenadas(r)]
+        resultados = await asyncio.gather(*(geocodificador.geocodificar(r["direccion"]) for r in pendientes))
+        for r, coords in zip(pendientes, resultados):
+            if coords:
+                r["latitud"], r["longitud"] = coords
+        geocodificados = sum(1 for coords in resultados if coords)
+
+        # Write-through: el lote queda en el catálogo (y en disco) antes de avanzar el checkpoint
+        estado["modificados"] += self.catalogo.upsert_many(validos)
+        geocodificador.guardar_cache()
+        estado["importados"] += len(validos)
+        estado["filas_con_error"] += len(errores)
+        estado["errores"].extend(errores[:max(0, MAX_ERRORES_GUARDADOS - len(estado["errores"]))])
+        estado["geocodificados"] += geocodificados
+        estado["sin_coordenadas"] += len(pendientes) - geocodificados
+        estado["formato"] = lector.formato
+        estado["filas_leidas"] = lote[-1][0]
+        estado["filas_confirmadas"] = lote[-1][0]
+        estado["bytes_leidos"] = lector.bytes_leidos
+        estado["geocoding_consultas"] = geocodificador.consultas
+        estado["geocoding_cache"] = geocodificador.aciertos_cache
+        estado["actualizado"] = time.time()
+        self._guardar_estado(estado)
+
+
+def resumen(estado: Dict) -> str:
+    total = estado.get("bytes_totales") or 0
+    avance = f" ({100 * estado['bytes_leidos'] / total:.0f}%)" if total else ""
+    return (f"[{estado['id']}] {estado['estado']}{avance}: filas={estado['filas_leidas']} "
+            f"importados={estado['importados']} errores={estado['filas_con_error']} "
+            f"geocodificados={estado['geocodificados']} sin_coordenadas={estado['sin_coordenadas']}")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    base_dir = Path(__file__).parent.parent
+    load_dotenv(base_dir / ".env")
+    parser = argparse.ArgumentParser(description="Importación masiva de restaurantes (NDJSON o array JSON)")
+    parser.add_argument("archivo", nargs="?", help="Archivo a importar")
+    parser.add_argument("--reanudar", metavar="ID", help="Reanudar un trabajo interrumpido")
+    parser.add_argument("--catalogo", default=str(base_dir / "restaurantes.json"))
+    parser.add_argument("--directorio", default=os.environ.get("IMPORT_DIR", str(base_dir / "importaciones")))
+    parser.add_argument("--lote", type=int, default=int(os.environ.get("IMPORT_LOTE", "500")))
+    parser.add_argument("--concurrencia", type=int, default=int(os.environ.get("IMPORT_CONCURRENCIA", "8")))
+    args = parser.parse_args()
+    if bool(args.archivo) == bool(args.reanudar):
+        parser.error("indicar un archivo o --reanudar ID")
+
+    importador = ImportadorCatalogo(
+        CatalogStore(args.catalogo),
+        Path(args.directorio),
+        api_key=os.environ.get("GOOGLE_MAPS_API_KEY", ""),
+        lote=args.lote,
+        concurrencia=args.concurrencia,
+    )
+    if args.reanudar:
+        if importador.estado(args.reanudar) is None:
+            print(f"No existe la importación {args.reanudar}")
+            return 1
+        trabajo_id = args.reanudar
+    else:
+        trabajo_id = importador.crear(Path(args.archivo).resolve())["id"]
+    estado = asyncio.run(importador.ejecutar(trabajo_id, al_progresar=lambda e: print(resumen(e))))
+    print(resumen(estado))
+    for err in estado["errores"][:20]:
+        print(f"   fila {err['fila']} ({err['id']}): {err['error']}")
+    if estado["filas_con_error"] > 20:
+        print(f"   ... y {estado['filas_con_error'] - 20} filas más con error (ver {importador.directorio / (trabajo_id + '.json')})")
+    if estado["estado"] == "fallido":
+        print(f"Falló: {estado['error']}. Reanudar con: python -m app.bulk_import --reanudar {trabajo_id}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
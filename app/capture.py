@@ -0,0 +1,73 @@
+# app/capture.py
+# Captura muestreada de requests de /api/recommend y /api/feedback.
+#
+# Es opt-in: con CAPTURE_SAMPLE_RATE=0 (el default) no se captura nada y el
+# costo es una comparación por request. Los bodies se guardan en un JSONL
+# rotativo, con los datos personales limpiados, para reproducirlos después con
+# `python -m app.replay` como prueba de carga realista.
+
+import hashlib
+import json
+import logging
+import random
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Campos con datos personales: se eliminan o se pseudonimizan
+_CAMPOS_ELIMINADOS = ("direccion", "usuario_direccion")
+_DECIMALES_COORDENADAS = 2  # ~1 km: suficiente para el índice espacial, no identifica un domicilio
+
+
+def _pseudonimo(valor: str) -> str:
+    return "u_" + hashlib.sha256(valor.encode("utf-8")).hexdigest()[:12]
+
+
+def limpiar_pii(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia del body sin direcciones del usuario, con coordenadas redondeadas e id pseudonimizado."""
+    limpio = json.loads(json.dumps(body, default=str))
+    for campo in _CAMPOS_ELIMINADOS:
+        limpio.pop(campo, None)
+    usuario = limpio.get("usuario")
+    if isinstance(usuario, dict):
+        for campo in _CAMPOS_ELIMINADOS:
+            usuario.pop(campo, None)
+        for campo in ("latitud", "longitud"):
+            if isinstance(usuario.get(campo), (int, float)):
+                usuario[campo] = round(usuario[campo], _DECIMALES_COORDENADAS)
+        if usuario.get("id"):
+            usuario["id"] = _pseudonimo(str(usuario["id"]))
+    return limpio
+
+
+class RequestCapture:
+    """Escribe una muestra de los requests en un JSONL rotativo."""
+
+    def __init__(self, path: Path, sample_rate: float = 0.0, max_bytes: int = 50 * 1024 * 1024, backups: int = 5):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self._logger: Optional[logging.Logger] = None
+        if self.activa:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"captura.{self.path}")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.addHandler(handler)
+            print(f"DEBUG: Captura de requests activa ({sample_rate:.0%}) en {self.path}")
+
+    @property
+    def activa(self) -> bool:
+        return self.sample_rate > 0
+
+    def capturar(self, endpoint: str, body: Dict[str, Any]):
+        """Registra el body si el request cae en la muestra."""
+        if not self.activa or random.random() >= self.sample_rate:
+            return
+        try:
+            registro = {"ts": time.time(), "endpoint": endpoint, "body": limpiar_pii(body)}
+            self._logger.info(json.dumps(registro, ensure_ascii=False))
+        except Exception as e:
+            print(f"DEBUG: Error capturando request: {e}")
@@ -0,0 +1,310 @@
+# app/catalog.py
+# Catálogo de restaurantes en memoria, respaldado por restaurantes.json.
+#
+# Antes cada request releía el archivo entero. El catálogo se carga una vez, se
+# recarga solo si el archivo cambió por fuera (mtime) y los cambios se aplican de
+# forma incremental. Las estructuras derivadas (feature store, etc.) se suscriben
+# como listeners y reciben cada alta/modificación/baja para actualizarse sin
+# reconstruir todo.
+#
+# Cada cambio incrementa `version` y queda en un registro acotado de cambios
+# (último cambio por id, con las bajas como lápidas), de donde sale el delta
+# de GET /api/restaurantes?since=<version>. La versión inicial es el reloj en
+# microsegundos, así que sigue creciendo después de reiniciar el servidor; un
+# `since` que el registro ya no cubre se contesta con el catálogo completo.
+#
+# Con varios workers escribiendo el mismo archivo, cada escritura toma un flock
+# sobre `restaurantes.json.lock` y recarga el archivo si otro proceso lo cambió
+# antes de aplicar sus cambios, así no se pisa lo que escribieron los demás.
+# Un proceso que no retiene el catálogo (`retener=False`, los lectores del
+# catálogo compartido) descarta su copia después de cada escritura.
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock las escrituras solo se serializan dentro del proceso
+    fcntl = None
+
+
+def cambios_posteriores(cambios: Iterable[Tuple[str, int, bool]], version: int) -> List[Tuple[str, bool]]:
+    """
+    (id, eliminado) de los cambios posteriores a `version`, del más viejo al
+    más nuevo. `cambios` son (id, versión, eliminado) del más nuevo al más viejo.
+    """
+    posteriores = []
+    for rest_id, v, eliminado in cambios:
+        if v <= version:
+            break
+        posteriores.append((rest_id, eliminado))
+    posteriores.reverse()
+    return posteriores
+
+
+class CatalogListener:
+    """Interfaz de las estructuras derivadas del catálogo."""
+
+    def al_reiniciar(self, restaurantes: List[Dict]):
+        """El catálogo se (re)cargó completo."""
+
+    def al_actualizar(self, restaurante: Dict):
+        """Alta o modificación de un restaurante."""
+
+    def al_eliminar(self, rest_id: str):
+        """Baja de un restaurante."""
+
+
+class CatalogStore:
+    def __init__(self, path: str, cambios_max: int = 10000, cargar_ahora: bool = True, retener: bool = True):
+        self.path = Path(path)
+        self.retener = retener  # False: la copia en memoria se descarta después de cada escritura
+        self._restaurantes: Dict[str, Dict] = {}
+        self._listeners: List[CatalogListener] = []
+        self._firma: Optional[Tuple[int, int, int]] = None  # (inodo, mtime_ns, tamaño) del archivo cargado
+        self._lock = threading.RLock()
+        self._escribiendo = 0  # profundidad de secciones de escritura anidadas (el flock se toma una vez)
+        self.version = time.time_ns() // 1000
+        self._cambios: "OrderedDict[str, Tuple[int, bool]]" = OrderedDict()  # id -> (versión, eliminado)
+        self._cambios_max = cambios_max
+        self._cubre_desde = self.version  # el registro tiene todos los cambios posteriores a esta versión
+        self._instantanea: Tuple[Optional[int], bytes] = (None, b"")
+        self._cargado = False
+        if cargar_ahora:
+            self.cargar()
+
+    def _asegurar_cargado(self):
+        # Con cargar_ahora=False el archivo se lee en el primer uso
+        if not self._cargado:
+            self.cargar()
+
+    # ---------- Listeners ----------
+    def suscribir(self, listener: CatalogListener):
+        with self._lock:
+            self._asegurar_cargado()
+            self._listeners.append(listener)
+            listener.al_reiniciar(list(self._restaurantes.values()))
+
+    # ---------- Carga ----------
+    def cargar(self):
+        """Carga (o recarga) el catálogo completo desde el archivo."""
+        with self._lock:
+            restaurantes = []
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    restaurantes = json.load(f)
+                self._firma = self._firma_archivo()
+            anteriores = self._restaurantes
+            self._restaurantes = {r["id"]: r for r in restaurantes}
+            if self._cargado:
+                # Recarga por un cambio externo: se registran las diferencias
+                for rest_id, r in self._restaurantes.items():
+                    if anteriores.get(rest_id) != r:
+                        self._registrar(rest_id, eliminado=False)
+                for rest_id in anteriores:
+                    if rest_id not in self._restaurantes:
+                        self._registrar(rest_id, eliminado=True)
+                if list(anteriores) != list(self._restaurantes):
+                    self.version += 1
+            self._cargado = True
+            for listener in self._listeners:
+                listener.al_reiniciar(list(self._restaurantes.values()))
+
+    def _firma_archivo(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def recargar_si_cambio(self):
+        """Recarga si el archivo fue modificado por fuera del servidor (u otro worker)."""
+        try:
+            firma = self._firma_archivo()
+        except OSError:
+            return
+        if not self._cargado:
+            self.cargar()
+        elif firma != self._firma:
+            print(f"DEBUG: {self.path.name} cambió en disco, recargando catálogo")
+            self.cargar()
+
+    def descargar(self):
+        """Suelta la copia en memoria; se vuelve a leer del archivo en el próximo uso."""
+        with self._lock:
+            self._restaurantes = {}
+            self._instantanea = (None, b"")
+            self._firma = None
+            self._cargado = False
+
+    def guardar(self):
+        """Escribe el catálogo completo en el archivo (temporal + rename atómico)."""
+        with self._lock:
+            tmp = self.path.with_suffix('.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(list(self._restaurantes.values()), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+            self._firma = self._firma_archivo()
+
+    @contextlib.contextmanager
+    def _escritura(self):
+        """
+        Sección de escritura: flock sobre el archivo de lock (entre procesos),
+        recarga si otro proceso cambió el archivo y, sin `retener`, descarta la
+        copia al terminar. Las secciones anidadas reusan el lock ya tomado.
+        """
+        with self._lock:
+            if self._escribiendo:
+                self._escribiendo += 1
+                try:
+                    yield
+                finally:
+                    self._escribiendo -= 1
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path.with_suffix('.json.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            self._escribiendo = 1
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                self.recargar_si_cambio()
+                yield
+            finally:
+                self._escribiendo = 0
+                os.close(fd)  # al cerrar se libera el flock
+                if not self.retener:
+                    self.descargar()
+
+    # ---------- Versiones ----------
+    def _registrar(self, rest_id: str, eliminado: bool):
+        self.version += 1
+        self._cambios[rest_id] = (self.version, eliminado)
+        self._cambios.move_to_end(rest_id)
+        while len(self._cambios) > self._cambios_max:
+            _, (version, _) = self._cambios.popitem(last=False)
+            self._cubre_desde = version
+
+    def cambios_desde(self, version: int) -> Optional[Tuple[int, List[Dict], List[str]]]:
+        """
+        (versión actual, altas y modificaciones, ids eliminados) posteriores a
+        `version`, en el orden en que ocurrieron. None si el registro no cubre
+        esa versión.
+        """
+        with self._lock:
+            self._asegurar_cargado()
+            if version < self._cubre_desde or version > self.version:
+                return None
+            cambios = cambios_posteriores(((i, v, e) for i, (v, e) in reversed(self._cambios.items())), version)
+            upserts = [dict(self._restaurantes[i]) for i, eliminado in cambios if not eliminado]
+            return self.version, upserts, [i for i, eliminado in cambios if eliminado]
+
+    def instantanea(self) -> Tuple[int, bytes]:
+        """(versión, catálogo completo serializado en JSON), serializado una vez por versión."""
+        with self._lock:
+            self._asegurar_cargado()
+            if self._instantanea[0] != self.version:
+                contenido = json.dumps(list(self._restaurantes.values()), ensure_ascii=False,
+                                       allow_nan=False, separators=(",", ":")).encode("utf-8")
+                self._instantanea = (self.version, contenido)
+            return self._instantanea
+
+    def exportar(self) -> Dict:
+        """
+        Estado del catálogo para publicarlo a otros procesos: versión, ids en
+        orden, cada restaurante serializado (el listado completo es
+        b"[" + b",".join(registros) + b"]") y el registro de cambios.
+        """
+        with self._lock:
+            self._asegurar_cargado()
+            return {
+                'version': self.version,
+                'ids': list(self._restaurantes),
+                'registros': [json.dumps(r, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+                              for r in self._restaurantes.values()],
+                'cubre_desde': self._cubre_desde,
+                'cambios': [[i, v, e] for i, (v, e) in reversed(self._cambios.items())],
+            }
+
+    # ---------- Lectura ----------
+    def todos(self) -> List[Dict]:
+        """Copias de todos los restaurantes (se pueden modificar sin afectar el catálogo)."""
+        with self._lock:
+            self._asegurar_cargado()
+            return [dict(r) for r in self._restaurantes.values()]
+
+    def obtener(self, rest_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._asegurar_cargado()
+            r = self._restaurantes.get(rest_id)
+            return dict(r) if r is not None else None
+
+    def obtener_muchos(self, rest_ids: Iterable[str]) -> List[Dict]:
+        """Copias de los restaurantes pedidos, en el orden pedido (se omiten los que no están)."""
+        with self._lock:
+            self._asegurar_cargado()
+            return [dict(self._restaurantes[i]) for i in rest_ids if i in self._restaurantes]
+
+    def buscar(self, condicion: Callable[[Dict], bool]) -> List[Dict]:
+        """Copias de los restaurantes que cumplen la condición, en el orden del catálogo."""
+        with self._lock:
+            self._asegurar_cargado()
+            return [dict(r) for r in self._restaurantes.values() if condicion(r)]
+
+    def __len__(self) -> int:
+        self._asegurar_cargado()
+        return len(self._restaurantes)
+
+    # ---------- Escritura incremental ----------
+    def upsert_many(self, restaurantes: Iterable[Dict], guardar: bool = True) -> int:
+        """Alta/modificación de restaurantes. Solo notifica los que cambiaron."""
+        cambios = 0
+        with self._escritura():
+            for r in restaurantes:
+                r = dict(r)
+                if self._restaurantes.get(r["id"]) == r:
+                    continue
+                self._restaurantes[r["id"]] = r
+                self._registrar(r["id"], eliminado=False)
+                cambios += 1
+                for listener in self._listeners:
+                    listener.al_actualizar(r)
+            if cambios and guardar:
+                self.guardar()
+        return cambios
+
+    def upsert(self, restaurante: Dict, guardar: bool = True) -> int:
+        return self.upsert_many([restaurante], guardar=guardar)
+
+    def eliminar(self, rest_id: str, guardar: bool = True) -> bool:
+        with self._escritura():
+            if self._restaurantes.pop(rest_id, None) is None:
+                return False
+            self._registrar(rest_id, eliminado=True)
+            for listener in self._listeners:
+                listener.al_eliminar(rest_id)
+            if guardar:
+                self.guardar()
+            return True
+
+    def reemplazar(self, restaurantes: List[Dict]):
+        """Reemplaza el catálogo completo aplicando solo las diferencias."""
+        with self._escritura():
+            nuevos_ids = {r["id"] for r in restaurantes}
+            for rest_id in [i for i in self._restaurantes if i not in nuevos_ids]:
+                self.eliminar(rest_id, guardar=False)
+            self.upsert_many(restaurantes, guardar=False)
+            # Respetar el orden de la lista recibida
+            orden_anterior = list(self._restaurantes)
+            self._restaurantes = {r["id"]: self._restaurantes[r["id"]] for r in restaurantes}
+            if list(self._restaurantes) != orden_anterior:
+                self.version += 1  # mismo contenido en otro orden: cambia el listado completo
+                # Los listeners que guardan el orden del catálogo lo reconstruyen
+                for listener in self._listeners:
+                    listener.al_reiniciar(list(self._restaurantes.values()))
+            self.guardar()
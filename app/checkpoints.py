@@ -0,0 +1,205 @@
+# app/checkpoints.py
+# Formato binario compacto para arrays de NumPy con escritura atómica.
+#
+# Layout del archivo:
+#   [8 bytes]  magic b"NNCKPT01"
+#   [4 bytes]  largo del header (uint32 little-endian)
+#   [N bytes]  header JSON (utf-8): versión, arquitectura, learning rate, checksum,
+#              y por cada array su nombre, dtype, shape y offset dentro del payload
+#   [padding]  hasta alinear a 64 bytes
+#   [payload]  arrays contiguos, cada uno alineado a 64 bytes
+#
+# El checksum (CRC32) cubre el payload. Los archivos se escriben en un temporal
+# del mismo directorio y se publican con os.replace, así un corte a mitad de la
+# escritura nunca deja un archivo a medio escribir con el nombre final.
+# La lectura puede mapear el archivo en memoria (mmap) sin copiar los arrays.
+
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"NNCKPT01"
+FORMAT_VERSION = 1
+ALINEACION = 64
+CHECKPOINT_PATTERN = re.compile(r"^nn_model\.(\d{6})\.ckpt$")
+
+_lock_escritura = threading.Lock()
+
+
+class CheckpointError(ValueError):
+    """Archivo de checkpoint inválido, truncado o con checksum incorrecto."""
+
+
+def _alinear(n: int) -> int:
+    return (n + ALINEACION - 1) // ALINEACION * ALINEACION
+
+
+def escribir_arrays(path: Path, arrays: Dict[str, np.ndarray], meta: Optional[Dict] = None):
+    """Escribe los arrays y la metadata en `path` de forma atómica (temporal + rename)."""
+    path = Path(path)
+    entradas = []
+    offset = 0
+    contiguos = {}
+    for nombre, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        contiguos[nombre] = arr
+        offset = _alinear(offset)
+        entradas.append({
+            'nombre': nombre,
+            'dtype': arr.dtype.str,
+            'shape': list(arr.shape),
+            'offset': offset,
+            'nbytes': int(arr.nbytes),
+        })
+        offset += arr.nbytes
+    largo_payload = _alinear(offset)
+
+    payload = bytearray(largo_payload)
+    for entrada in entradas:
+        datos = contiguos[entrada['nombre']].tobytes()
+        payload[entrada['offset']:entrada['offset'] + len(datos)] = datos
+
+    header = dict(meta or {})
+    header.update({
+        'format_version': FORMAT_VERSION,
+        'arrays': entradas,
+        'payload_bytes': largo_payload,
+        'checksum': zlib.crc32(payload) & 0xFFFFFFFF,
+    })
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    inicio_payload = _alinear(len(MAGIC) + 4 + len(header_bytes))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b"\0" * (inicio_payload - len(MAGIC) - 4 - len(header_bytes)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    _fsync_directorio(path.parent)
+
+
+def _fsync_directorio(directorio: Path):
+    # Persistir el rename; no disponible en Windows
+    if os.name != 'posix':
+        return
+    fd = os.open(directorio, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def leer_header(buf) -> Tuple[Dict, int]:
+    """Parsea magic + header. Devuelve (header, offset donde empieza el payload)."""
+    if len(buf) < len(MAGIC) + 4 or bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise CheckpointError("magic inválido: no es un checkpoint binario")
+    (largo,) = struct.unpack('<I', bytes(buf[len(MAGIC):len(MAGIC) + 4]))
+    fin_header = len(MAGIC) + 4 + largo
+    if len(buf) < fin_header:
+        raise CheckpointError("header truncado")
+    try:
+        header = json.loads(bytes(buf[len(MAGIC) + 4:fin_header]).decode('utf-8'))
+    except ValueError as e:
+        raise CheckpointError(f"header ilegible: {e}")
+    if header.get('format_version') != FORMAT_VERSION:
+        raise CheckpointError(f"format_version no soportada: {header.get('format_version')}")
+    return header, _alinear(fin_header)
+
+
+def leer_arrays(path: Path, usar_mmap: bool = False, verificar: bool = True) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """
+    Lee un archivo escrito por escribir_arrays. Devuelve (header, arrays).
+    Con usar_mmap=True los arrays son vistas de solo lectura sobre el archivo mapeado.
+    """
+    with open(path, 'rb') as f:
+        if usar_mmap:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+
+    header, inicio = leer_header(buf)
+    fin = inicio + header['payload_bytes']
+    if len(buf) < fin:
+        raise CheckpointError("payload truncado")
+    payload = memoryview(buf)[inicio:fin]
+    if verificar and (zlib.crc32(payload) & 0xFFFFFFFF) != header['checksum']:
+        raise CheckpointError("checksum incorrecto")
+
+    arrays = {}
+    for entrada in header['arrays']:
+        dtype = np.dtype(entrada['dtype'])
+        cantidad = int(np.prod(entrada['shape'], dtype=np.int64))
+        arr = np.frombuffer(payload, dtype=dtype, count=cantidad, offset=entrada['offset'])
+        arrays[entrada['nombre']] = arr.reshape(entrada['shape'])
+    return header, arrays
+
+
+# ---------- Checkpoints del modelo ----------
+def listar_checkpoints(directorio: Path) -> List[Path]:
+    """Checkpoints del directorio, del más nuevo al más viejo."""
+    directorio = Path(directorio)
+    if not directorio.exists():
+        return []
+    encontrados = []
+    for p in directorio.iterdir():
+        m = CHECKPOINT_PATTERN.match(p.name)
+        if m:
+            encontrados.append((int(m.group(1)), p))
+    return [p for _, p in sorted(encontrados, reverse=True)]
+
+
+def guardar_checkpoint(directorio: Path, params: Dict[str, np.ndarray], meta: Dict, retener: int = 5) -> Path:
+    """
+    Guarda un nuevo checkpoint con número de secuencia creciente y borra los
+    más viejos, conservando los últimos `retener` para poder hacer rollback.
+    """
+    directorio = Path(directorio)
+    with _lock_escritura:
+        existentes = listar_checkpoints(directorio)
+        ultimo = int(CHECKPOINT_PATTERN.match(existentes[0].name).group(1)) if existentes else 0
+        path = directorio / f"nn_model.{ultimo + 1:06d}.ckpt"
+        escribir_arrays(path, params, meta)
+        for viejo in listar_checkpoints(directorio)[retener:]:
+            try:
+                viejo.unlink()
+            except OSError as e:
+                print(f"Error borrando checkpoint viejo {viejo}: {e}")
+    return path
+
+
+def cargar_ultimo_checkpoint(directorio: Path, usar_mmap: bool = False) -> Optional[Tuple[Path, Dict, Dict[str, np.ndarray]]]:
+    """
+    Carga el checkpoint válido más nuevo. Si el último está corrupto hace
+    rollback al anterior (avisando). Devuelve None si no hay checkpoints y
+    lanza CheckpointError si hay pero ninguno es válido.
+    """
+    candidatos = listar_checkpoints(directorio)
+    if not candidatos:
+        return None
+    errores = []
+    for path in candidatos:
+        try:
+            header, arrays = leer_arrays(path, usar_mmap=usar_mmap)
+            if errores:
+                print(f"WARNING: rollback a {path.name}; checkpoints descartados: {errores}")
+            return path, header, arrays
+        except (CheckpointError, OSError) as e:
+            errores.append(f"{path.name}: {e}")
+    raise CheckpointError(f"ningún checkpoint válido en {directorio}: {errores}")
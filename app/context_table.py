@@ -0,0 +1,77 @@
+# app/context_table.py
+# Tabla de los términos de la puntuación que dependen del contexto y no del usuario.
+#
+# Algunas partes de U dependen solo del restaurante y del Contexto:
+#   - puntuar-disponibilidad: solo en franja cena, 1.0 con reserva y 0.3 sin
+#   - contexto-lluvia-aumenta-cercania: con lluvia wd termina en 1.0
+#   - agregar-calidad y la penalización por falta de estacionamiento: no
+#     dependen del contexto; la penalización solo se aplica en auto o moto
+#
+# Acá se materializa, para cada combinación (clima, dia, franja), qué columna
+# del feature store da la disponibilidad y qué pesos fija el contexto. Las
+# columnas por restaurante (disp_cena, calidad, penalizacion_estacionamiento)
+# viven en el feature store: se actualizan con cada cambio del catálogo y se
+# comparten entre workers junto con el resto. Por request solo quedan los
+# términos que dependen del usuario (afinidad, precio, cercanía).
+#
+# Los caminos que puntúan en Python (top-K, sesiones, plazo vencido) usan las
+# columnas directamente. Para CLIPS, main copia la disponibilidad en el slot
+# `disp` del restaurante (-1 = calcularla en la regla) y aplica `pesos_fijos`
+# al usuario antes de asertarlo, así puntuar-disponibilidad no la recalcula y
+# contexto-lluvia-aumenta-cercania no se activa.
+#
+# Ninguna regla del .clp lee `dia`, así que las entradas de distintos días
+# comparten columnas. El estado abierto depende de la hora actual, no de la
+# franja, y sigue calculándose por request.
+
+from typing import Dict, Optional
+
+import numpy as np
+
+from .feature_store import FeatureStore
+
+CLIMAS = ('templado', 'lluvia', 'calor', 'frio')
+DIAS = ('lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo')
+FRANJAS = ('desayuno', 'almuerzo', 'cena')
+
+
+class ComponentesContexto:
+    """Entrada de la tabla para un (clima, dia, franja)."""
+
+    def __init__(self, clima: str, dia: str, franja: str):
+        self.clima = clima
+        self.dia = dia
+        self.franja = franja
+        # Pesos que el contexto fija por encima de los del usuario
+        self.pesos_fijos: Dict[str, float] = {'wd': 1.0} if clima == 'lluvia' else {}
+        # Columna del feature store con la disponibilidad (None = no puntúa)
+        self.columna_disp: Optional[str] = 'disp_cena' if franja == 'cena' else None
+
+    def columnas(self, features: FeatureStore, filas: np.ndarray) -> Dict[str, np.ndarray]:
+        """calidad, disp y penalizacion_estacionamiento de las filas (NaN en las -1, fuera del store)."""
+        fuera = filas < 0
+        filas = np.where(fuera, 0, filas)
+        columnas = {}
+        for nombre, columna in (('calidad', 'calidad'), ('disp', self.columna_disp),
+                                ('penalizacion_estacionamiento', 'penalizacion_estacionamiento')):
+            if columna is None or fuera.all():
+                valores = np.zeros(len(filas))
+            else:
+                valores = getattr(features, columna)[filas]
+            valores = valores.astype(float)
+            valores[fuera] = np.nan
+            columnas[nombre] = valores
+        return columnas
+
+
+TABLA: Dict[tuple, ComponentesContexto] = {
+    (clima, dia, franja): ComponentesContexto(clima, dia, franja)
+    for clima in CLIMAS for dia in DIAS for franja in FRANJAS
+}
+
+
+def componentes(contexto: Dict) -> ComponentesContexto:
+    """Entrada de la tabla para el contexto (armada en el momento si trae valores fuera del dominio)."""
+    clave = (contexto.get('clima'), contexto.get('dia'), contexto.get('franja'))
+    entrada = TABLA.get(clave)
+    return entrada if entrada is not None else ComponentesContexto(*clave)
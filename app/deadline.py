@@ -0,0 +1,143 @@
+# app/deadline.py
+# Plazos por request y cancelación del trabajo abandonado.
+#
+# Si el cliente de /api/recommend corta (timeout propio, pestaña cerrada), el
+# servidor seguía con las consultas a Google Maps una detrás de otra y corría
+# CLIPS hasta el final para una respuesta que nadie iba a leer. Acá:
+#
+#   - Plazo: vencimiento opcional del request (header X-Deadline-Ms o el valor
+#     por defecto de la config). Viaja en una ContextVar, así las etapas
+#     (geocodificación, Distance Matrix, red neuronal, CLIPS) lo consultan sin
+#     pasarlo por todas las firmas. Cada etapa que se queda sin tiempo usa su
+#     alternativa barata y lo anota en `recortes`.
+#   - correr_cancelable: corre el pipeline en la tarea del request y una tarea
+#     aparte revisa si el cliente se desconectó; en ese caso cancela la del
+#     request. La cancelación corta los requests HTTP que estén en vuelo y CLIPS
+#     se detiene en el próximo corte entre tramos. El pipeline sigue en la tarea
+#     del request para que el perfilado (profiling.py) lo vea entero.
+
+import asyncio
+import contextvars
+import time
+from typing import Awaitable, Callable, List, Optional
+
+HEADER = "x-deadline-ms"
+
+
+class PlazoVencido(Exception):
+    """Se agotó el plazo del request."""
+
+
+class ClienteDesconectado(Exception):
+    """El cliente cortó la conexión antes de la respuesta."""
+
+
+class Plazo:
+    """Vencimiento de un request (None = sin plazo) y etapas recortadas por él."""
+
+    def __init__(self, segundos: Optional[float] = None):
+        self.inicio = time.monotonic()
+        self.vence = self.inicio + segundos if segundos and segundos > 0 else None
+        self.desconectado = False
+        self.recortes: List[str] = []
+
+    def restante(self) -> Optional[float]:
+        """Segundos que quedan (None si no hay plazo)."""
+        if self.vence is None:
+            return None
+        return max(0.0, self.vence - time.monotonic())
+
+    @property
+    def vencido(self) -> bool:
+        return self.desconectado or (self.vence is not None and time.monotonic() >= self.vence)
+
+    def recortar(self, etapa: str):
+        if etapa not in self.recortes:
+            self.recortes.append(etapa)
+            print(f"DEBUG: Plazo agotado en '{etapa}' ({(time.monotonic() - self.inicio) * 1000:.0f}ms)")
+
+    async def esperar(self, awaitable: Awaitable):
+        """Espera a lo sumo el tiempo restante; si se agota cancela la operación y lanza PlazoVencido."""
+        if self.vencido:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise PlazoVencido()
+        restante = self.restante()
+        if restante is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, restante)
+        except asyncio.TimeoutError:
+            raise PlazoVencido()
+
+
+_plazo: contextvars.ContextVar[Optional[Plazo]] = contextvars.ContextVar("plazo", default=None)
+
+
+def plazo_actual() -> Optional[Plazo]:
+    """Plazo del request en curso (None fuera de un request con plazo)."""
+    return _plazo.get()
+
+
+def vencido() -> bool:
+    """True si el request en curso tiene plazo y se agotó."""
+    plazo = _plazo.get()
+    return plazo is not None and plazo.vencido
+
+
+async def dentro_del_plazo(awaitable: Awaitable):
+    """`await` con el plazo del request en curso (sin plazo espera lo que haga falta). Lanza PlazoVencido."""
+    plazo = _plazo.get()
+    if plazo is None:
+        return await awaitable
+    return await plazo.esperar(awaitable)
+
+
+def plazo_del_request(valor_header: Optional[str], defecto_ms: float) -> Plazo:
+    """Plazo a partir del header X-Deadline-Ms (ms); si falta o es inválido, el de la config (0 = sin plazo)."""
+    ms = defecto_ms
+    if valor_header:
+        try:
+            ms = float(valor_header)
+        except ValueError:
+            print(f"WARNING: {HEADER} inválido: {valor_header!r}")
+    return Plazo(ms / 1000 if ms and ms > 0 else None)
+
+
+async def correr_cancelable(
+    awaitable: Awaitable,
+    plazo: Plazo,
+    desconectado: Callable[[], Awaitable[bool]],
+    intervalo: float = 0.05,
+):
+    """
+    Espera `awaitable` en la tarea actual con `plazo` como plazo actual. Una
+    tarea vigía revisa cada `intervalo` segundos si el cliente se desconectó y
+    en ese caso cancela la tarea actual; la cancelación se convierte en
+    ClienteDesconectado.
+    """
+    principal = asyncio.current_task()
+
+    async def vigilar():
+        while not await desconectado():
+            await asyncio.sleep(intervalo)
+        plazo.desconectado = True
+        principal.cancel()
+
+    token = _plazo.set(plazo)
+    vigia = asyncio.ensure_future(vigilar())
+    try:
+        resultado = await awaitable
+    except asyncio.CancelledError:
+        if not plazo.desconectado:
+            raise  # cancelación de afuera, no del vigía
+        principal.uncancel()
+        raise ClienteDesconectado()
+    finally:
+        vigia.cancel()
+        _plazo.reset(token)
+    if plazo.desconectado and principal.cancelling():
+        # El pipeline absorbió la cancelación del vigía
+        principal.uncancel()
+        raise ClienteDesconectado()
+    return resultado
@@ -0,0 +1,101 @@
+# app/diversity.py
+# Re-ranking por diversidad (MMR) usando el slot `diversidad` del usuario.
+#
+# Después de puntuar, se eligen los primeros K resultados de forma golosa:
+# en cada paso se toma el restaurante que maximiza
+#     lambda * U - (1 - lambda) * max_sim(restaurante, ya elegidos)
+# donde la similitud es Jaccard sobre un bitset de cocinas, tipo_comida y
+# franja de precio. max_sim se mantiene incrementalmente (un popcount
+# vectorizado contra el último elegido por paso), así que el costo es O(K·N)
+# sobre un pool acotado de candidatos.
+
+from typing import Dict, List
+
+import numpy as np
+
+from .feature_store import Vocabulario, popcount
+
+# Peso de U frente a la similitud según `diversidad`
+LAMBDAS = {'baja': 1.0, 'media': 0.85, 'alta': 0.6}
+LAMBDA_DEFAULT = LAMBDAS['media']
+
+# Pool de candidatos a re-rankear: los mejores por U
+FACTOR_POOL = 3
+POOL_MIN_EXTRA = 10
+
+
+def lambda_diversidad(diversidad: str) -> float:
+    return LAMBDAS.get(diversidad, LAMBDA_DEFAULT)
+
+
+def tamano_pool(k: int) -> int:
+    """Cantidad de candidatos (por U) entre los que se eligen los K diversos."""
+    return max(k * FACTOR_POOL, k + POOL_MIN_EXTRA)
+
+
+def franja_precio(precio: float) -> str:
+    # Mismos cortes que _format_price_level en main
+    if precio <= 15000:
+        return "$"
+    if precio <= 25000:
+        return "$$"
+    return "$$$"
+
+
+def _tokens(r: Dict) -> List[str]:
+    tokens = [f"cocina:{c}" for c in dict.fromkeys(r.get('cocinas') or [])]
+    if r.get('tipo_comida'):
+        tokens.append(f"tipo:{r['tipo_comida']}")
+    if r.get('precio_pp') is not None:
+        tokens.append(f"precio:{franja_precio(r['precio_pp'])}")
+    return tokens
+
+
+def bitsets(restaurantes: List[Dict]) -> np.ndarray:
+    """Bitset (n, palabras) de cocinas + tipo_comida + franja de precio."""
+    vocab = Vocabulario()
+    tokens = [_tokens(r) for r in restaurantes]
+    for ts in tokens:
+        for t in ts:
+            vocab.bit(t)
+    return np.stack([vocab.codificar(ts, vocab.palabras) for ts in tokens]) if tokens else np.zeros((0, 1), dtype=np.uint64)
+
+
+def seleccionar_diversos(utilidades: np.ndarray, bits: np.ndarray, k: int, lam: float) -> List[int]:
+    """Índices de los K elegidos por MMR, en orden de elección."""
+    n = len(utilidades)
+    k = min(k, n)
+    if k == 0:
+        return []
+    if lam >= 1.0:
+        return list(np.argsort(-utilidades, kind='stable')[:k])
+    tamanos = popcount(bits)
+    max_sim = np.zeros(n)
+    disponible = np.ones(n, dtype=bool)
+    elegidos = []
+    for _ in range(k):
+        puntaje = np.where(disponible, lam * utilidades - (1 - lam) * max_sim, -np.inf)
+        i = int(np.argmax(puntaje))
+        elegidos.append(i)
+        disponible[i] = False
+        inter = popcount(bits & bits[i])
+        union = tamanos + tamanos[i] - inter
+        sim = np.where(union > 0, inter / np.maximum(union, 1), 0.0)
+        np.maximum(max_sim, sim, out=max_sim)
+    return elegidos
+
+
+def rerankear(recs: List[Dict], restaurantes: Dict[str, Dict], k: int, diversidad: str) -> List[Dict]:
+    """
+    Reordena los primeros K de `recs` (ordenados por U) por MMR, eligiendo entre
+    los mejores tamano_pool(K). El resto queda después, en el orden original.
+    `restaurantes` mapea id -> datos del restaurante (cocinas, tipo_comida, precio_pp).
+    """
+    lam = lambda_diversidad(diversidad)
+    if lam >= 1.0 or len(recs) <= 1 or k <= 0:
+        return recs
+    pool = recs[:tamano_pool(k)]
+    bits = bitsets([restaurantes.get(r['id'], {}) for r in pool])
+    elegidos = seleccionar_diversos(np.array([r['U'] for r in pool], dtype=float), bits, k, lam)
+    resto = set(elegidos)
+    return [pool[i] for i in elegidos] + [r for i, r in enumerate(pool) if i not in resto] + recs[len(pool):]
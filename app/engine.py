@@ -4,6 +4,9 @@
 # pip install clipspy
 from clips import Environment, Symbol
 
+# Límite de disparos de reglas por recomendación
+MAX_PASOS = 10000
+
 class ClipsRecommender:
     def __init__(self, clp_path: str):
         self.clp_path = clp_path
@@ -59,38 +62,37 @@ class ClipsRecommender:
         return fact
 
     def run(self, max_steps: int = 0):
-        # 0 means no limit
+        # 0 means no limit. Returns the number of rules fired
         return self.env.run(max_steps)
 
     def get_recommendations(self):
-        # Read acum + restaurante to return id, nombre, U, justifs
-        # First, get all discarded restaurants
+        # Read acum + restaurante to return id, nombre, U (only numeric scores;
+        # explanations are computed on demand, see scoring.explicar)
         discarded = set()
+        nombres = {}
+        acums = []
         for f in self.env.facts():
-            if f.template.name == "descartar":
+            name = f.template.name
+            if name == "descartar":
                 discarded.add(str(f["rest"]))
-        
+            elif name == "restaurante":
+                nombres[str(f["id"])] = str(f["nombre"])
+            elif name == "acum":
+                acums.append(f)
+
         recs = []
-        for f in self.env.facts():
-            if f.template.name == "acum":
-                rest_id = str(f["rest"])
-                # Skip if restaurant is discarded
-                if rest_id in discarded:
-                    continue
-                U = float(f["U"])
-                justifs = list(f["justifs"])
-                # find restaurant name
-                nombre = rest_id
-                for g in self.env.facts():
-                    if g.template.name == "restaurante" and str(g["id"]) == rest_id:
-                        nombre = str(g["nombre"])
-                        break
-                recs.append({"id": rest_id, "nombre": nombre, "U": U, "justifs": justifs})
+        for f in acums:
+            rest_id = str(f["rest"])
+            # Skip if restaurant is discarded
+            if rest_id in discarded:
+                continue
+            recs.append({"id": rest_id, "nombre": nombres.get(rest_id, rest_id), "U": float(f["U"])})
         # sort by U desc
         recs.sort(key=lambda x: x["U"], reverse=True)
         return recs
 
-    def recommend(self, usuario: dict, contexto: dict, restaurantes: list = None):
+    def preparar(self, usuario: dict, contexto: dict, restaurantes: list = None):
+        """reset y aserción de los hechos del request (antes de run)."""
         self.reset_env()
         print(f"DEBUG: Usuario recibido: {usuario}")
         print(f"DEBUG: Contexto recibido: {contexto}")
@@ -108,8 +110,8 @@ class ClipsRecommender:
         for f in self.env.facts():
             print(f"  {f}")
 
-        self.run(max_steps=10000) # Aumentar el límite de disparos de reglas
-
+    def resultados(self):
+        """Recomendaciones del estado actual del entorno (después de run)."""
         print("DEBUG: Hechos en el entorno CLIPS después de run:")
         for f in self.env.facts():
             print(f"  {f}")
@@ -117,3 +119,8 @@ class ClipsRecommender:
         recs = self.get_recommendations()
         print(f"DEBUG: Recomendaciones generadas: {recs}")
         return recs
+
+    def recommend(self, usuario: dict, contexto: dict, restaurantes: list = None):
+        self.preparar(usuario, contexto, restaurantes)
+        self.run(max_steps=MAX_PASOS) # Aumentar el límite de disparos de reglas
+        return self.resultados()
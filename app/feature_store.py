@@ -0,0 +1,410 @@
+# app/feature_store.py
+# Feature store por restaurante, construido al cargar el catálogo.
+#
+# Guarda en arrays columnares las features estáticas de cada restaurante (las que
+# no dependen del request) y las cocinas/atributos como bitsets sobre un
+# vocabulario global. Así la afinidad de Jaccard entre las cocinas favoritas del
+# usuario y las del restaurante es aritmética de popcount, vectorizada sobre todo
+# el catálogo, en lugar de recorrer listas en Python o con member$ en CLIPS.
+#
+# También guarda las columnas que usan los filtros del request (rating, tiempo
+# de espera, horarios y códigos de tipo_comida, reserva y estacionamiento_propio)
+# para combinarlos en una sola máscara booleana y materializar como dict solo
+# los restaurantes que la pasan.
+#
+# Se mantiene incrementalmente como listener del CatalogStore.
+
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .catalog import CatalogListener
+
+BITS_POR_PALABRA = 64
+
+if hasattr(np, "bitwise_count"):
+    def popcount(x: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(x).sum(axis=-1, dtype=np.int64)
+else:  # numpy < 2.0
+    def popcount(x: np.ndarray) -> np.ndarray:
+        bytes_ = x.view(np.uint8).reshape(x.shape[:-1] + (-1,))
+        return np.unpackbits(bytes_, axis=-1).sum(axis=-1, dtype=np.int64)
+
+
+def calidad_estatica(rating: float, n_resenas: float) -> float:
+    """Mismo criterio que puntuar-calidad / agregar-calidad en el .clp."""
+    if rating is None or n_resenas is None or rating < 3.5 or n_resenas < 10:
+        return 0.0
+    return (rating / 5.0) * float(np.sqrt(min(1.0, n_resenas / 200.0)))
+
+
+# puntuar-disponibilidad (solo en franja cena) y penalizar-sin-estacionamiento (solo en auto o moto)
+DISP_CON_RESERVA, DISP_SIN_RESERVA = 1.0, 0.3
+PENALIZACION_ESTACIONAMIENTO = 0.15
+
+
+def disponibilidad_cena(reserva: Optional[str]) -> float:
+    return DISP_CON_RESERVA if reserva == 'si' else DISP_SIN_RESERVA
+
+
+def penalizacion_estacionamiento(estacionamiento_propio: Optional[str]) -> float:
+    return 0.0 if estacionamiento_propio == 'si' else PENALIZACION_ESTACIONAMIENTO
+
+
+class Vocabulario:
+    """Asigna un bit a cada valor (cocina o atributo) visto en el catálogo."""
+
+    def __init__(self):
+        self.indices: Dict[str, int] = {}
+
+    def bit(self, valor: str) -> int:
+        if valor not in self.indices:
+            self.indices[valor] = len(self.indices)
+        return self.indices[valor]
+
+    @property
+    def palabras(self) -> int:
+        return max(1, (len(self.indices) + BITS_POR_PALABRA - 1) // BITS_POR_PALABRA)
+
+    def codificar(self, valores: Iterable[str], palabras: int, agregar: bool = False) -> np.ndarray:
+        """Bitset de los valores. Los desconocidos se ignoran salvo con agregar=True."""
+        bits = np.zeros(palabras, dtype=np.uint64)
+        for v in valores or []:
+            if agregar:
+                i = self.bit(v)
+            else:
+                i = self.indices.get(v)
+                if i is None:
+                    continue
+            bits[i // BITS_POR_PALABRA] |= np.uint64(1) << np.uint64(i % BITS_POR_PALABRA)
+        return bits
+
+
+CAMPOS_CATEGORICOS = ('tipo_comida', 'reserva', 'estacionamiento_propio')
+
+
+class Categorias:
+    """Código entero por valor de un campo categórico (0 = sin valor)."""
+
+    def __init__(self):
+        self.codigos: Dict[str, int] = {}
+
+    def codigo(self, valor: Optional[str], agregar: bool = False) -> int:
+        """Los valores desconocidos dan -1 (no coinciden con ninguna fila) salvo con agregar=True."""
+        if valor is None:
+            return 0
+        c = self.codigos.get(valor)
+        if c is None:
+            if not agregar:
+                return -1
+            c = self.codigos[valor] = len(self.codigos) + 1
+        return c
+
+
+def minutos_hhmm(hora: str) -> Optional[int]:
+    """Minutos desde medianoche de un "HH:MM" (None si no se puede leer)."""
+    try:
+        partes = hora.split(':')
+        return int(partes[0]) * 60 + int(partes[1])
+    except Exception:
+        return None
+
+
+def _columnas_filtro(r: Dict) -> tuple:
+    """rating, tiempo_espera, con_horario, apertura, cierre, abierto_fijo de un restaurante."""
+    apertura = cierre = None
+    if r.get('horario_apertura') and r.get('horario_cierre'):
+        apertura, cierre = minutos_hhmm(r['horario_apertura']), minutos_hhmm(r['horario_cierre'])
+        # Horario ilegible: verificar_horario_abierto lo da por abierto
+        abierto_fijo = apertura is None or cierre is None
+    else:
+        abierto_fijo = r.get('abierto') == 'si'
+    con_horario = apertura is not None and cierre is not None
+    tiempo_espera = r.get('tiempo_espera')
+    return (
+        float(r.get('rating') or 0.0),
+        np.nan if tiempo_espera is None else float(tiempo_espera),
+        con_horario,
+        apertura if con_horario else -1,
+        cierre if con_horario else -1,
+        abierto_fijo,
+    )
+
+
+def columnas_filtro(restaurantes: List[Dict], categorias: Dict[str, Categorias]) -> Dict[str, np.ndarray]:
+    """Columnas de filtro de una lista de restaurantes (los que vienen en el request)."""
+    valores = [_columnas_filtro(r) for r in restaurantes]
+    rating, tiempo_espera, con_horario, apertura, cierre, abierto_fijo = (
+        zip(*valores) if valores else ((),) * 6)
+    cols = {
+        'rating': np.array(rating, dtype=float),
+        'tiempo_espera': np.array(tiempo_espera, dtype=float),
+        'con_horario': np.array(con_horario, dtype=bool),
+        'apertura': np.array(apertura, dtype=np.int64),
+        'cierre': np.array(cierre, dtype=np.int64),
+        'abierto_fijo': np.array(abierto_fijo, dtype=bool),
+    }
+    for campo in CAMPOS_CATEGORICOS:
+        cols[campo] = np.array([categorias[campo].codigo(r.get(campo), agregar=True) for r in restaurantes],
+                               dtype=np.int32)
+    return cols
+
+
+def abiertos(cols: Dict[str, np.ndarray], minuto_actual: int) -> np.ndarray:
+    """verificar_horario_abierto vectorizado; sin horarios vale el campo abierto."""
+    apertura, cierre = cols['apertura'], cols['cierre']
+    normal = (apertura <= minuto_actual) & (minuto_actual < cierre)
+    cruza_medianoche = (minuto_actual >= apertura) | (minuto_actual < cierre)
+    en_horario = np.where(cierre < apertura, cruza_medianoche, normal)
+    return np.where(cols['con_horario'], en_horario, cols['abierto_fijo'])
+
+
+def mascara_filtros(
+    usuario: Dict,
+    cols: Dict[str, np.ndarray],
+    categorias: Dict[str, Categorias],
+    abierto: np.ndarray,
+) -> np.ndarray:
+    """
+    Filtros del request (rating_minimo, solo_abiertos, tiempo_espera_max,
+    tipo_comida_preferido, estacionamiento_requerido) en una sola máscara.
+    Incluye también el filtro de requiere_reserva del .clp: CLIPS los
+    descartaría igual, así no se materializan.
+    """
+    mascara = np.ones(len(abierto), dtype=bool)
+    if usuario.get('rating_minimo') is not None:
+        mascara &= cols['rating'] >= float(usuario['rating_minimo'])
+    if usuario.get('solo_abiertos') == 'si':
+        mascara &= abierto
+    if usuario.get('tiempo_espera_max') is not None:
+        # Sin tiempo de espera (NaN) no se filtra
+        mascara &= ~(cols['tiempo_espera'] > float(usuario['tiempo_espera_max']))
+    if usuario.get('tipo_comida_preferido'):
+        mascara &= cols['tipo_comida'] == categorias['tipo_comida'].codigo(usuario['tipo_comida_preferido'])
+    estacionamiento_si = categorias['estacionamiento_propio'].codigo('si')
+    if usuario.get('estacionamiento_requerido') == 'si':
+        mascara &= cols['estacionamiento_propio'] == estacionamiento_si
+    elif usuario.get('estacionamiento_requerido') == 'no':
+        mascara &= cols['estacionamiento_propio'] != estacionamiento_si
+    reserva_si = categorias['reserva'].codigo('si')
+    if usuario.get('requiere_reserva') == 'si':
+        mascara &= cols['reserva'] == reserva_si
+    elif usuario.get('requiere_reserva') == 'no':
+        mascara &= cols['reserva'] != reserva_si
+    return mascara
+
+
+# Columnas por fila del store (se agrandan, compactan y mueven juntas)
+COLUMNAS = ('rating_norm', 'calidad', 'precio_pp', 'n_cocinas', 'cocinas_bits', 'atributos_bits', 'orden',
+            'rating', 'tiempo_espera', 'con_horario', 'apertura', 'cierre', 'abierto_fijo',
+            'latitud', 'longitud', 'disp_cena', 'penalizacion_estacionamiento') + CAMPOS_CATEGORICOS
+
+
+class FeatureStore(CatalogListener):
+    """Arrays columnares de features estáticas por restaurante + bitsets."""
+
+    def __init__(self, capacidad_inicial: int = 64):
+        self._lock = threading.RLock()
+        self.cocinas = Vocabulario()
+        self.atributos = Vocabulario()
+        self.categorias = {campo: Categorias() for campo in CAMPOS_CATEGORICOS}
+        self._reiniciar(capacidad_inicial)
+
+    def _reiniciar(self, capacidad: int):
+        self.ids: List[str] = []
+        self.fila: Dict[str, int] = {}
+        self.rating_norm = np.zeros(capacidad)    # (rating - 1) / 4, como extract_features
+        self.calidad = np.zeros(capacidad)        # término de calidad del .clp
+        self.precio_pp = np.zeros(capacidad)
+        self.n_cocinas = np.zeros(capacidad, dtype=np.int64)
+        self.cocinas_bits = np.zeros((capacidad, self.cocinas.palabras), dtype=np.uint64)
+        self.atributos_bits = np.zeros((capacidad, self.atributos.palabras), dtype=np.uint64)
+        # Posición en el catálogo: las bajas mueven filas, los filtros devuelven en este orden
+        self.orden = np.zeros(capacidad, dtype=np.int64)
+        self._siguiente_orden = 0
+        # Columnas de los filtros del request
+        self.rating = np.zeros(capacidad)
+        self.tiempo_espera = np.full(capacidad, np.nan)
+        self.con_horario = np.zeros(capacidad, dtype=bool)
+        self.apertura = np.full(capacidad, -1, dtype=np.int64)
+        self.cierre = np.full(capacidad, -1, dtype=np.int64)
+        self.abierto_fijo = np.zeros(capacidad, dtype=bool)
+        # Coordenadas (NaN si faltan), para armar el índice espacial sin leer los registros
+        self.latitud = np.full(capacidad, np.nan)
+        self.longitud = np.full(capacidad, np.nan)
+        # Términos del .clp que no dependen del usuario (ver context_table.py)
+        self.disp_cena = np.zeros(capacidad)
+        self.penalizacion_estacionamiento = np.zeros(capacidad)
+        for campo in CAMPOS_CATEGORICOS:
+            setattr(self, campo, np.zeros(capacidad, dtype=np.int32))
+
+    @property
+    def n(self) -> int:
+        return len(self.ids)
+
+    # ---------- Mantenimiento ----------
+    def _asegurar_capacidad(self, filas: int):
+        cap = len(self.rating_norm)
+        if filas > cap:
+            nueva = max(filas, cap * 2)
+            for nombre in COLUMNAS:
+                viejo = getattr(self, nombre)
+                arr = np.zeros((nueva,) + viejo.shape[1:], dtype=viejo.dtype)
+                arr[:cap] = viejo
+                setattr(self, nombre, arr)
+        # Ensanchar los bitsets si el vocabulario creció
+        for nombre, vocab in (('cocinas_bits', self.cocinas), ('atributos_bits', self.atributos)):
+            viejo = getattr(self, nombre)
+            if vocab.palabras > viejo.shape[1]:
+                arr = np.zeros((viejo.shape[0], vocab.palabras), dtype=np.uint64)
+                arr[:, :viejo.shape[1]] = viejo
+                setattr(self, nombre, arr)
+
+    def _escribir_fila(self, i: int, r: Dict):
+        cocinas = list(dict.fromkeys(r.get('cocinas') or []))
+        for c in cocinas:
+            self.cocinas.bit(c)
+        for a in r.get('atributos') or []:
+            self.atributos.bit(a)
+        self._asegurar_capacidad(i + 1)
+        rating = r.get('rating')
+        self.rating_norm[i] = (rating - 1) / 4 if rating else 0.0
+        self.calidad[i] = calidad_estatica(rating, r.get('n_resenas'))
+        self.precio_pp[i] = r.get('precio_pp') or 0.0
+        self.n_cocinas[i] = len(cocinas)
+        self.cocinas_bits[i] = self.cocinas.codificar(cocinas, self.cocinas_bits.shape[1])
+        self.atributos_bits[i] = self.atributos.codificar(r.get('atributos'), self.atributos_bits.shape[1])
+        (self.rating[i], self.tiempo_espera[i], self.con_horario[i],
+         self.apertura[i], self.cierre[i], self.abierto_fijo[i]) = _columnas_filtro(r)
+        self.latitud[i] = r.get('latitud') or np.nan
+        self.longitud[i] = r.get('longitud') or np.nan
+        self.disp_cena[i] = disponibilidad_cena(r.get('reserva'))
+        self.penalizacion_estacionamiento[i] = penalizacion_estacionamiento(r.get('estacionamiento_propio'))
+        for campo in CAMPOS_CATEGORICOS:
+            getattr(self, campo)[i] = self.categorias[campo].codigo(r.get(campo), agregar=True)
+
+    def al_reiniciar(self, restaurantes: List[Dict]):
+        with self._lock:
+            self._reiniciar(max(64, len(restaurantes)))
+            for r in restaurantes:
+                self.al_actualizar(r)
+
+    def al_actualizar(self, restaurante: Dict):
+        with self._lock:
+            rest_id = restaurante['id']
+            i = self.fila.get(rest_id)
+            if i is None:
+                i = len(self.ids)
+                self.ids.append(rest_id)
+                self.fila[rest_id] = i
+                self._escribir_fila(i, restaurante)
+                self.orden[i] = self._siguiente_orden
+                self._siguiente_orden += 1
+            else:
+                self._escribir_fila(i, restaurante)
+
+    def al_eliminar(self, rest_id: str):
+        # Se mueve la última fila al hueco para mantener los arrays compactos
+        with self._lock:
+            i = self.fila.pop(rest_id, None)
+            if i is None:
+                return
+            ultimo = len(self.ids) - 1
+            if i != ultimo:
+                id_ultimo = self.ids[ultimo]
+                for nombre in COLUMNAS:
+                    arr = getattr(self, nombre)
+                    arr[i] = arr[ultimo]
+                self.ids[i] = id_ultimo
+                self.fila[id_ultimo] = i
+            self.ids.pop()
+
+    # ---------- Publicación ----------
+    def exportar(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Copia de las columnas (solo las filas usadas) y metadata (ids, vocabularios, categorías)."""
+        with self._lock:
+            n = self.n
+            arrays = {nombre: getattr(self, nombre)[:n].copy() for nombre in COLUMNAS}
+            meta = {
+                'ids': list(self.ids),
+                'cocinas': dict(self.cocinas.indices),
+                'atributos': dict(self.atributos.indices),
+                'categorias': {campo: dict(c.codigos) for campo, c in self.categorias.items()},
+                'siguiente_orden': self._siguiente_orden,
+            }
+            return arrays, meta
+
+    @classmethod
+    def desde_exportado(cls, arrays: Dict[str, np.ndarray], meta: Dict) -> 'FeatureStore':
+        """
+        Store de solo lectura sobre columnas ya armadas (por ejemplo vistas de
+        un archivo mapeado en memoria): no copia los arrays y no se suscribe.
+        """
+        store = cls.__new__(cls)
+        store._lock = threading.RLock()
+        store.cocinas = Vocabulario()
+        store.cocinas.indices = dict(meta['cocinas'])
+        store.atributos = Vocabulario()
+        store.atributos.indices = dict(meta['atributos'])
+        store.categorias = {}
+        for campo in CAMPOS_CATEGORICOS:
+            store.categorias[campo] = Categorias()
+            store.categorias[campo].codigos = dict(meta['categorias'][campo])
+        store.ids = list(meta['ids'])
+        store.fila = {rest_id: i for i, rest_id in enumerate(store.ids)}
+        store._siguiente_orden = meta['siguiente_orden']
+        for nombre in COLUMNAS:
+            setattr(store, nombre, arrays[nombre])
+        return store
+
+    # ---------- Consultas ----------
+    def filas(self, rest_ids: Iterable[str]) -> np.ndarray:
+        """Índice de fila por id (-1 si el restaurante no está en el store)."""
+        return np.array([self.fila.get(i, -1) for i in rest_ids], dtype=np.int64)
+
+    def afinidad(self, cocinas_favoritas: List[str], filas: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Jaccard entre las cocinas favoritas y las de cada restaurante, vía popcount:
+        |fav ∩ c| / (|fav| + |c| - |fav ∩ c|). Las favoritas que no aparecen en el
+        catálogo no suman a la intersección pero sí a la unión.
+        Devuelve NaN para las filas -1 (restaurantes fuera del store).
+        """
+        with self._lock:
+            if filas is None:
+                filas = np.arange(self.n)
+            favoritas = list(dict.fromkeys(cocinas_favoritas or []))
+            fav_bits = self.cocinas.codificar(favoritas, self.cocinas_bits.shape[1])
+            inter = popcount(self.cocinas_bits[filas] & fav_bits)
+            union = len(favoritas) + self.n_cocinas[filas] - inter
+            afinidad = np.where(union > 0, inter / np.maximum(union, 1), 0.0)
+            afinidad[filas < 0] = np.nan
+            return afinidad
+
+    def filtrar(self, usuario: Dict, minuto_actual: int, filas: Optional[np.ndarray] = None):
+        """
+        Aplica los filtros del request a todo el catálogo (o solo a `filas`,
+        por ejemplo las del índice espacial) con una máscara.
+        Devuelve (ids, abierto) de los que pasan, en el orden del catálogo;
+        abierto es el estado actual según horarios.
+        """
+        with self._lock:
+            if filas is None:
+                n = self.n
+                cols = {nombre: getattr(self, nombre)[:n] for nombre in COLUMNAS}
+            else:
+                filas = filas[filas >= 0]
+                cols = {nombre: getattr(self, nombre)[filas] for nombre in COLUMNAS}
+            abierto = abiertos(cols, minuto_actual)
+            pasan = np.flatnonzero(mascara_filtros(usuario, cols, self.categorias, abierto))
+            pasan = pasan[np.argsort(cols['orden'][pasan], kind='stable')]
+            elegidas = pasan if filas is None else filas[pasan]
+            return [self.ids[i] for i in elegidas], abierto[pasan]
+
+    def estaticas(self, rest_id: str) -> Optional[Dict[str, float]]:
+        """Features estáticas de un restaurante (None si no está en el store)."""
+        with self._lock:
+            i = self.fila.get(rest_id)
+            if i is None:
+                return None
+            return {'rating_norm': float(self.rating_norm[i]), 'calidad': float(self.calidad[i])}
@@ -0,0 +1,370 @@
+# app/feedback_log.py
+# Log append-only de feedbacks en segmentos JSONL.
+#
+# Reemplaza la reescritura completa de user_feedback_history.json en cada feedback:
+# - Cada feedback es una línea JSON agregada al segmento activo (costo O(1),
+#   no crece con el tamaño del historial).
+# - Cuando el segmento activo supera `max_bytes` se rota a uno nuevo.
+# - Un hilo en segundo plano compacta los segmentos cerrados en un .jsonl.gz.
+# - El contador de feedbacks se mantiene en memoria (no hay que releer el historial).
+# - leer_registros() recorre el log en streaming, para reentrenar sin cargarlo entero.
+#
+# Con varios workers de uvicorn cada proceso escribe en su propio segmento: el
+# número se reserva creando el archivo en exclusiva (el siguiente al mayor
+# existente) y el proceso le mantiene un flock mientras es su segmento activo.
+# Cada registro lleva `_seg` (su segmento) y `_seq` (su posición en el
+# segmento), que lo identifican aunque después se compacte. La compactación
+# solo junta segmentos sin flock (cerrados, o de un proceso que murió): los
+# elige con el lock del directorio tomado, el mismo con el que se reservan y
+# bloquean los segmentos nuevos, y un segundo lock evita que dos procesos
+# compacten a la vez. Sin flock (Windows) cada proceso compacta solo los
+# segmentos que cerró él.
+#
+# Nombres de archivo:
+#   segment-000007.jsonl             segmento plano (activo si un proceso lo tiene bloqueado)
+#   segment-000001-000006.jsonl.gz   segmentos 1 a 6 compactados
+#   conteos.json                     cantidad de registros de cada .jsonl.gz
+#   log.lock                         lock del directorio (reserva de segmentos, elección de los cerrados)
+#   compactacion.lock                un solo proceso compacta a la vez
+
+import contextlib
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock no se distingue el segmento activo de otro proceso
+    fcntl = None
+
+FSYNC_SIEMPRE = "always"
+FSYNC_INTERVALO = "interval"
+FSYNC_NUNCA = "never"
+
+_PATRON = re.compile(r"^segment-(\d{6})(?:-(\d{6}))?\.jsonl(\.gz)?$")
+CONTEOS = "conteos.json"
+LOCK_DIRECTORIO = "log.lock"
+LOCK_COMPACTACION = "compactacion.lock"
+
+
+def _listar_segmentos(directorio: Path) -> List[Tuple[int, int, Path]]:
+    """(primer segmento, último segmento, path) ordenados por número de segmento."""
+    if not directorio.exists():
+        return []
+    segmentos = []
+    for p in directorio.iterdir():
+        m = _PATRON.match(p.name)
+        if m:
+            desde = int(m.group(1))
+            hasta = int(m.group(2)) if m.group(2) else desde
+            segmentos.append((desde, hasta, p))
+    segmentos.sort()
+    return segmentos
+
+
+def _abrir(path: Path):
+    if path.name.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def _leer_lineas(path: Path) -> Iterator[Dict]:
+    # Líneas truncadas (ej. la última del segmento activo a mitad de escritura) se ignoran
+    with _abrir(path) as f:
+        for linea in f:
+            try:
+                yield json.loads(linea)
+            except ValueError:
+                continue
+
+
+def leer_registros(directorio: Path) -> Iterator[Dict]:
+    """
+    Recorre todos los feedbacks del log en orden de segmento, en streaming.
+    Tolera una compactación concurrente: si un segmento desaparece se vuelve a
+    listar el directorio y se saltean los registros ya leídos, por (_seg, _seq).
+    Los registros de antes de `_seg` tienen un `_seq` global y se saltean por él.
+    """
+    directorio = Path(directorio)
+    leidos: Dict[int, int] = {}  # segmento -> último _seq leído
+    ultimo_seq_global = 0
+    ultimo_segmento = 0
+    while True:
+        siguiente = next(
+            ((d, h, p) for d, h, p in _listar_segmentos(directorio) if h > ultimo_segmento),
+            None,
+        )
+        if siguiente is None:
+            return
+        _, hasta, path = siguiente
+        try:
+            for registro in _leer_lineas(path):
+                seq = registro.get('_seq', 0)
+                seg = registro.get('_seg')
+                if seg is None:
+                    if seq and seq <= ultimo_seq_global:
+                        continue
+                    ultimo_seq_global = max(ultimo_seq_global, seq)
+                else:
+                    if seq <= leidos.get(seg, 0):
+                        continue
+                    leidos[seg] = seq
+                yield registro
+        except FileNotFoundError:
+            continue  # Lo compactaron mientras tanto: se relista
+        ultimo_segmento = hasta
+
+
+class FeedbackLog:
+    """Log append-only de feedbacks con rotación, compactación y contador en memoria."""
+
+    def __init__(
+        self,
+        directorio: Path,
+        fsync: str = FSYNC_INTERVALO,
+        fsync_intervalo: float = 1.0,
+        max_bytes: int = 8 * 1024 * 1024,
+        compactar_desde: int = 4,
+        legacy_file: Optional[Path] = None,
+    ):
+        if fsync not in (FSYNC_SIEMPRE, FSYNC_INTERVALO, FSYNC_NUNCA):
+            raise ValueError(f"política de fsync inválida: {fsync}")
+        self.directorio = Path(directorio)
+        self.fsync = fsync
+        self.fsync_intervalo = fsync_intervalo
+        self.max_bytes = max_bytes
+        self.compactar_desde = compactar_desde
+        self._lock = threading.Lock()
+        self._lock_compactacion = threading.Lock()
+        self._ultimo_fsync = time.monotonic()
+        self._cerrados = set()  # segmentos que cerró este proceso (sin flock son los únicos que compacta)
+
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        with self._lock_directorio():
+            segmentos = _listar_segmentos(self.directorio)
+            migrar = not segmentos and legacy_file is not None and Path(legacy_file).exists()
+            self._total = self._contar(segmentos)
+            self._abrir_segmento_nuevo()
+            if migrar:
+                self._migrar_legacy(Path(legacy_file))
+
+    # ---------- Estado ----------
+    @property
+    def total(self) -> int:
+        """Feedbacks que había en el log al abrirlo más los que agregó este proceso (O(1))."""
+        return self._total
+
+    @contextlib.contextmanager
+    def _flock(self, nombre: str, bloquear: bool = True):
+        """Lock entre procesos sobre `nombre` en el directorio. Sin bloquear, da False si lo tiene otro."""
+        if fcntl is None:
+            yield True
+            return
+        fd = os.open(self.directorio / nombre, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if bloquear else fcntl.LOCK_NB))
+            except OSError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    def _lock_directorio(self):
+        """Lock entre procesos para reservar segmentos y elegir qué compactar."""
+        return self._flock(LOCK_DIRECTORIO)
+
+    def _abrir_segmento_nuevo(self):
+        """
+        Reserva el segmento siguiente al mayor existente creándolo en exclusiva y
+        lo bloquea mientras sea el activo de este proceso. Se llama con el lock
+        del directorio tomado, así la compactación no lo ve sin bloquear.
+        """
+        while True:
+            numero = max((h for _, h, _ in _listar_segmentos(self.directorio)), default=0) + 1
+            path = self.directorio / f"segment-{numero:06d}.jsonl"
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+                break
+            except FileExistsError:
+                continue
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        self._segmento = numero
+        self._seq = 0
+        self._archivo = os.fdopen(fd, 'a', encoding='utf-8')
+
+    def _conteos(self) -> Dict[str, int]:
+        try:
+            with open(self.directorio / CONTEOS, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _contar(self, segmentos) -> int:
+        # Los planos se cuentan por líneas; los .gz por conteos.json (o leyéndolos si no figuran)
+        conteos = self._conteos()
+        total = 0
+        for _, _, path in segmentos:
+            if not path.name.endswith('.gz'):
+                with open(path, 'rb') as f:
+                    total += sum(bloque.count(b"\n") for bloque in iter(lambda: f.read(1 << 20), b""))
+            elif path.name in conteos:
+                total += conteos[path.name]
+            else:
+                total += sum(1 for _ in _leer_lineas(path))
+        return total
+
+    def _migrar_legacy(self, legacy_file: Path):
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                feedbacks = json.load(f).get('feedbacks', [])
+        except Exception as e:
+            print(f"Error migrando historial {legacy_file}: {e}")
+            return
+        self.append_many(feedbacks)
+        print(f"Historial migrado: {len(feedbacks)} feedbacks desde {legacy_file}")
+
+    # ---------- Escritura ----------
+    def append(self, registro: Dict) -> int:
+        """Agrega un feedback. Devuelve el total de feedbacks."""
+        return self.append_many([registro])
+
+    def append_many(self, registros: Iterable[Dict]) -> int:
+        """Agrega varios feedbacks con una sola escritura. Devuelve el total de feedbacks."""
+        with self._lock:
+            lineas = []
+            for registro in registros:
+                self._total += 1
+                self._seq += 1
+                registro = dict(registro)
+                registro['_seg'] = self._segmento
+                registro['_seq'] = self._seq
+                lineas.append(json.dumps(registro, ensure_ascii=False) + "\n")
+            if lineas:
+                self._archivo.write("".join(lineas))
+                self._archivo.flush()
+                self._aplicar_fsync()
+                if self._archivo.tell() >= self.max_bytes:
+                    self._rotar()
+            return self._total
+
+    def _aplicar_fsync(self):
+        if self.fsync == FSYNC_SIEMPRE:
+            os.fsync(self._archivo.fileno())
+        elif self.fsync == FSYNC_INTERVALO:
+            ahora = time.monotonic()
+            if ahora - self._ultimo_fsync >= self.fsync_intervalo:
+                os.fsync(self._archivo.fileno())
+                self._ultimo_fsync = ahora
+
+    def _rotar(self):
+        if self.fsync != FSYNC_NUNCA:
+            os.fsync(self._archivo.fileno())
+        self._archivo.close()  # libera el flock: el segmento queda cerrado
+        self._cerrados.add(self._segmento)
+        with self._lock_directorio():
+            self._abrir_segmento_nuevo()
+        threading.Thread(target=self.compactar, daemon=True).start()
+
+    def flush(self):
+        with self._lock:
+            self._archivo.flush()
+            if self.fsync != FSYNC_NUNCA:
+                os.fsync(self._archivo.fileno())
+
+    def close(self):
+        with self._lock:
+            self._archivo.flush()
+            if self.fsync != FSYNC_NUNCA:
+                os.fsync(self._archivo.fileno())
+            if self._seq == 0:
+                # Segmento sin registros: se borra antes de soltar el flock
+                with self._lock_directorio():
+                    (self.directorio / f"segment-{self._segmento:06d}.jsonl").unlink(missing_ok=True)
+                    self._archivo.close()
+            else:
+                self._archivo.close()
+                self._cerrados.add(self._segmento)
+
+    # ---------- Compactación ----------
+    def _cerrado(self, path: Path, hasta: int) -> bool:
+        """True si ningún proceso tiene el segmento plano como activo."""
+        if fcntl is None:
+            return hasta in self._cerrados
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+
+    def _elegir_compactables(self) -> List[Tuple[int, int, Path]]:
+        """Primera racha de segmentos planos cerrados y consecutivos en el listado, con al menos compactar_desde."""
+        racha = []
+        for d, h, p in _listar_segmentos(self.directorio):
+            if not p.name.endswith('.gz') and self._cerrado(p, h):
+                racha.append((d, h, p))
+                continue
+            if len(racha) >= self.compactar_desde:
+                return racha
+            racha = []
+        return racha if len(racha) >= self.compactar_desde else []
+
+    def compactar(self):
+        """
+        Junta segmentos planos cerrados y consecutivos en un único .jsonl.gz
+        (descartando líneas corruptas). Se ejecuta en segundo plano después de
+        cada rotación. Los segmentos activos de otros procesos no se tocan.
+        """
+        with self._lock_compactacion, self._flock(LOCK_COMPACTACION, bloquear=False) as tomado:
+            if not tomado:
+                return  # otro proceso está compactando
+            # Un segmento cerrado no se vuelve a abrir: alcanza con elegirlos con el lock del directorio
+            with self._lock_directorio():
+                cerrados = self._elegir_compactables()
+            if not cerrados:
+                return
+            desde, hasta = cerrados[0][0], cerrados[-1][1]
+            destino = self.directorio / f"segment-{desde:06d}-{hasta:06d}.jsonl.gz"
+            tmp = destino.with_name(destino.name + ".tmp")
+            try:
+                cantidad = 0
+                with gzip.open(tmp, 'wt', encoding='utf-8') as out:
+                    for _, _, path in cerrados:
+                        for registro in _leer_lineas(path):
+                            out.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                            cantidad += 1
+                conteos = self._conteos()
+                conteos[destino.name] = cantidad
+                for _, _, path in cerrados:
+                    conteos.pop(path.name, None)
+                tmp_conteos = self.directorio / (CONTEOS + ".tmp")
+                with open(tmp_conteos, 'w', encoding='utf-8') as f:
+                    json.dump(conteos, f)
+                os.replace(tmp, destino)
+                os.replace(tmp_conteos, self.directorio / CONTEOS)
+                for _, _, path in cerrados:
+                    path.unlink()
+                print(f"Feedback log compactado: segmentos {desde}-{hasta} -> {destino.name}")
+            except Exception as e:
+                print(f"Error compactando feedback log: {e}")
+                if tmp.exists():
+                    tmp.unlink()
+
+    # ---------- Lectura ----------
+    def leer(self) -> Iterator[Dict]:
+        """Recorre el log en streaming (ver leer_registros)."""
+        self.flush()
+        return leer_registros(self.directorio)
@@ -0,0 +1,263 @@
+# app/feedback_queue.py
+# Cola de ingesta de feedback con entrenamiento por micro-batches.
+#
+# /api/feedback solo encola y responde: la extracción de features, el paso de
+# entrenamiento y la escritura del historial los hace un consumidor en segundo
+# plano, que drena la cola en micro-batches y procesa cada batch en un hilo
+# aparte (un paso vectorizado + una escritura en bloque).
+#
+# La cola es acotada: si está llena, ofrecer() devuelve False y el endpoint
+# responde 503 con Retry-After (backpressure). Opcionalmente los feedbacks
+# aceptados se persisten en un archivo spool, que se reprocesa al reiniciar
+# si el servidor se cayó con feedbacks pendientes.
+#
+# Los batches se procesan en el mismo orden en que se escribieron en el spool,
+# así que el avance es un contador: después de cada batch se agrega al spool
+# una marca {"_procesados": N} y al reiniciar solo vuelven los feedbacks
+# posteriores a la última marca. Con todo procesado el spool se vacía. Un
+# batch que falla se reintenta hasta `reintentos` veces; si sigue fallando sus
+# feedbacks (ya respondidos con 202) van al archivo de fallidos junto al spool,
+# que no se reprocesa solo, y el avance sigue.
+#
+# pausar() detiene el consumidor después del batch en curso (los feedbacks se
+# siguen aceptando hasta llenar la cola) y reanudar() lo vuelve a arrancar; lo
+# usa el reentrenamiento offline para que nada modifique el modelo mientras corre.
+
+import asyncio
+import json
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional
+
+MARCA = '_procesados'
+
+
+class FeedbackQueue:
+    """Cola acotada en proceso con un consumidor que procesa micro-batches."""
+
+    def __init__(
+        self,
+        procesar_lote: Callable[[List[Dict]], None],
+        maxsize: int = 1000,
+        lote_max: int = 64,
+        espera_lote: float = 0.05,
+        spool_file: Optional[Path] = None,
+        al_procesar: Optional[Callable[[int], "asyncio.Future"]] = None,
+        reintentos: int = 3,
+    ):
+        self.procesar_lote = procesar_lote
+        self.maxsize = maxsize
+        self.lote_max = lote_max
+        self.espera_lote = espera_lote
+        self.spool_file = Path(spool_file) if spool_file else None
+        self.fallidos_file = self.spool_file.with_suffix('.fallidos') if self.spool_file else None
+        self.al_procesar = al_procesar  # corrutina opcional a ejecutar después de cada batch
+        self.reintentos = max(1, reintentos)
+        self._cola: Optional[asyncio.Queue] = None
+        # Recuperados del spool al iniciar: van antes que la cola y no ocupan su capacidad
+        self._recuperados: Deque[Dict] = deque()
+        self._consumidor: Optional[asyncio.Task] = None
+        self._activo: Optional[asyncio.Event] = None  # sin setear: consumidor pausado
+        self._procesando: Optional[asyncio.Lock] = None  # tomado mientras se procesa un batch
+        self._spool = None
+        self._confirmados = 0  # feedbacks del spool ya procesados (la última marca)
+        self._conservar_spool = False  # un batch falló y no se pudo guardar en fallidos
+        self.procesados = 0
+        self.rechazados = 0
+        self.errores = 0  # feedbacks de batches que fallaron todos los intentos
+        self.errores_al_procesar = 0  # fallas de al_procesar (el batch ya estaba procesado)
+
+    # ---------- Ciclo de vida ----------
+    async def iniciar(self):
+        self._cola = asyncio.Queue(maxsize=self.maxsize)
+        self._activo = asyncio.Event()
+        self._activo.set()
+        self._procesando = asyncio.Lock()
+        if self.spool_file is not None:
+            pendientes = self._leer_spool()
+            self.spool_file.parent.mkdir(parents=True, exist_ok=True)
+            self._spool = open(self.spool_file, 'a', encoding='utf-8')
+            self._recuperados.extend(pendientes)
+            if pendientes:
+                print(f"DEBUG: {len(pendientes)} feedbacks pendientes recuperados del spool")
+        self._consumidor = asyncio.create_task(self._consumir())
+
+    async def _drenar(self):
+        while self._recuperados:
+            await asyncio.sleep(0.05)
+        await self._cola.join()
+
+    async def pausar(self):
+        """Detiene el consumidor y espera a que termine el batch en curso."""
+        if self._cola is None:
+            return
+        self._activo.clear()
+        async with self._procesando:
+            pass
+
+    def reanudar(self):
+        if self._activo is not None:
+            self._activo.set()
+
+    @property
+    def pausada(self) -> bool:
+        return self._activo is not None and not self._activo.is_set()
+
+    async def detener(self, timeout: float = 10.0):
+        """Espera a que se drene la cola (con timeout) y detiene el consumidor."""
+        if self._cola is None:
+            return
+        try:
+            await asyncio.wait_for(self._drenar(), timeout)
+        except asyncio.TimeoutError:
+            print(f"DEBUG: Cola de feedback detenida con {self.pendientes} pendientes (quedan en el spool)")
+        if self._consumidor is not None:
+            self._consumidor.cancel()
+            try:
+                await self._consumidor
+            except asyncio.CancelledError:
+                pass
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+
+    def _leer_spool(self) -> List[Dict]:
+        """Feedbacks posteriores a la última marca de avance (el spool se reescribe solo con ellos)."""
+        if not self.spool_file.exists():
+            return []
+        items, procesados = [], 0
+        with open(self.spool_file, 'r', encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    item = json.loads(linea)
+                except ValueError:
+                    continue
+                if isinstance(item, dict) and len(item) == 1 and MARCA in item:
+                    procesados = item[MARCA]
+                else:
+                    items.append(item)
+        pendientes = items[procesados:]
+        tmp = self.spool_file.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for item in pendientes:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        tmp.replace(self.spool_file)
+        return pendientes
+
+    def _guardar_fallidos(self, lote: List[Dict]) -> bool:
+        """Agrega un batch que falló al archivo de fallidos. False si no hay dónde guardarlo."""
+        if self.fallidos_file is None:
+            return False
+        try:
+            with open(self.fallidos_file, 'a', encoding='utf-8') as f:
+                for item in lote:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"DEBUG: Error guardando {len(lote)} feedbacks fallidos en {self.fallidos_file}: {e}")
+            return False
+        print(f"DEBUG: {len(lote)} feedbacks del batch fallido guardados en {self.fallidos_file}")
+        return True
+
+    def _confirmar(self, cantidad: int):
+        """Marca en el spool que se procesaron `cantidad` feedbacks más; con todo procesado lo vacía."""
+        if self._spool is None or self._conservar_spool:
+            return
+        if not self._recuperados and self._cola.empty():
+            self._spool.truncate(0)
+            self._confirmados = 0
+            return
+        self._confirmados += cantidad
+        self._spool.write(json.dumps({MARCA: self._confirmados}) + "\n")
+        self._spool.flush()
+
+    # ---------- Productor ----------
+    @property
+    def pendientes(self) -> int:
+        return (self._cola.qsize() if self._cola is not None else 0) + len(self._recuperados)
+
+    def ofrecer(self, item: Dict) -> bool:
+        """Encola un feedback sin bloquear. Devuelve False si la cola está llena."""
+        if self._cola is None:
+            raise RuntimeError("FeedbackQueue no iniciada")
+        try:
+            self._cola.put_nowait(item)
+        except asyncio.QueueFull:
+            self.rechazados += 1
+            return False
+        if self._spool is not None:
+            self._spool.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self._spool.flush()
+        return True
+
+    # ---------- Consumidor ----------
+    async def _siguiente_lote(self) -> List[Dict]:
+        if self._recuperados:
+            n = min(self.lote_max, len(self._recuperados))
+            return [self._recuperados.popleft() for _ in range(n)]
+        lote = [await self._cola.get()]
+        limite = time.monotonic() + self.espera_lote
+        while len(lote) < self.lote_max:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self._cola.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _consumir(self):
+        while True:
+            await self._activo.wait()
+            de_la_cola = not self._recuperados
+            lote = await self._siguiente_lote()
+            try:
+                # Si se pausó mientras se armaba el batch, se procesa al reanudar
+                await self._activo.wait()
+                async with self._procesando:
+                    await self._procesar(lote)
+                    self._confirmar(len(lote))
+            finally:
+                if de_la_cola:
+                    for _ in lote:
+                        self._cola.task_done()
+
+    async def _procesar(self, lote: List[Dict]):
+        """Procesa un batch con reintentos; si fallan todos lo guarda en fallidos (o conserva el spool si no puede)."""
+        for intento in range(self.reintentos):
+            try:
+                await asyncio.to_thread(self.procesar_lote, lote)
+                break
+            except Exception as e:
+                print(f"DEBUG: Error procesando batch de {len(lote)} feedbacks "
+                      f"(intento {intento + 1}/{self.reintentos}): {e}")
+                if intento + 1 < self.reintentos:
+                    await asyncio.sleep(min(2.0, 0.1 * 2 ** intento))
+                    continue
+                import traceback
+                traceback.print_exc()
+                self.errores += len(lote)
+                if not self._guardar_fallidos(lote):
+                    # Quedan solo en el spool: se deja de marcar avance hasta reiniciar
+                    self._conservar_spool = True
+                return
+        self.procesados += len(lote)
+        if self.al_procesar is not None:
+            try:
+                await self.al_procesar(len(lote))
+            except Exception as e:
+                # El batch ya está procesado y en el historial: solo falló lo posterior
+                self.errores_al_procesar += 1
+                print(f"DEBUG: Error después de procesar el batch de {len(lote)} feedbacks: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pendientes': self.pendientes,
+            'capacidad': self.maxsize,
+            'procesados': self.procesados,
+            'rechazados': self.rechazados,
+            'errores': self.errores,
+            'errores_al_procesar': self.errores_al_procesar,
+            'pausada': self.pausada,
+        }
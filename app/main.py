@@ -1,12 +1,16 @@
 
 # app/main.py
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import os
-import json
+import asyncio
+import time
 import httpx
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -15,13 +19,86 @@ BASE_DIR = Path(__file__).parent.parent  # Directorio IA-Back
 ENV_FILE = BASE_DIR / ".env"
 load_dotenv(ENV_FILE)
 
-from .engine import ClipsRecommender
+from .engine import MAX_PASOS, ClipsRecommender
 from .neural_network import WeightOptimizerNN
+from .retraining import ejecutar_reentrenamiento
+from .personalization import UserHeadStore
+from .feedback_log import FeedbackLog
+from .feedback_queue import FeedbackQueue
+from .catalog import CatalogStore
+from .feature_store import Categorias, CAMPOS_CATEGORICOS, FeatureStore, abiertos, columnas_filtro, mascara_filtros
+from .capture import RequestCapture
+from .bulk_import import ImportadorCatalogo, falta_coordenadas, normalizar_direccion
+from .topk import seleccionar_contendientes
+from .scoring import explicar, ranking as ranking_espejo, razones_descarte
+from .diversity import lambda_diversidad, rerankear, tamano_pool
+from .profiling import MiddlewarePerfilado, Perfilador, a_colapsado, a_speedscope
+from .admission import CACHE, COMPLETO, NIVELES, SIN_GOOGLE, SIN_NN, CacheLRU, ControlAdmision, Saturado, clave_request, estimar_tiempo
+from .sessions import AJUSTABLES, Sesion, Sesiones
+from .spatial import IndiceEspacial, radio_alcance_km
+from .context_table import componentes as componentes_contexto
+from .saved_locations import UbicacionGuardada, UbicacionesGuardadas
+from .deadline import HEADER as HEADER_PLAZO, ClienteDesconectado, PlazoVencido, correr_cancelable, dentro_del_plazo, plazo_actual, plazo_del_request, vencido
+from .shared_catalog import CatalogoCompartido, VistaCatalogo, disponible as shared_catalog_disponible
+from .models import Usuario, Contexto, Restaurante
 from fastapi.middleware.cors import CORSMiddleware
 
 CLP_PATH = os.environ.get("CLP_PATH", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "tpo_gastronomico_v3_2.clp")))
 RESTAURANTES_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "restaurantes.json"))
 GOOGLE_MAPS_API_KEY = os.environ.get("GOOGLE_MAPS_API_KEY", "")
+USER_HEADS_DIR = os.environ.get("USER_HEADS_DIR", str(BASE_DIR / "user_heads"))
+USER_HEADS_CAPACIDAD = int(os.environ.get("USER_HEADS_CAPACIDAD", "10000"))
+FEEDBACK_LOG_DIR = os.environ.get("FEEDBACK_LOG_DIR", str(BASE_DIR / "feedback_log"))
+FEEDBACK_LOG_FSYNC = os.environ.get("FEEDBACK_LOG_FSYNC", "interval")  # always, interval, never
+FEEDBACK_QUEUE_MAX = int(os.environ.get("FEEDBACK_QUEUE_MAX", "1000"))
+FEEDBACK_BATCH_MAX = int(os.environ.get("FEEDBACK_BATCH_MAX", "64"))
+FEEDBACK_SPOOL = os.environ.get("FEEDBACK_SPOOL", "si") == "si"  # persistir feedbacks aceptados hasta procesarlos
+FEEDBACK_REINTENTOS = int(os.environ.get("FEEDBACK_REINTENTOS", "3"))  # intentos por batch antes de pasarlo a fallidos
+GUARDAR_MODELO_CADA = 5  # feedbacks
+NN_LEARNING_RATE = os.environ.get("NN_LEARNING_RATE", "")  # vacío = el del checkpoint (0.01 sin checkpoint)
+# Captura muestreada de requests para replay (0 = desactivada)
+CAPTURE_SAMPLE_RATE = float(os.environ.get("CAPTURE_SAMPLE_RATE", "0"))
+CAPTURE_FILE = os.environ.get("CAPTURE_FILE", str(BASE_DIR / "capturas" / "requests.jsonl"))
+DIVERSIDAD_TOP = int(os.environ.get("DIVERSIDAD_TOP", "10"))  # posiciones re-rankeadas por diversidad sin top_k
+EXPLAIN_MAX = int(os.environ.get("EXPLAIN_MAX", "10"))  # resultados explicados con explain=true sin top_k
+# Importación masiva del catálogo (POST /api/restaurantes/importar)
+IMPORT_DIR = os.environ.get("IMPORT_DIR", str(BASE_DIR / "importaciones"))
+IMPORT_LOTE = int(os.environ.get("IMPORT_LOTE", "500"))
+IMPORT_CONCURRENCIA = int(os.environ.get("IMPORT_CONCURRENCIA", "8"))  # geocodificaciones en paralelo
+# Control de admisión de /api/recommend y degradación bajo carga
+ADMISION_MAX_CONCURRENTES = int(os.environ.get("ADMISION_MAX_CONCURRENTES", "16"))
+ADMISION_MAX_COLA = int(os.environ.get("ADMISION_MAX_COLA", "64"))
+ADMISION_ESPERA_MAX = float(os.environ.get("ADMISION_ESPERA_MAX", "5"))  # segundos
+ADMISION_ESPERA_OBJETIVO_MS = float(os.environ.get("ADMISION_ESPERA_OBJETIVO_MS", "250"))  # espera p90 en cola
+ADMISION_DEGRADAR = os.environ.get("ADMISION_DEGRADAR", "si") == "si"
+CACHE_RESPUESTAS_TTL = float(os.environ.get("CACHE_RESPUESTAS_TTL", "300"))  # segundos
+CACHE_TIEMPOS_TTL = float(os.environ.get("CACHE_TIEMPOS_TTL", "3600"))  # segundos
+# Perfilado por request (?profile=1 con X-Profile-Token, o muestreado)
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")  # vacío = perfilado a pedido desactivado
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVALO_MS = float(os.environ.get("PROFILE_INTERVALO_MS", "2"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", str(BASE_DIR / "perfiles"))
+CATALOGO_CAMBIOS_MAX = int(os.environ.get("CATALOGO_CAMBIOS_MAX", "10000"))  # cambios guardados para ?since=
+# Catálogo compartido entre workers por un archivo mapeado (vacío = cada proceso carga su copia)
+CATALOGO_COMPARTIDO_DIR = os.environ.get("CATALOGO_COMPARTIDO_DIR", "")  # por ejemplo /dev/shm/ia-back
+CATALOGO_COMPARTIDO_INTERVALO = float(os.environ.get("CATALOGO_COMPARTIDO_INTERVALO", "1"))  # segundos
+# Sesiones de re-ranking interactivo (/api/recommend/sesion)
+SESION_TTL = float(os.environ.get("SESION_TTL", "900"))  # segundos sin uso hasta que vence
+SESION_MAX = int(os.environ.get("SESION_MAX", "1000"))  # sesiones en memoria
+SESION_TOP_K = int(os.environ.get("SESION_TOP_K", "20"))  # resultados por ajuste sin top_k
+SESION_TIEMPO_MAX = float(os.environ.get("SESION_TIEMPO_MAX", "120"))  # minutos que cubren los candidatos (0 = todo el catálogo)
+# Candidatos del catálogo acotados al radio alcanzable en tiempo_max (0 = todo el catálogo)
+ALCANCE_MARGEN = float(os.environ.get("ALCANCE_MARGEN", "2"))
+INDICE_CELDA_KM = float(os.environ.get("INDICE_CELDA_KM", "1"))
+# Plazo de /api/recommend si el cliente no manda X-Deadline-Ms (0 = sin plazo)
+PLAZO_RECOMMEND_MS = float(os.environ.get("PLAZO_RECOMMEND_MS", "0"))
+CLIPS_TRAMO = int(os.environ.get("CLIPS_TRAMO", "500"))  # reglas por tramo entre chequeos del plazo
+# Ubicaciones guardadas por usuario con tiempos de viaje precalculados
+UBICACIONES_DIR = os.environ.get("UBICACIONES_DIR", str(BASE_DIR / "ubicaciones"))
+UBICACIONES_TIEMPO_MAX = float(os.environ.get("UBICACIONES_TIEMPO_MAX", "60"))  # minutos que cubre cada perfil
+UBICACIONES_TTL = float(os.environ.get("UBICACIONES_TTL", str(7 * 24 * 3600)))  # segundos hasta reconsultar un tiempo
+UBICACIONES_INTERVALO = float(os.environ.get("UBICACIONES_INTERVALO", "30"))  # segundos entre ciclos de mantenimiento
+UBICACIONES_CONSULTAS_POR_CICLO = int(os.environ.get("UBICACIONES_CONSULTAS_POR_CICLO", "40"))
 
 # Debug: Verificar si la API key se cargó correctamente
 print(f"DEBUG: Buscando .env en: {ENV_FILE}")
@@ -40,35 +117,97 @@ else:
 
 app = FastAPI(title="CLIPS Recommender API")
 
-# Almacenamiento simple de restaurantes en archivo JSON
-async def load_restaurantes():
-    """Carga restaurantes y geocodifica direcciones si no tienen coordenadas"""
-    if Path(RESTAURANTES_FILE).exists():
-        with open(RESTAURANTES_FILE, 'r', encoding='utf-8') as f:
-            restaurantes = json.load(f)
+# Catálogo de restaurantes en memoria (respaldado por restaurantes.json) y
+# feature store con las features estáticas, actualizado incrementalmente.
+# Con catálogo compartido solo el proceso publicador los carga; los demás
+# mapean lo que publica (ver shared_catalog.py) y, si atienden una escritura,
+# la aplican sobre el archivo recargado y descartan su copia
+compartido: Optional[CatalogoCompartido] = None
+if CATALOGO_COMPARTIDO_DIR:
+    if shared_catalog_disponible():
+        compartido = CatalogoCompartido(Path(CATALOGO_COMPARTIDO_DIR))
     else:
-        restaurantes = []
+        print("WARNING: catálogo compartido no disponible en esta plataforma, cada proceso carga su copia")
+publica_catalogo = compartido is None or compartido.tomar_publicacion()
+catalogo = CatalogStore(RESTAURANTES_FILE, cambios_max=CATALOGO_CAMBIOS_MAX,
+                        cargar_ahora=publica_catalogo, retener=publica_catalogo)
+# Última versión del catálogo en la que se intentó geocodificar lo que falta
+version_geocodificada: Optional[int] = None
+feature_store = FeatureStore()
+# Índice espacial (grilla) para acotar los candidatos por distancia al usuario
+indice_espacial = IndiceEspacial(INDICE_CELDA_KM)
+# Ubicaciones guardadas de los usuarios; sus perfiles de tiempos los mantiene el proceso que publica el catálogo
+ubicaciones = UbicacionesGuardadas(
+    Path(UBICACIONES_DIR),
+    tiempo_max=UBICACIONES_TIEMPO_MAX,
+    margen=ALCANCE_MARGEN or 2.0,
+    ttl=UBICACIONES_TTL,
+    consultas_por_ciclo=UBICACIONES_CONSULTAS_POR_CICLO,
+)
+if publica_catalogo:
+    catalogo.suscribir(feature_store)
+    catalogo.suscribir(indice_espacial)
+    catalogo.suscribir(ubicaciones)
+if compartido is not None and compartido.publicador:
+    compartido.escribir(*compartido.exportar(catalogo, feature_store))
+
+# Muestra de requests para reproducir con `python -m app.replay`
+captura = RequestCapture(Path(CAPTURE_FILE), sample_rate=CAPTURE_SAMPLE_RATE)
+
+# Admisión de /api/recommend: requests en curso acotados, cola de espera acotada
+# y niveles de degradación según la cola y la espera en cola reciente
+admision = ControlAdmision(
+    max_concurrentes=ADMISION_MAX_CONCURRENTES,
+    max_cola=ADMISION_MAX_COLA,
+    espera_max=ADMISION_ESPERA_MAX,
+    espera_objetivo_ms=ADMISION_ESPERA_OBJETIVO_MS,
+    degradar=ADMISION_DEGRADAR,
+)
+# Respuestas recientes (nivel cache) y tiempos de Google Maps (nivel sin_google)
+cache_respuestas = CacheLRU(capacidad=1000, ttl=CACHE_RESPUESTAS_TTL)
+cache_tiempos = CacheLRU(capacidad=50000, ttl=CACHE_TIEMPOS_TTL)
+# Requests de /api/recommend servidos con alguna etapa recortada por el plazo y cancelados por desconexión
+plazos_estado = {"vencidos": 0, "desconectados": 0}
+# Candidatos y criterios de cada sesión de re-ranking
+sesiones = Sesiones(capacidad=SESION_MAX, ttl=SESION_TTL)
+
+# Importaciones masivas en streaming, escriben en el catálogo por lotes
+importador = ImportadorCatalogo(
+    catalogo,
+    Path(IMPORT_DIR),
+    api_key=GOOGLE_MAPS_API_KEY,
+    lote=IMPORT_LOTE,
+    concurrencia=IMPORT_CONCURRENCIA,
+)
+
+async def load_restaurantes():
+    """Devuelve copias de los restaurantes del catálogo y geocodifica direcciones si no tienen coordenadas"""
+    restaurantes = catalogo_lectura().todos()
     
-    # Geocodificar direcciones que no tengan coordenadas
-    actualizado = False
+    # Geocodificar direcciones que no tengan coordenadas y guardar solo esos
+    # (no la lista entera, que puede estar atrasada respecto de otro worker)
+    actualizados = await geocodificar_faltantes(restaurantes)
+    if actualizados:
+        catalogo.upsert_many(actualizados)
+    
+    return restaurantes
+
+async def geocodificar_faltantes(restaurantes: List[Dict]) -> List[Dict]:
+    """Geocodifica los restaurantes sin coordenadas. Devuelve los que se actualizaron."""
+    actualizados = []
     for r in restaurantes:
-        if r.get("direccion") and (not r.get("latitud") or not r.get("longitud") or r.get("latitud") == 0.0 or r.get("longitud") == 0.0):
+        if falta_coordenadas(r):
             coords = await geocodificar_direccion(r["direccion"])
             if coords:
                 r["latitud"] = coords[0]
                 r["longitud"] = coords[1]
-                actualizado = True
+                actualizados.append(r)
                 print(f"DEBUG: Coordenadas agregadas para {r.get('nombre')}: ({coords[0]}, {coords[1]})")
-    
-    # Guardar si se actualizó
-    if actualizado:
-        save_restaurantes(restaurantes)
-    
-    return restaurantes
+    return actualizados
 
 def save_restaurantes(restaurantes):
-    with open(RESTAURANTES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(restaurantes, f, ensure_ascii=False, indent=2)
+    # Solo se aplican (y notifican al feature store) los restaurantes que cambiaron
+    catalogo.reemplazar(restaurantes)
 
 async def geocodificar_direccion(direccion: str) -> Optional[tuple]:
     """Convierte una dirección a coordenadas (lat, lon) usando Google Maps Geocoding API"""
@@ -85,7 +224,7 @@ async def geocodificar_direccion(direccion: str) -> Optional[tuple]:
                 "language": "es"
             }
             print(f"DEBUG: Geocodificando dirección: {direccion}")
-            response = await client.get(url, params=params)
+            response = await dentro_del_plazo(client.get(url, params=params))
             data = response.json()
             
             if data.get("status") == "OK" and data.get("results"):
@@ -96,12 +235,50 @@ async def geocodificar_direccion(direccion: str) -> Optional[tuple]:
                 return (lat, lon)
             else:
                 print(f"DEBUG: Error geocodificando - Status: {data.get('status')}, Error: {data.get('error_message', 'N/A')}")
+    except PlazoVencido:
+        plazo_actual().recortar('geocodificacion')
     except Exception as e:
         print(f"Error geocodificando dirección: {e}")
         import traceback
         traceback.print_exc()
     return None
 
+async def completar_tiempos_google(restaurantes: List[Dict], origen: str, modo: str, usuario: Optional[Dict] = None):
+    """
+    Completa tiempo_min consultando Google Maps (999 si la consulta falla).
+    Si se agota el plazo del request, los que faltan se resuelven como en el
+    nivel sin_google (hace falta `usuario` para estimar por distancia).
+    """
+    for i, r in enumerate(restaurantes):
+        tiempo = None if vencido() else await calcular_tiempo_google_maps(origen, r["direccion"], modo)
+        if tiempo is None and usuario is not None and vencido():
+            plazo_actual().recortar('google')
+            await completar_tiempos_sin_google(restaurantes[i:], usuario=usuario, origen=origen, modo=modo)
+            return
+        r["tiempo_min"] = tiempo if tiempo else 999
+        if tiempo:
+            cache_tiempos.guardar((origen, r["direccion"], modo), tiempo)
+        print(f"DEBUG: Restaurante {r.get('nombre')} ({r.get('direccion')}) - tiempo_min: {r['tiempo_min']}")
+
+async def completar_tiempos_sin_google(restaurantes: List[Dict], usuario: Dict, origen: str, modo: str):
+    """Nivel degradado: tiempo_min del cache de Google Maps o estimado por distancia (999 si no se puede)"""
+    cacheados = estimados = 0
+    for r in restaurantes:
+        tiempo = cache_tiempos.obtener((origen, r["direccion"], modo))
+        if tiempo:
+            cacheados += 1
+        else:
+            tiempo = estimar_tiempo(usuario, r, modo)
+            estimados += tiempo is not None
+        r["tiempo_min"] = tiempo if tiempo is not None else 999
+    print(f"DEBUG: Tiempos sin Google: {cacheados} del cache, {estimados} estimados, {len(restaurantes) - cacheados - estimados} sin tiempo")
+
+def minuto_del_dia() -> int:
+    """Minutos desde medianoche de la hora actual"""
+    from datetime import datetime
+    ahora = datetime.now()
+    return ahora.hour * 60 + ahora.minute
+
 def verificar_horario_abierto(horario_apertura: Optional[str], horario_cierre: Optional[str]) -> str:
     """Verifica si el restaurante está abierto ahora basado en horarios HH:MM"""
     if not horario_apertura or not horario_cierre:
@@ -149,7 +326,7 @@ async def calcular_tiempo_google_maps(origen_direccion: str, destino_direccion:
                 "language": "es"
             }
             print(f"DEBUG: Llamando Google Maps API - Origen: {origen_direccion}, Destino: {destino_direccion}, Modo: {modo}")
-            response = await client.get(url, params=params)
+            response = await dentro_del_plazo(client.get(url, params=params))
             data = response.json()
             
             print(f"DEBUG: Respuesta Google Maps - Status: {data.get('status')}")
@@ -165,6 +342,8 @@ async def calcular_tiempo_google_maps(origen_direccion: str, destino_direccion:
                     print(f"DEBUG: Error en elemento - Status: {elements[0].get('status') if elements else 'No elements'}")
             else:
                 print(f"DEBUG: Error en respuesta - Status: {data.get('status')}, Error messages: {data.get('error_message', 'N/A')}")
+    except PlazoVencido:
+        plazo_actual().recortar('google')
     except Exception as e:
         print(f"Error calculando tiempo con Google Maps: {e}")
         import traceback
@@ -185,73 +364,211 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Perfilado de requests: sin token ni muestreo el middleware no hace nada
+perfilador = Perfilador(Path(PROFILE_DIR), token=PROFILE_TOKEN, sample_rate=PROFILE_SAMPLE_RATE,
+                        intervalo_ms=PROFILE_INTERVALO_MS)
+app.add_middleware(MiddlewarePerfilado, perfilador=perfilador)
+
 engine = ClipsRecommender(CLP_PATH)
+motor_lock = asyncio.Lock()
 
 # Inicializar red neuronal para optimización de pesos
+# Arquitectura, learning rate e incrementos de pesos ideales vienen del checkpoint (ver app/tuning.py)
 nn_optimizer = WeightOptimizerNN(learning_rate=0.01)
+if NN_LEARNING_RATE:
+    nn_optimizer.learning_rate = float(NN_LEARNING_RATE)
+# Ajustes por usuario sobre la red global (LRU acotado, persistido en disco)
+nn_optimizer.user_heads = UserHeadStore(USER_HEADS_DIR, capacidad=USER_HEADS_CAPACIDAD)
+nn_optimizer.feature_store = feature_store
+# Historial de feedback append-only (migra user_feedback_history.json la primera vez)
+nn_optimizer.feedback_log = FeedbackLog(FEEDBACK_LOG_DIR, fsync=FEEDBACK_LOG_FSYNC, legacy_file=nn_optimizer.history_file)
 
-class Usuario(BaseModel):
-    id: str = "u1"
-    cocinas_favoritas: List[str] = ["italiana", "pizza"]
-    picante: str = "bajo"
-    presupuesto: float = 18
-    tiempo_max: float = 15
-    movilidad: str = "a_pie"  # a_pie, auto, moto, bicicleta, transporte_publico
-    restricciones: List[str] = []  # vegano, vegetariano, celiaco, intolerancia_lactosa, kosher, fit
-    diversidad: str = "media"
-    wg: float = 0.35
-    wp: float = 0.20
-    wd: float = 0.25
-    wq: float = 0.15
-    wa: float = 0.05
-    direccion: Optional[str] = None
-    latitud: Optional[float] = None
-    longitud: Optional[float] = None
-    movilidad_reducida: Optional[str] = None  # si, no
-    rating_minimo: Optional[float] = None  # mínimo de estrellas requerido (0-5)
-    requiere_reserva: Optional[str] = None  # si, no
-    solo_abiertos: Optional[str] = None  # si, no
-    tiempo_espera_max: Optional[float] = None  # tiempo máximo de espera aceptable (min)
-    tipo_comida_preferido: Optional[str] = None  # comida_rapida, gourmet, fine_dining, casual, bar, cafeteria
-    estacionamiento_requerido: Optional[str] = None  # si, no
-
-class Contexto(BaseModel):
-    clima: str = "lluvia"
-    dia: str = "viernes"
-    franja: str = "cena"
-
-class Restaurante(BaseModel):
-    id: str
-    nombre: str
-    cocinas: List[str]
-    precio_pp: float
-    rating: float
-    n_resenas: float
-    atributos: List[str] = []  # vegano, vegetariano, celiaco, sin_tacc, intolerancia_lactosa, kosher, fit
-    reserva: str = "si"  # si, no
-    abierto: str = "si"  # si, no (actualizado dinámicamente según horarios)
-    direccion: Optional[str] = None
-    latitud: Optional[float] = None
-    longitud: Optional[float] = None
-    tiempo_min: Optional[float] = None  # Se calcula dinámicamente
-    tiempo_espera: Optional[float] = None  # Tiempo promedio de espera en minutos
-    pet_friendly: Optional[str] = None  # si, no
-    estacionamiento_propio: Optional[str] = None  # si, no
-    tipo_comida: Optional[str] = None  # comida_rapida, gourmet, casual, fine_dining
-    horario_apertura: Optional[str] = None  # Formato HH:MM (ej: "09:00")
-    horario_cierre: Optional[str] = None  # Formato HH:MM (ej: "23:00")
+async def _guardar_tras_lote(cantidad: int):
+    # Guardar modelo actualizado periódicamente (cada GUARDAR_MODELO_CADA feedbacks)
+    total = nn_optimizer.feedback_log.total
+    if total // GUARDAR_MODELO_CADA != (total - cantidad) // GUARDAR_MODELO_CADA:
+        try:
+            await guardar_modelo_en_segundo_plano()
+            print(f"DEBUG: Modelo guardado después de {total} feedbacks")
+        except Exception as e:
+            print(f"DEBUG: Error guardando modelo: {e}")
+
+# Cola de ingesta: /api/feedback encola y un consumidor entrena en micro-batches
+feedback_queue = FeedbackQueue(
+    nn_optimizer.train_from_feedback_batch,
+    maxsize=FEEDBACK_QUEUE_MAX,
+    lote_max=FEEDBACK_BATCH_MAX,
+    spool_file=Path(FEEDBACK_LOG_DIR) / "pendientes.spool" if FEEDBACK_SPOOL else None,
+    reintentos=FEEDBACK_REINTENTOS,
+    al_procesar=_guardar_tras_lote,
+)
+
+@app.on_event("startup")
+async def iniciar_cola_feedback():
+    await feedback_queue.iniciar()
+
+@app.on_event("startup")
+async def iniciar_catalogo_compartido():
+    if compartido is not None:
+        asyncio.create_task(mantener_catalogo_compartido())
+
+@app.on_event("startup")
+async def iniciar_ubicaciones():
+    asyncio.create_task(mantener_ubicaciones())
+
+@app.on_event("shutdown")
+async def guardar_heads_usuarios():
+    await feedback_queue.detener()
+    nn_optimizer.user_heads.flush()
+    nn_optimizer.feedback_log.close()
+
+async def guardar_modelo_en_segundo_plano():
+    """Guarda checkpoint y heads fuera del event loop (el snapshot se toma en el loop)."""
+    snapshot = nn_optimizer.snapshot()
+    await asyncio.to_thread(nn_optimizer.save_model, None, snapshot)
+    await asyncio.to_thread(nn_optimizer.user_heads.flush)
 
 class RequestBody(BaseModel):
     usuario: Usuario
     contexto: Contexto
     restaurantes: List[Restaurante] = []
     usar_pesos_optimizados: bool = True  # Por defecto usar pesos optimizados por IA
+    top_k: Optional[int] = None  # Devolver solo los K mejores (poda los que no pueden entrar)
+    explain: bool = False  # Agregar el desglose por criterio a los resultados devueltos
+
+def vista_compartida() -> Optional[VistaCatalogo]:
+    """Versión mapeada del catálogo compartido; None si este proceso usa su propio catálogo."""
+    if compartido is None or compartido.publicador:
+        return None
+    vista = compartido.vista()
+    if vista is not None:
+        nn_optimizer.feature_store = vista.features
+    return vista
+
+def catalogo_lectura():
+    """Catálogo para las lecturas de los requests: la vista compartida o el catálogo propio (recargado si cambió)."""
+    vista = vista_compartida()
+    if vista is not None:
+        return vista
+    catalogo.recargar_si_cambio()
+    return catalogo
+
+def features_vigentes() -> FeatureStore:
+    vista = vista_compartida()
+    return vista.features if vista is not None else feature_store
+
+def indice_vigente() -> IndiceEspacial:
+    vista = vista_compartida()
+    return vista.espacial if vista is not None else indice_espacial
+
+async def mantener_catalogo_compartido():
+    """
+    En el publicador, publica cada versión nueva del catálogo (también los
+    cambios que otros workers escriben en restaurantes.json). En los lectores,
+    toma la publicación si el publicador terminó.
+    """
+    while True:
+        await asyncio.sleep(CATALOGO_COMPARTIDO_INTERVALO)
+        try:
+            if not compartido.publicador and compartido.tomar_publicacion():
+                print("DEBUG: Este proceso pasa a publicar el catálogo compartido")
+                catalogo.retener = True
+                catalogo.suscribir(feature_store)
+                catalogo.suscribir(indice_espacial)
+                catalogo.suscribir(ubicaciones)
+                nn_optimizer.feature_store = feature_store
+            if compartido.publicador:
+                catalogo.recargar_si_cambio()
+                if compartido.version_publicada != catalogo.version:
+                    arrays, header = compartido.exportar(catalogo, feature_store)
+                    await asyncio.to_thread(compartido.escribir, arrays, header)
+        except Exception as e:
+            print(f"ERROR: Publicando el catálogo compartido: {e}")
+
+async def mantener_ubicaciones():
+    """Completa y renueva los perfiles de tiempos de las ubicaciones guardadas (solo en el proceso que publica el catálogo)."""
+    while True:
+        await asyncio.sleep(UBICACIONES_INTERVALO)
+        if not GOOGLE_MAPS_API_KEY or (compartido is not None and not compartido.publicador):
+            continue
+        try:
+            await ubicaciones.actualizar(GOOGLE_MAPS_API_KEY)
+        except Exception as e:
+            print(f"ERROR: Actualizando perfiles de tiempos: {e}")
+
+def etag_catalogo(version: int) -> str:
+    return f'"catalogo-{version}"'
+
+def coincide_etag(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas
+
+async def geocodificar_catalogo():
+    """Geocodifica los restaurantes del catálogo sin coordenadas (una vez por versión del catálogo)"""
+    global version_geocodificada
+    if version_geocodificada == catalogo.version:
+        return
+    actualizados = await geocodificar_faltantes(catalogo.buscar(falta_coordenadas))
+    if actualizados:
+        catalogo.upsert_many(actualizados)
+    version_geocodificada = catalogo.version
 
 @app.get("/api/restaurantes")
-async def get_restaurantes():
-    """Obtener todos los restaurantes"""
-    restaurantes = await load_restaurantes()
-    return JSONResponse(restaurantes)
+async def get_restaurantes(request: Request, since: Optional[int] = None):
+    """
+    Obtener todos los restaurantes.
+    
+    Responde con ETag (la versión del catálogo) y 304 si el If-None-Match del
+    cliente coincide. Con `?since=<version>` devuelve solo lo que cambió desde
+    esa versión: {"version", "completo": false, "upserts", "eliminados"}. Si
+    el registro de cambios ya no llega a esa versión, devuelve el catálogo
+    entero en `upserts` con "completo": true.
+    """
+    fuente = catalogo_lectura()
+    if coincide_etag(request, etag_catalogo(fuente.version)):
+        return Response(status_code=304, headers={"ETag": etag_catalogo(fuente.version)})
+    
+    if fuente is catalogo:
+        await geocodificar_catalogo()
+    if since is None:
+        version, contenido = fuente.instantanea()
+        respuesta = Response(content=contenido, media_type="application/json")
+    else:
+        delta = fuente.cambios_desde(since)
+        if delta is None:
+            version = fuente.version
+            respuesta = JSONResponse({"version": version, "completo": True, "upserts": fuente.todos(), "eliminados": []})
+        else:
+            version, upserts, eliminados = delta
+            respuesta = JSONResponse({"version": version, "completo": False, "upserts": upserts, "eliminados": eliminados})
+    respuesta.headers["ETag"] = etag_catalogo(version)
+    respuesta.headers["X-Catalog-Version"] = str(version)
+    respuesta.headers["Cache-Control"] = "no-cache"
+    return respuesta
+
+@app.get("/api/restaurantes/cercanos")
+async def restaurantes_cercanos(lat: float, lon: float, radio_km: Optional[float] = None, n: Optional[int] = None):
+    """
+    Restaurantes por distancia a (lat, lon), del más cercano al más lejano, con
+    `distancia_km`. Con `radio_km`, todos los que están a menos de esa distancia;
+    con `n`, los n más cercanos (si vienen los dos, los n más cercanos dentro del radio).
+    """
+    if radio_km is None and n is None:
+        return JSONResponse({"error": "Indicar radio_km o n"}, status_code=400)
+    fuente = catalogo_lectura()
+    indice = indice_vigente()
+    if n is not None:
+        encontrados = indice.cercanos(lat, lon, n, radio_max_km=radio_km)
+    else:
+        encontrados = indice.en_radio(lat, lon, radio_km)
+    distancias = dict(encontrados)
+    resultado = fuente.obtener_muchos([rest_id for rest_id, _ in encontrados])
+    for r in resultado:
+        r["distancia_km"] = round(distancias[r["id"]], 3)
+    return JSONResponse(resultado)
 
 @app.post("/api/restaurantes")
 async def create_restaurantes(restaurantes: List[Restaurante]):
@@ -270,6 +587,43 @@ async def create_restaurantes(restaurantes: List[Restaurante]):
     save_restaurantes(restaurantes_dict)
     return JSONResponse({"message": "Restaurantes guardados", "count": len(restaurantes_dict)})
 
+@app.post("/api/restaurantes/importar")
+async def importar_restaurantes(request: Request):
+    """
+    Importación masiva: el body (NDJSON o array JSON) se guarda en disco en
+    streaming y se procesa en segundo plano. Responde 202 con el id del trabajo.
+    """
+    trabajo = importador.crear()
+    path = importador.archivo_subida(trabajo["id"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        async for pedazo in request.stream():
+            f.write(pedazo)
+    importador.lanzar(trabajo["id"])
+    print(f"DEBUG: Importación {trabajo['id']} recibida ({path.stat().st_size} bytes)")
+    return JSONResponse(importador.estado(trabajo["id"]), status_code=202)
+
+@app.get("/api/restaurantes/importar/{trabajo_id}")
+async def estado_importacion(trabajo_id: str):
+    """Progreso y errores por fila de una importación"""
+    estado = importador.estado(trabajo_id)
+    if estado is None:
+        return JSONResponse({"error": "Importación no encontrada"}, status_code=404)
+    return JSONResponse(estado)
+
+@app.post("/api/restaurantes/importar/{trabajo_id}/reanudar")
+async def reanudar_importacion(trabajo_id: str):
+    """Reanuda una importación interrumpida desde la última fila confirmada"""
+    estado = importador.estado(trabajo_id)
+    if estado is None:
+        return JSONResponse({"error": "Importación no encontrada"}, status_code=404)
+    if estado["activo"]:
+        return JSONResponse({"error": "La importación está en curso"}, status_code=409)
+    if estado["estado"] != "completado":
+        importador.lanzar(trabajo_id)
+        estado = importador.estado(trabajo_id)
+    return JSONResponse(estado, status_code=202)
+
 class CalcularTiemposRequest(BaseModel):
     usuario_direccion: str
     modo: str = "walking"
@@ -301,28 +655,130 @@ async def calcular_tiempos(request: CalcularTiemposRequest):
     
     return JSONResponse(restaurantes_con_tiempos)
 
-@app.post("/api/recommend")
-async def api_recommend(body: RequestBody):
-    print("=" * 80)
-    print("DEBUG: /api/recommend llamado")
-    print(f"DEBUG: Restaurantes recibidos en el request: {len(body.restaurantes)}")
-    
-    u = body.usuario.dict()
-    c = body.contexto.dict()
-    rs = [r.dict() for r in body.restaurantes]
-    
-    print(f"DEBUG: Usuario - presupuesto: {u.get('presupuesto')}, tiempo_max: {u.get('tiempo_max')}")
-    print(f"DEBUG: Restaurantes iniciales: {len(rs)}")
-    
-    # Optimizar pesos usando red neuronal solo si el usuario lo permite
-    usar_pesos_optimizados = body.usar_pesos_optimizados if hasattr(body, 'usar_pesos_optimizados') else True
-    
+# Mapear movilidad a modo de Google Maps API
+MODO_MAP = {
+    "a_pie": "walking",
+    "auto": "driving",
+    "moto": "driving",  # Google Maps no tiene modo específico para moto
+    "bicicleta": "bicycling",
+    "transporte_publico": "transit"
+}
+
+class UbicacionRequest(BaseModel):
+    direccion: str
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    movilidades: List[str] = []  # perfiles a precalcular (a_pie, auto, ...); se suman solos al recomendar
+
+@app.put("/api/usuarios/{usuario_id}/ubicaciones/{nombre}")
+async def guardar_ubicacion(usuario_id: str, nombre: str, body: UbicacionRequest):
+    """
+    Guarda (o cambia) una ubicación del usuario. Se geocodifica una sola vez
+    acá y los tiempos de viaje al catálogo se precalculan en segundo plano.
+    """
+    invalidas = [m for m in body.movilidades if m not in MODO_MAP]
+    if invalidas:
+        return JSONResponse({"error": f"Movilidades desconocidas: {invalidas}"}, status_code=422)
+    latitud, longitud = body.latitud, body.longitud
+    if not latitud or not longitud:
+        previa = ubicaciones.obtener(usuario_id, nombre)
+        if previa is not None and previa.latitud and normalizar_direccion(previa.direccion) == normalizar_direccion(body.direccion):
+            latitud, longitud = previa.latitud, previa.longitud
+        else:
+            coords = await geocodificar_direccion(body.direccion)
+            latitud, longitud = coords if coords else (None, None)
+    modos = [MODO_MAP[m] for m in body.movilidades]
+    ubic = ubicaciones.guardar(UbicacionGuardada(usuario_id, nombre, body.direccion, latitud, longitud, modos))
+    print(f"DEBUG: Ubicación '{nombre}' de {usuario_id} guardada: {body.direccion} ({latitud}, {longitud}), modos {ubic.modos}")
+    return JSONResponse(ubicaciones.estado(ubic))
+
+@app.get("/api/usuarios/{usuario_id}/ubicaciones")
+async def listar_ubicaciones(usuario_id: str):
+    ubicaciones.recargar_si_cambio()
+    return JSONResponse([ubicaciones.estado(u) for u in ubicaciones.de_usuario(usuario_id)])
+
+@app.delete("/api/usuarios/{usuario_id}/ubicaciones/{nombre}")
+async def eliminar_ubicacion(usuario_id: str, nombre: str):
+    if not ubicaciones.eliminar(usuario_id, nombre):
+        return JSONResponse({"error": "Ubicación inexistente"}, status_code=404)
+    return JSONResponse({"usuario_id": usuario_id, "nombre": nombre, "eliminada": True})
+
+def marcar_tiempos_pendientes(rs: List[Dict], u: Dict) -> str:
+    """Pone tiempo_min None en los que hay que consultar a Google Maps y 999 en los que no tienen tiempo. Devuelve el modo."""
+    usar_google = bool(u.get('direccion') and GOOGLE_MAPS_API_KEY)
+    for r in rs:
+        if usar_google and r.get("direccion"):
+            r["tiempo_min"] = None
+        elif not r.get("tiempo_min"):
+            # Sin dirección, tiempo por defecto
+            r["tiempo_min"] = 999
+    return MODO_MAP.get(u.get('movilidad', 'a_pie'), 'walking')
+
+def resolver_ubicacion(u: Dict) -> Optional[UbicacionGuardada]:
+    """
+    Ubicación guardada desde la que se recomienda: la nombrada en `ubicacion`
+    o la del usuario con la misma dirección. Pone su dirección y coordenadas en el usuario.
+    """
+    nombre = u.pop('ubicacion', None)  # no es un slot del usuario en CLIPS
+    ubicaciones.recargar_si_cambio()
+    if nombre:
+        ubic = ubicaciones.obtener(u.get('id'), nombre)
+        if ubic is None:
+            print(f"WARNING: El usuario {u.get('id')} no tiene una ubicación guardada '{nombre}'")
+    elif u.get('direccion'):
+        ubic = ubicaciones.por_direccion(u.get('id'), u['direccion'])
+    else:
+        ubic = None
+    if ubic is not None:
+        u['direccion'] = ubic.direccion
+        if ubic.latitud and ubic.longitud:
+            u['latitud'], u['longitud'] = ubic.latitud, ubic.longitud
+    return ubic
+
+def completar_tiempos_guardados(ubic: UbicacionGuardada, rs: List[Dict], modo: str):
+    """tiempo_min del perfil de la ubicación guardada; los que no están quedan para Google Maps"""
+    completados = ubicaciones.completar(ubic, modo, rs)
+    # Un modo nuevo para la ubicación se empieza a mantener desde ahora
+    ubicaciones.agregar_modo(ubic, modo)
+    print(f"DEBUG: Ubicación guardada '{ubic.nombre}': {completados} tiempos del perfil ({modo}), "
+          f"{sum(1 for r in rs if r.get('tiempo_min') is None)} a consultar")
+
+def actualizar_abiertos(rs: List[Dict]):
+    for r in rs:
+        if r.get("horario_apertura") and r.get("horario_cierre"):
+            r["abierto"] = verificar_horario_abierto(r.get("horario_apertura"), r.get("horario_cierre"))
+            print(f"DEBUG: Restaurante {r.get('nombre')} - horarios {r.get('horario_apertura')}-{r.get('horario_cierre')} -> abierto: {r['abierto']}")
+
+def completar_features(rs: List[Dict], u: Dict, c: Dict):
+    """
+    Copia afinidad, calidad y disponibilidad (la columna que indica la tabla de
+    contexto) del feature store en los restaurantes que están en el catálogo
+    """
+    features = features_vigentes()
+    filas = features.filas([r["id"] for r in rs])
+    afinidades = features.afinidad(u.get('cocinas_favoritas'), filas)
+    entrada = componentes_contexto(c)
+    contextuales = entrada.columnas(features, filas)
+    for i, (r, fila, afinidad) in enumerate(zip(rs, filas, afinidades)):
+        if fila >= 0:
+            r["afinidad"] = float(afinidad)
+            r["calidad"] = float(contextuales['calidad'][i])
+            if entrada.columna_disp is not None:
+                r["disp"] = float(contextuales['disp'][i])
+
+def columnas_contexto(c: Dict, rs: List[Dict]) -> Dict[str, np.ndarray]:
+    """Términos de U que no dependen del usuario (disponibilidad, calidad, penalización) de la tabla de contexto"""
+    features = features_vigentes()
+    return componentes_contexto(c).columnas(features, features.filas([r["id"] for r in rs]))
+
+def aplicar_pesos(u: Dict, c: Dict, rs: List[Dict], usar_pesos_optimizados: bool):
+    """Reemplaza los pesos del usuario por los de la red neuronal (si corresponde)"""
     if usar_pesos_optimizados and rs and len(rs) > 0:
         try:
             # Usar el primer restaurante como ejemplo para extraer características
             restaurante_ejemplo = rs[0]
             pesos_optimizados = nn_optimizer.predict_weights(u, restaurante_ejemplo, c)
-            
+        
             # Usar pesos optimizados por la red neuronal
             # La NN aprende de los feedbacks pasados y ajusta los pesos para mejorar recomendaciones
             pesos_originales = {
@@ -332,13 +788,13 @@ async def api_recommend(body: RequestBody):
                 'wq': u.get('wq'),
                 'wa': u.get('wa')
             }
-            
+        
             u['wg'] = pesos_optimizados['wg']
             u['wp'] = pesos_optimizados['wp']
             u['wd'] = pesos_optimizados['wd']
             u['wq'] = pesos_optimizados['wq']
             u['wa'] = pesos_optimizados['wa']
-            
+        
             print(f"DEBUG: Pesos originales del usuario - wg:{pesos_originales['wg']}, wp:{pesos_originales['wp']}, wd:{pesos_originales['wd']}, wq:{pesos_originales['wq']}, wa:{pesos_originales['wa']}")
             print(f"DEBUG: Pesos utilizados (optimizados por NN) - wg:{u['wg']:.3f}, wp:{u['wp']:.3f}, wd:{u['wd']:.3f}, wq:{u['wq']:.3f}, wa:{u['wa']:.3f}")
         except Exception as e:
@@ -353,118 +809,204 @@ async def api_recommend(body: RequestBody):
         else:
             print(f"DEBUG: Sin restaurantes disponibles - usando pesos por defecto del usuario")
         print(f"DEBUG: Pesos utilizados (por defecto) - wg:{u.get('wg', 0.35):.3f}, wp:{u.get('wp', 0.20):.3f}, wd:{u.get('wd', 0.25):.3f}, wq:{u.get('wq', 0.15):.3f}, wa:{u.get('wa', 0.05):.3f}")
+
+# Campos del restaurante que se copian a cada recomendación
+CAMPOS_OBLIGATORIOS = ('nombre', 'cocinas', 'atributos', 'reserva')  # si están
+CAMPOS_OPCIONALES = ('pet_friendly', 'estacionamiento_propio', 'tipo_comida', 'horario_apertura',
+                     'horario_cierre', 'abierto', 'direccion')  # si tienen valor
+
+def formatear_recomendacion(rec: Dict, original_rest: Dict) -> Dict:
+    """Agrega a la recomendación de CLIPS los datos del restaurante y los formatos de precio y rating"""
+    # Incluir precio_pp original y formateado
+    precio_pp_raw = original_rest.get('precio_pp')
+    if precio_pp_raw is not None:
+        rec['precio_pp'] = precio_pp_raw
+        rec['precio_pp_formato'] = _format_price_level(precio_pp_raw)
+    # Incluir rating original y formateado a estrellas
+    rating_raw = original_rest.get('rating')
+    if rating_raw is not None:
+        rec['rating'] = rating_raw
+        rec['rating_estrellas'] = _format_rating_stars(rating_raw)
+    # Incluir tiempo_min calculado
+    if original_rest.get('tiempo_min') is not None:
+        rec['tiempo_min'] = original_rest['tiempo_min']
+    # Incluir coordenadas
+    if original_rest.get('latitud') and original_rest.get('longitud'):
+        rec['latitud'] = original_rest['latitud']
+        rec['longitud'] = original_rest['longitud']
+    for campo in CAMPOS_OBLIGATORIOS:
+        if campo in original_rest:
+            rec[campo] = original_rest[campo]
+    if original_rest.get('tiempo_espera') is not None:
+        rec['tiempo_espera'] = original_rest['tiempo_espera']
+    for campo in CAMPOS_OPCIONALES:
+        if original_rest.get(campo):
+            rec[campo] = original_rest[campo]
+    return rec
+
+def respuesta_saturado(endpoint: str, e: Saturado) -> JSONResponse:
+    print(f"DEBUG: {endpoint} rechazado: {e}")
+    return JSONResponse({
+        "error": "Servidor saturado, reintentar más tarde",
+        "motivo": str(e),
+    }, status_code=503, headers={"Retry-After": str(e.retry_after), "X-Recommend-Queue-Depth": str(admision.esperando)})
+
+@app.post("/api/recommend")
+async def api_recommend(body: RequestBody, request: Request):
+    print("=" * 80)
+    print("DEBUG: /api/recommend llamado")
+    print(f"DEBUG: Restaurantes recibidos en el request: {len(body.restaurantes)}")
+    body_dict = body.dict()
+    captura.capturar("/api/recommend", body_dict)
+    plazo = plazo_del_request(request.headers.get(HEADER_PLAZO), PLAZO_RECOMMEND_MS)
     
-    # Cargar restaurantes desde archivo para tener las direcciones completas
-    restaurantes_completos = await load_restaurantes()
-    # Crear un mapa por ID para acceso rápido
-    restaurantes_map = {r["id"]: r for r in restaurantes_completos}
+    try:
+        async with admision.turno() as turno:
+            nivel = turno.nivel
+            clave = clave_request(body_dict) if admision.degradar or plazo.vence is not None else None
+            contenido = cache_respuestas.obtener(clave) if nivel >= CACHE else None
+            if contenido is not None:
+                respuesta = Response(content=contenido, media_type="application/json")
+            else:
+                # Sin respuesta cacheada se sirve con el nivel anterior
+                nivel = min(nivel, SIN_NN)
+                # Si el cliente corta, se cancelan las consultas a Google y CLIPS y se libera el turno
+                respuesta = await correr_cancelable(recomendar(body, nivel), plazo, request.is_disconnected)
+                if plazo.recortes:
+                    # Respuesta parcial: antes que eso, la completa del cache si la hay (y no se cachea)
+                    plazos_estado["vencidos"] += 1
+                    contenido = cache_respuestas.obtener(clave) if clave is not None else None
+                    if contenido is not None:
+                        respuesta = Response(content=contenido, media_type="application/json")
+                        nivel = CACHE
+                    else:
+                        respuesta.headers["X-Recommend-Partial"] = ",".join(plazo.recortes)
+                elif clave is not None and respuesta.status_code == 200:
+                    cache_respuestas.guardar(clave, respuesta.body)
+    except Saturado as e:
+        return respuesta_saturado("/api/recommend", e)
+    except ClienteDesconectado:
+        plazos_estado["desconectados"] += 1
+        print(f"DEBUG: /api/recommend cancelado, el cliente se desconectó ({(time.monotonic() - plazo.inicio) * 1000:.0f}ms)")
+        return Response(status_code=499)
+    
+    if nivel != COMPLETO:
+        print(f"DEBUG: Servido con degradación '{NIVELES[nivel]}' (espera {turno.espera * 1000:.0f}ms)")
+    respuesta.headers["X-Recommend-Degradation"] = NIVELES[nivel]
+    respuesta.headers["X-Recommend-Queue-Wait-Ms"] = f"{turno.espera * 1000:.0f}"
+    return respuesta
+
+@app.get("/api/recommend/estado")
+async def api_recommend_estado():
+    """Estado del control de admisión de /api/recommend."""
+    estado = admision.estado()
+    estado["respuestas_cacheadas"] = len(cache_respuestas)
+    estado["tiempos_cacheados"] = len(cache_tiempos)
+    estado["plazos"] = dict(plazos_estado)
+    return JSONResponse(estado)
+
+def filas_al_alcance(u: Dict, fs: FeatureStore, alcance: Optional[float] = None) -> Optional[np.ndarray]:
+    """
+    Filas del feature store a menos del radio alcanzable en `alcance` minutos
+    (por defecto el tiempo_max del usuario) con su movilidad, más las que no
+    tienen coordenadas. None (todo el catálogo) si el usuario no mandó
+    coordenadas o ALCANCE_MARGEN es 0.
+    """
+    if not u.get('latitud') or not u.get('longitud'):
+        return None
+    modo = MODO_MAP.get(u.get('movilidad', 'a_pie'), 'walking')
+    minutos = alcance if alcance is not None else float(u.get('tiempo_max') or 0)
+    radio = radio_alcance_km(minutos, modo, ALCANCE_MARGEN)
+    if radio is None:
+        return None
+    indice = indice_vigente()
+    cercanos = indice.en_radio(float(u['latitud']), float(u['longitud']), radio)
+    ids = [rest_id for rest_id, _ in cercanos]
+    ids.extend(indice.sin_coordenadas)
+    print(f"DEBUG: Índice espacial: {len(cercanos)} restaurantes a menos de {radio:.1f} km "
+          f"(+{len(indice.sin_coordenadas)} sin coordenadas) de {fs.n}")
+    return fs.filas(ids)
+
+async def candidatos_filtrados(u: Dict, c: Dict, rs: List[Dict], nivel: int = COMPLETO, alcance: Optional[float] = None):
+    """
+    Restaurantes del request (o del catálogo si no se enviaron) que pasan los
+    filtros, con features del feature store y tiempo_min marcado para resolver.
+    Del catálogo solo se toman los que están al alcance (ver filas_al_alcance).
+    Devuelve (restaurantes, resolver_tiempos).
+    """
+    fuente = catalogo_lectura()
+    minuto_actual = minuto_del_dia()
+    ubic = resolver_ubicacion(u)
     
     # Si se enviaron restaurantes, actualizar con los datos completos (direcciones y coordenadas)
-    # Si no se enviaron restaurantes o el array está vacío, cargar todos del archivo
-    actualizado_archivo = False
+    # Si no se enviaron restaurantes o el array está vacío, se filtra el catálogo completo
     if rs and len(rs) > 0:
         print(f"DEBUG: Actualizando {len(rs)} restaurantes con datos del archivo")
+        actualizados = []
         for r in rs:
-            if r["id"] in restaurantes_map:
+            r_completo = fuente.obtener(r["id"])
+            if r_completo is not None:
                 # Actualizar con datos del archivo (dirección y coordenadas)
-                r_completo = restaurantes_map[r["id"]]
                 r["direccion"] = r_completo.get("direccion")
                 # Copiar coordenadas si existen en el archivo
                 if r_completo.get("latitud") and r_completo.get("longitud"):
                     r["latitud"] = r_completo.get("latitud")
                     r["longitud"] = r_completo.get("longitud")
-                elif r.get("direccion") and (not r.get("latitud") or not r.get("longitud") or r.get("latitud") == 0.0 or r.get("longitud") == 0.0):
+                elif falta_coordenadas(r):
                     # Si no tiene coordenadas, geocodificar ahora
                     coords = await geocodificar_direccion(r["direccion"])
                     if coords:
                         r["latitud"] = coords[0]
                         r["longitud"] = coords[1]
-                        # Actualizar también en el archivo para futuras cargas
+                        # Actualizar también en el catálogo para futuras cargas
                         r_completo["latitud"] = coords[0]
                         r_completo["longitud"] = coords[1]
-                        actualizado_archivo = True
+                        actualizados.append(r_completo)
                 # Si ya tiene tiempo_min calculado y direccion, mantenerlo
                 if not r.get("tiempo_min") and r.get("direccion"):
                     r["tiempo_min"] = None  # Se calculará abajo
         # Guardar coordenadas actualizadas si se geocodificaron
-        if actualizado_archivo:
-            save_restaurantes(restaurantes_completos)
-    else:
-        print(f"DEBUG: No se enviaron restaurantes o array vacío, cargando {len(restaurantes_completos)} del archivo")
-        rs = restaurantes_completos.copy()
-    
-    # Mapear movilidad a modo de Google Maps API
-    modo_map = {
-        "a_pie": "walking",
-        "auto": "driving",
-        "moto": "driving",  # Google Maps no tiene modo específico para moto
-        "bicicleta": "bicycling",
-        "transporte_publico": "transit"
-    }
-    
-    # Si hay dirección del usuario, calcular tiempos reales (siempre recalcular si hay dirección)
-    if u.get('direccion') and GOOGLE_MAPS_API_KEY:
-        modo = modo_map.get(u.get('movilidad', 'a_pie'), 'walking')
-        print(f"DEBUG: Calculando tiempos para {len(rs)} restaurantes desde '{u['direccion']}' en modo {modo}")
-        for r in rs:
-            if r.get("direccion"):
-                # Siempre recalcular si hay dirección del restaurante
-                tiempo = await calcular_tiempo_google_maps(u['direccion'], r["direccion"], modo)
-                r["tiempo_min"] = tiempo if tiempo else 999
-                print(f"DEBUG: Restaurante {r.get('nombre')} ({r.get('direccion')}) - tiempo_min: {r['tiempo_min']}")
-            elif not r.get("tiempo_min"):
-                r["tiempo_min"] = 999
-                print(f"DEBUG: Restaurante {r.get('nombre')} - sin dirección, tiempo_min: 999")
+        if actualizados:
+            catalogo.upsert_many(actualizados)
+        # Filtros del request como una máscara sobre las columnas de la lista recibida
+        categorias = {campo: Categorias() for campo in CAMPOS_CATEGORICOS}
+        cols = columnas_filtro(rs, categorias)
+        abierto = abiertos(cols, minuto_actual)
+        pasan = mascara_filtros(u, cols, categorias, abierto)
+        rs = [r for r, ok in zip(rs, pasan) if ok]
+        abierto = abierto[pasan]
     else:
-        # Si no hay dirección, establecer tiempos por defecto
-        for r in rs:
-            if not r.get("tiempo_min"):
-                r["tiempo_min"] = 999
+        # Filtros del request sobre las columnas del feature store (solo las filas
+        # al alcance del usuario): se copian del catálogo los restaurantes que pasan
+        fs = features_vigentes()
+        ids, abierto = fs.filtrar(u, minuto_actual, filas_al_alcance(u, fs, alcance))
+        rs = fuente.obtener_muchos(ids)
+        print(f"DEBUG: No se enviaron restaurantes o array vacío, {len(rs)} de {len(fuente)} del catálogo pasan los filtros")
+        # Geocodificar los que no tengan coordenadas (solo los que pasaron los filtros)
+        actualizados = await geocodificar_faltantes(rs)
+        if actualizados:
+            geocodificados = []
+            for r in actualizados:
+                r_completo = fuente.obtener(r["id"])
+                if r_completo is not None:
+                    r_completo["latitud"], r_completo["longitud"] = r["latitud"], r["longitud"]
+                    geocodificados.append(r_completo)
+            catalogo.upsert_many(geocodificados)
     
-    # Verificar horarios y actualizar campo "abierto" dinámicamente
-    for r in rs:
+    # Estado de apertura según horarios (sin horarios queda el campo abierto)
+    for r, a in zip(rs, abierto):
         if r.get("horario_apertura") and r.get("horario_cierre"):
-            r["abierto"] = verificar_horario_abierto(r.get("horario_apertura"), r.get("horario_cierre"))
-            print(f"DEBUG: Restaurante {r.get('nombre')} - horarios {r.get('horario_apertura')}-{r.get('horario_cierre')} -> abierto: {r['abierto']}")
+            r["abierto"] = "si" if a else "no"
+    filtros = [f for f in ('rating_minimo', 'solo_abiertos', 'tiempo_espera_max', 'tipo_comida_preferido',
+                           'estacionamiento_requerido', 'requiere_reserva') if u.get(f) is not None]
+    print(f"DEBUG: Filtros del request {filtros}: quedan {len(rs)} restaurantes")
     
-    # Filtrar restaurantes por rating_minimo si está especificado
-    if u.get('rating_minimo') is not None:
-        rating_min = float(u.get('rating_minimo', 0))
-        rs = [r for r in rs if r.get('rating', 0) >= rating_min]
-        print(f"DEBUG: Filtrados restaurantes por rating_minimo >= {rating_min}, quedan {len(rs)} restaurantes")
-    
-    # Filtrar restaurantes por solo_abiertos si está especificado
-    solo_abiertos_val = u.get('solo_abiertos')
-    print(f"DEBUG: solo_abiertos recibido: '{solo_abiertos_val}' (tipo: {type(solo_abiertos_val)})")
-    if solo_abiertos_val == 'si':
-        cantidad_antes = len(rs)
-        rs = [r for r in rs if r.get('abierto') == 'si']
-        print(f"DEBUG: Filtrados restaurantes por solo_abiertos=si ({cantidad_antes} -> {len(rs)}), quedan {len(rs)} restaurantes")
-    elif solo_abiertos_val == 'no':
-        print(f"DEBUG: solo_abiertos=no, NO se filtrarán restaurantes por estado de apertura (mostrar todos)")
-    else:
-        print(f"DEBUG: solo_abiertos no especificado o vacío, NO se filtrarán restaurantes por estado de apertura")
-    
-    # Filtrar restaurantes por tiempo_espera_max si está especificado
-    if u.get('tiempo_espera_max') is not None:
-        tiempo_max = float(u.get('tiempo_espera_max', 999))
-        rs = [r for r in rs if (r.get('tiempo_espera') is None or r.get('tiempo_espera', 0) <= tiempo_max)]
-        print(f"DEBUG: Filtrados restaurantes por tiempo_espera <= {tiempo_max}, quedan {len(rs)} restaurantes")
-    
-    # Filtrar restaurantes por tipo_comida_preferido si está especificado
-    if u.get('tipo_comida_preferido'):
-        tipo_pref = u.get('tipo_comida_preferido')
-        rs = [r for r in rs if r.get('tipo_comida') == tipo_pref]
-        print(f"DEBUG: Filtrados restaurantes por tipo_comida={tipo_pref}, quedan {len(rs)} restaurantes")
-    
-    # Filtrar restaurantes por estacionamiento_requerido si está especificado
-    if u.get('estacionamiento_requerido'):
-        est_req = u.get('estacionamiento_requerido')
-        if est_req == 'si':
-            rs = [r for r in rs if r.get('estacionamiento_propio') == 'si']
-        elif est_req == 'no':
-            rs = [r for r in rs if r.get('estacionamiento_propio') != 'si']
-        print(f"DEBUG: Filtrados restaurantes por estacionamiento_requerido={est_req}, quedan {len(rs)} restaurantes")
+    # Si hay dirección del usuario, se calculan tiempos reales (siempre recalcular si hay dirección).
+    # Acá solo se marcan con tiempo_min None: la consulta se hace después de los filtros y,
+    # con top_k, solo para los restaurantes que todavía pueden entrar al top-K.
+    modo = marcar_tiempos_pendientes(rs, u)
+    if ubic is not None:
+        completar_tiempos_guardados(ubic, rs, modo)
     
     # Log de dirección recibida para debug
     if u.get('direccion') or u.get('latitud') or u.get('longitud'):
@@ -475,79 +1017,267 @@ async def api_recommend(body: RequestBody):
     print(f"DEBUG: Total restaurantes ANTES de llamar al motor CLIPS: {len(rs)}")
     if len(rs) == 0:
         print("ERROR: No hay restaurantes para procesar. Los filtros eliminaron todos los restaurantes.")
+        return [], None
+    
+    # Features precalculadas del feature store: afinidad por bitsets, calidad estática y
+    # disponibilidad según el contexto. Los restaurantes que no están en el catálogo las calculan en CLIPS.
+    completar_features(rs, u, c)
+    
+    if nivel >= SIN_GOOGLE:
+        resolver_tiempos = partial(completar_tiempos_sin_google, usuario=u, origen=u.get('direccion'), modo=modo)
+    else:
+        resolver_tiempos = partial(completar_tiempos_google, origen=u.get('direccion'), modo=modo, usuario=u)
+    return rs, resolver_tiempos
+
+async def evaluar_en_motor(u: Dict, c: Dict, rs: List[Dict]) -> List[Dict]:
+    """
+    Corre CLIPS en tramos de CLIPS_TRAMO reglas, cediendo el event loop entre
+    tramos: un request cancelado se detiene en el próximo corte y, si se agota
+    el plazo, el ranking sale de la réplica en Python de las reglas.
+    """
+    async with motor_lock:  # un solo entorno CLIPS: los tramos de dos requests no se mezclan
+        if vencido():
+            plazo_actual().recortar('clips')
+            return ranking_espejo(u, c, rs, columnas_contexto(c, rs))
+        # Los pesos que fija el contexto (wd con lluvia) van ya aplicados: la regla de
+        # lluvia no se activa y el usuario de la sesión conserva sus pesos
+        usuario = dict(u, **componentes_contexto(c).pesos_fijos)
+        engine.preparar(usuario=usuario, contexto=c, restaurantes=rs if rs else None)
+        pasos = 0
+        while pasos < MAX_PASOS:
+            tramo = min(CLIPS_TRAMO, MAX_PASOS - pasos)
+            disparadas = engine.run(max_steps=tramo)
+            pasos += disparadas
+            if disparadas < tramo:
+                break
+            await asyncio.sleep(0)
+            if vencido():
+                print(f"DEBUG: CLIPS cortado tras {pasos} reglas")
+                plazo_actual().recortar('clips')
+                return ranking_espejo(u, c, rs, columnas_contexto(c, rs))
+        return engine.resultados()
+
+async def recomendar(body: RequestBody, nivel: int = COMPLETO) -> JSONResponse:
+    """Pipeline de /api/recommend. Con nivel sin_google no consulta Google Maps y con sin_nn no usa la red."""
+    u = body.usuario.dict()
+    c = body.contexto.dict()
+    rs = [r.dict() for r in body.restaurantes]
+    
+    print(f"DEBUG: Usuario - presupuesto: {u.get('presupuesto')}, tiempo_max: {u.get('tiempo_max')}")
+    print(f"DEBUG: Restaurantes iniciales: {len(rs)}")
+    
+    # Optimizar pesos usando red neuronal solo si el usuario lo permite (y queda plazo)
+    usar_nn = body.usar_pesos_optimizados and nivel < SIN_NN
+    if usar_nn and vencido():
+        plazo_actual().recortar('nn')
+        usar_nn = False
+    aplicar_pesos(u, c, rs, usar_nn)
+    
+    rs, resolver_tiempos = await candidatos_filtrados(u, c, rs, nivel)
+    if not rs:
         return JSONResponse([], status_code=200)  # Devolver array vacío en lugar de error
     
-    recs = engine.recommend(usuario=u, contexto=c, restaurantes=rs if rs else None)
+    if body.top_k:
+        # Poda por cota superior: CLIPS solo puntúa a los que pueden entrar al top-K.
+        # Con diversidad se puntúa un pool más grande para elegir los K entre ellos.
+        k_pool = body.top_k if lambda_diversidad(u.get('diversidad')) >= 1.0 else tamano_pool(body.top_k)
+        rs, stats_topk = await seleccionar_contendientes(u, c, rs, k_pool, resolver_tiempos,
+                                                         contextuales=columnas_contexto(c, rs))
+        print(f"DEBUG: Top-{body.top_k}: {stats_topk}")
+        if not rs:
+            return JSONResponse([], status_code=200)
+    else:
+        pendientes = []
+        for r in rs:
+            if r.get("tiempo_min") is None:
+                if razones_descarte(u, r):
+                    r["tiempo_min"] = 999  # CLIPS lo va a descartar: no hace falta consultar
+                else:
+                    pendientes.append(r)
+        if pendientes:
+            print(f"DEBUG: Calculando tiempos para {len(pendientes)} restaurantes desde '{u['direccion']}'")
+            await resolver_tiempos(pendientes)
+    
+    recs = await evaluar_en_motor(u, c, rs)
+    
+    # Crear un mapa de restaurantes para acceder fácilmente a sus datos originales
+    restaurantes_map = {r["id"]: r for r in rs}
+    
+    # Re-ranking por diversidad (baja = solo U)
+    recs = rerankear(recs, restaurantes_map, body.top_k or DIVERSIDAD_TOP, u.get('diversidad'))
+    if body.top_k:
+        recs = recs[:body.top_k]
     
     print(f"DEBUG: Recomendaciones generadas por CLIPS: {len(recs)}")
     if len(recs) == 0:
         print("WARNING: El motor CLIPS no generó ninguna recomendación.")
         print("DEBUG: Verificar que los restaurantes cumplan con las reglas del motor CLIPS.")
     
-    # Crear un mapa de restaurantes para acceder fácilmente a sus datos originales
-    restaurantes_map = {r["id"]: r for r in rs}
+    formatted_recs = [formatear_recomendacion(rec, restaurantes_map.get(rec['id'], {})) for rec in recs]
 
-    formatted_recs = []
-    for rec in recs:
-        original_rest = restaurantes_map.get(rec['id'], {})
-        
-        # Incluir precio_pp original y formateado
-        precio_pp_raw = original_rest.get('precio_pp')
-        if precio_pp_raw is not None:
-            rec['precio_pp'] = precio_pp_raw # Incluir el original
-            rec['precio_pp_formato'] = _format_price_level(precio_pp_raw)
-        
-        # Incluir rating original y formateado a estrellas
-        rating_raw = original_rest.get('rating')
-        if rating_raw is not None:
-            rec['rating'] = rating_raw # Incluir el original
-            rec['rating_estrellas'] = _format_rating_stars(rating_raw)
-        
-        # Incluir tiempo_min calculado
-        tiempo_min_raw = original_rest.get('tiempo_min')
-        if tiempo_min_raw is not None:
-            rec['tiempo_min'] = tiempo_min_raw
-        
-        # Incluir coordenadas
-        if original_rest.get('latitud') and original_rest.get('longitud'):
-            rec['latitud'] = original_rest.get('latitud')
-            rec['longitud'] = original_rest.get('longitud')
-        
-        # Incluir TODOS los campos de restaurante (incluidos los opcionales)
-        # Campos obligatorios
-        if 'nombre' in original_rest:
-            rec['nombre'] = original_rest['nombre']
-        if 'cocinas' in original_rest:
-            rec['cocinas'] = original_rest['cocinas']
-        if 'atributos' in original_rest:
-            rec['atributos'] = original_rest['atributos']
-        if 'reserva' in original_rest:
-            rec['reserva'] = original_rest['reserva']
-        
-        # Campos opcionales nuevos
-        if original_rest.get('tiempo_espera') is not None:
-            rec['tiempo_espera'] = original_rest.get('tiempo_espera')
-        if original_rest.get('pet_friendly'):
-            rec['pet_friendly'] = original_rest.get('pet_friendly')
-        if original_rest.get('estacionamiento_propio'):
-            rec['estacionamiento_propio'] = original_rest.get('estacionamiento_propio')
-        if original_rest.get('tipo_comida'):
-            rec['tipo_comida'] = original_rest.get('tipo_comida')
-        if original_rest.get('horario_apertura'):
-            rec['horario_apertura'] = original_rest.get('horario_apertura')
-        if original_rest.get('horario_cierre'):
-            rec['horario_cierre'] = original_rest.get('horario_cierre')
-        # Incluir abierto (ya actualizado dinámicamente)
-        if original_rest.get('abierto'):
-            rec['abierto'] = original_rest.get('abierto')
-        # Incluir dirección y coordenadas
-        if original_rest.get('direccion'):
-            rec['direccion'] = original_rest.get('direccion')
-            
-        formatted_recs.append(rec)
+    # Explicaciones solo para los resultados devueltos (acotadas a top_k o EXPLAIN_MAX)
+    if body.explain:
+        explicados = formatted_recs[:body.top_k or EXPLAIN_MAX]
+        for rec, explicacion in zip(explicados, explicar(u, c, [restaurantes_map[rec['id']] for rec in explicados])):
+            rec['explicacion'] = explicacion
 
     return JSONResponse(formatted_recs)
 
+class AjusteSesion(BaseModel):
+    wg: Optional[float] = None
+    wp: Optional[float] = None
+    wd: Optional[float] = None
+    wq: Optional[float] = None
+    wa: Optional[float] = None
+    presupuesto: Optional[float] = None
+    tiempo_max: Optional[float] = None
+    diversidad: Optional[str] = None
+    top_k: Optional[int] = None
+
+def respuesta_sesion(sesion: Sesion, recalculados: Optional[List[str]] = None) -> JSONResponse:
+    recs = [formatear_recomendacion({"id": r["id"], "nombre": r.get("nombre", r["id"]), "U": u}, r)
+            for r, u in sesion.ranking()]
+    return JSONResponse({
+        "sesion": sesion.id,
+        "candidatos": len(sesion.restaurantes),
+        "recalculados": recalculados or [],
+        "recomendaciones": recs,
+    })
+
+async def armar_sesion(u: Dict, c: Dict, rs: List[Dict], top_k: int, nivel: int) -> Sesion:
+    """
+    Candidatos de una sesión con sus tiempos resueltos. Del catálogo se toman
+    los que están a SESION_TIEMPO_MAX minutos (o al tiempo_max del usuario si es
+    mayor), así los ajustes de tiempo_max dentro de ese alcance no dejan afuera
+    restaurantes que /api/recommend devolvería.
+    """
+    alcance = None
+    if not rs and SESION_TIEMPO_MAX > 0:
+        alcance = max(SESION_TIEMPO_MAX, float(u.get('tiempo_max') or 0))
+    rs, resolver_tiempos = await candidatos_filtrados(u, c, rs, nivel, alcance)
+    if not u.get('latitud') or not u.get('longitud') or ALCANCE_MARGEN <= 0:
+        alcance = None  # no se acotó por distancia: los candidatos sirven para cualquier tiempo_max
+    # Los que CLIPS descartaría no se puntúan nunca: tampoco hace falta su tiempo
+    rs = [r for r in rs if not razones_descarte(u, r)]
+    pendientes = [r for r in rs if r.get("tiempo_min") is None]
+    if pendientes:
+        await resolver_tiempos(pendientes)
+    return Sesion(u, c, rs, top_k, contextuales=columnas_contexto(c, rs), alcance=alcance)
+
+@app.post("/api/recommend/sesion")
+async def api_recommend_sesion(body: RequestBody):
+    """
+    Abre una sesión de re-ranking: corre los filtros y resuelve los tiempos de
+    viaje una sola vez, y guarda los candidatos con su matriz de criterios.
+    
+    Los ajustes posteriores (PATCH /api/recommend/sesion/{id}) re-rankean en
+    memoria sin volver a consultar Google Maps, la red neuronal ni CLIPS.
+    """
+    u = body.usuario.dict()
+    c = body.contexto.dict()
+    rs = [r.dict() for r in body.restaurantes]
+    try:
+        async with admision.turno() as turno:
+            # El nivel cache no aplica: una sesión siempre arma sus candidatos
+            nivel = min(turno.nivel, SIN_NN)
+            aplicar_pesos(u, c, rs, body.usar_pesos_optimizados and nivel < SIN_NN)
+            sesion = await armar_sesion(u, c, rs, body.top_k or SESION_TOP_K, nivel)
+    except Saturado as e:
+        return respuesta_saturado("/api/recommend/sesion", e)
+    
+    sesiones.crear(sesion)
+    print(f"DEBUG: Sesión {sesion.id} creada con {len(sesion.restaurantes)} candidatos (nivel {NIVELES[nivel]})")
+    respuesta = respuesta_sesion(sesion)
+    respuesta.headers["X-Recommend-Degradation"] = NIVELES[nivel]
+    return respuesta
+
+@app.patch("/api/recommend/sesion/{sesion_id}")
+async def api_recommend_sesion_ajustar(sesion_id: str, body: AjusteSesion):
+    """
+    Ajusta pesos, presupuesto, tiempo_max o diversidad de la sesión y devuelve
+    el nuevo ranking. Los pesos solo cambian el producto M @ w; presupuesto y
+    tiempo_max recalculan únicamente la columna de precio o de cercanía.
+    """
+    sesion = sesiones.obtener(sesion_id)
+    if sesion is None:
+        return JSONResponse({"error": "Sesión inexistente o vencida"}, status_code=404)
+    cambios = {k: v for k, v in body.dict(exclude_unset=True).items() if k in AJUSTABLES and v is not None}
+    if body.top_k:
+        sesion.top_k = body.top_k
+    if sesion.supera_alcance(cambios):
+        # tiempo_max más allá del radio de los candidatos: se vuelven a armar con el nuevo alcance
+        print(f"DEBUG: Sesión {sesion.id}: tiempo_max {cambios['tiempo_max']} supera el alcance "
+              f"de {sesion.alcance:.0f} min, se vuelven a armar los candidatos")
+        u = dict(sesion.usuario, **cambios)
+        try:
+            async with admision.turno() as turno:
+                nueva = await armar_sesion(u, sesion.contexto, [], sesion.top_k, min(turno.nivel, SIN_NN))
+        except Saturado as e:
+            return respuesta_saturado("/api/recommend/sesion", e)
+        nueva.id, nueva.creada, nueva.ajustes = sesion.id, sesion.creada, sesion.ajustes + 1
+        sesion = sesiones.crear(nueva)
+        return respuesta_sesion(sesion, recalculados=['candidatos'])
+    recalculados = sesion.ajustar(cambios)
+    return respuesta_sesion(sesion, recalculados=recalculados)
+
+@app.get("/api/recommend/sesion/{sesion_id}")
+async def api_recommend_sesion_estado(sesion_id: str):
+    sesion = sesiones.obtener(sesion_id)
+    if sesion is None:
+        return JSONResponse({"error": "Sesión inexistente o vencida"}, status_code=404)
+    return JSONResponse(sesion.estado())
+
+@app.delete("/api/recommend/sesion/{sesion_id}")
+async def api_recommend_sesion_cerrar(sesion_id: str):
+    if not sesiones.eliminar(sesion_id):
+        return JSONResponse({"error": "Sesión inexistente o vencida"}, status_code=404)
+    return JSONResponse({"sesion": sesion_id, "cerrada": True})
+
+class ExplainRequest(RequestBody):
+    ids: List[str]
+
+@app.post("/api/recommend/explain")
+async def api_recommend_explain(body: ExplainRequest):
+    """
+    Desglose de U por criterio y razones de descarte, solo para los restaurantes pedidos.
+    
+    Recibe el mismo body que /api/recommend más `ids`. El ranking no arma
+    justificaciones; se calculan acá a pedido con la réplica en Python de las reglas.
+    """
+    u = body.usuario.dict()
+    c = body.contexto.dict()
+    ubic = resolver_ubicacion(u)
+    enviados = {r.id: r.dict() for r in body.restaurantes}
+    aplicar_pesos(u, c, list(enviados.values()), body.usar_pesos_optimizados)
+    
+    fuente = catalogo_lectura()
+    rs = []
+    no_encontrados = []
+    for rest_id in dict.fromkeys(body.ids):
+        completo = fuente.obtener(rest_id)
+        r = enviados.get(rest_id, completo)
+        if r is None:
+            no_encontrados.append(rest_id)
+            continue
+        if completo is not None and rest_id in enviados:
+            # Igual que /api/recommend: dirección y coordenadas salen del archivo
+            r["direccion"] = completo.get("direccion")
+            if completo.get("latitud") and completo.get("longitud"):
+                r["latitud"] = completo.get("latitud")
+                r["longitud"] = completo.get("longitud")
+        rs.append(r)
+    
+    modo = marcar_tiempos_pendientes(rs, u)
+    if ubic is not None:
+        completar_tiempos_guardados(ubic, rs, modo)
+    pendientes = [r for r in rs if r.get("tiempo_min") is None]
+    if pendientes:
+        await completar_tiempos_google(pendientes, origen=u.get('direccion'), modo=modo, usuario=u)
+    actualizar_abiertos(rs)
+    completar_features(rs, u, c)
+    
+    return JSONResponse({"explicaciones": explicar(u, c, rs), "no_encontrados": no_encontrados})
+
 def _format_price_level(price: float) -> str:
     if price <= 15000:
         return "$"
@@ -575,39 +1305,132 @@ async def api_feedback(body: FeedbackRequest):
     
     Se llama cuando el usuario selecciona un restaurante de las recomendaciones.
     La red neuronal aprende de estas interacciones para mejorar futuras recomendaciones.
+    
+    El feedback se encola y se responde de inmediato (202); el entrenamiento y la
+    escritura del historial los hace el consumidor de la cola en micro-batches.
+    Si la cola está llena se responde 503 con Retry-After.
     """
-    try:
-        u = body.usuario.dict()
-        c = body.contexto.dict()
-        restaurante_sel = body.restaurante_seleccionado.dict()
-        restaurantes_rej = [r.dict() for r in body.restaurantes_rechazados]
-        razones = body.razones_preferencia
-        
-        print(f"DEBUG: Feedback recibido - Razones: {razones}")
-        
-        # Entrenar la red neuronal con el feedback
-        nn_optimizer.train_from_feedback(u, restaurante_sel, restaurantes_rej, c, razones)
-        
-        # Guardar modelo actualizado periódicamente (cada 5 feedbacks)
-        history = nn_optimizer.load_history()
-        feedback_count = len(history.get('feedbacks', []))
-        if feedback_count % 5 == 0:
-            try:
-                nn_optimizer.save_model()
-                print(f"DEBUG: Modelo guardado después de {feedback_count} feedbacks")
-            except Exception as e:
-                print(f"DEBUG: Error guardando modelo: {e}")
-        
+    razones = body.razones_preferencia
+    print(f"DEBUG: Feedback recibido - Razones: {razones}")
+    captura.capturar("/api/feedback", body.dict())
+    
+    item = {
+        'usuario': body.usuario.dict(),
+        'contexto': body.contexto.dict(),
+        'restaurante_seleccionado': body.restaurante_seleccionado.dict(),
+        'restaurantes_rechazados': [r.dict() for r in body.restaurantes_rechazados],
+        'razones_preferencia': razones,
+    }
+    if not feedback_queue.ofrecer(item):
+        print(f"DEBUG: Cola de feedback llena ({feedback_queue.pendientes}), se rechaza el feedback")
         return JSONResponse({
-            "message": "Feedback recibido y procesado correctamente",
-            "modelo_actualizado": True,
-            "total_feedbacks": feedback_count
-        })
+            "message": "Cola de feedback llena, reintentar más tarde",
+            "modelo_actualizado": False
+        }, status_code=503, headers={"Retry-After": "1", "X-Feedback-Queue-Depth": str(feedback_queue.pendientes)})
+    
+    return JSONResponse({
+        "message": "Feedback recibido, se procesará en segundo plano",
+        "modelo_actualizado": False,
+        "total_feedbacks": nn_optimizer.feedback_log.total + feedback_queue.pendientes,
+        "pendientes": feedback_queue.pendientes
+    }, status_code=202, headers={"X-Feedback-Queue-Depth": str(feedback_queue.pendientes)})
+
+@app.get("/api/feedback/estado")
+async def api_feedback_estado():
+    """Estado de la cola de ingesta de feedback."""
+    estado = feedback_queue.stats()
+    estado["total_feedbacks"] = nn_optimizer.feedback_log.total
+    return JSONResponse(estado)
+
+@app.get("/api/perfiles")
+async def api_listar_perfiles(request: Request):
+    """Perfiles guardados (los más recientes primero). Requiere X-Profile-Token."""
+    if not perfilador.autorizado(request.headers.get("x-profile-token")):
+        return JSONResponse({"error": "No autorizado"}, status_code=403)
+    return JSONResponse(await asyncio.to_thread(perfilador.listar))
+
+@app.get("/api/perfiles/{perfil_id}")
+async def api_obtener_perfil(perfil_id: str, request: Request, formato: str = "speedscope"):
+    """Un perfil como JSON de speedscope, pilas colapsadas (formato=colapsado) o crudo (formato=json)"""
+    if not perfilador.autorizado(request.headers.get("x-profile-token")):
+        return JSONResponse({"error": "No autorizado"}, status_code=403)
+    perfil = perfilador.obtener(perfil_id)
+    if perfil is None:
+        return JSONResponse({"error": "Perfil no encontrado"}, status_code=404)
+    if formato == "colapsado":
+        return Response(content=a_colapsado(perfil), media_type="text/plain")
+    if formato == "json":
+        return JSONResponse(perfil)
+    return JSONResponse(a_speedscope(perfil))
+
+# Reentrenamiento offline: corre en un proceso aparte y solo publica si mejora en test
+reentrenamiento_estado: Dict[str, Any] = {"en_curso": False, "ultimo_resultado": None}
+_reentrenamiento_executor: Optional[ProcessPoolExecutor] = None
+
+async def _correr_reentrenamiento():
+    """
+    Mientras corre el job, el consumidor de la cola de feedback queda pausado: el
+    job entrena desde los parámetros actuales con todo el historial y publicarlo
+    pisaría los pasos online dados en el medio. Los feedbacks que llegan se
+    encolan (y van al spool) y se entrenan sobre el modelo nuevo al reanudar.
+    """
+    global _reentrenamiento_executor
+    if _reentrenamiento_executor is None:
+        _reentrenamiento_executor = ProcessPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+    await feedback_queue.pausar()
+    try:
+        resultado = await loop.run_in_executor(
+            _reentrenamiento_executor,
+            partial(
+                ejecutar_reentrenamiento,
+                nn_optimizer.get_params(),
+                learning_rate=nn_optimizer.learning_rate,
+                feedback_dir=str(nn_optimizer.feedback_log.directorio),
+                incrementos=nn_optimizer.incrementos,
+            ),
+        )
+        params = resultado.pop('params', None)
+        if resultado.get('publicar') and params is not None:
+            nn_optimizer.set_params(params)
+            nn_optimizer.version += 1
+            await guardar_modelo_en_segundo_plano()
+            resultado['version'] = nn_optimizer.version
+            print(f"DEBUG: Reentrenamiento publicó el modelo versión {nn_optimizer.version}")
+        else:
+            print(f"DEBUG: Reentrenamiento sin publicar: {resultado.get('motivo')}")
+        reentrenamiento_estado["ultimo_resultado"] = resultado
     except Exception as e:
-        print(f"DEBUG: Error procesando feedback: {e}")
+        print(f"DEBUG: Error en reentrenamiento: {e}")
         import traceback
         traceback.print_exc()
-        return JSONResponse({
-            "message": f"Error procesando feedback: {str(e)}",
-            "modelo_actualizado": False
-        }, status_code=500)
+        reentrenamiento_estado["ultimo_resultado"] = {"publicar": False, "motivo": f"error: {e}"}
+    finally:
+        feedback_queue.reanudar()
+        reentrenamiento_estado["en_curso"] = False
+
+@app.post("/api/modelo/reentrenar")
+async def api_reentrenar():
+    """Lanza el reentrenamiento offline en segundo plano (no bloquea el request)."""
+    if reentrenamiento_estado["en_curso"]:
+        return JSONResponse({"message": "Ya hay un reentrenamiento en curso"}, status_code=409)
+    reentrenamiento_estado["en_curso"] = True
+    asyncio.create_task(_correr_reentrenamiento())
+    return JSONResponse({"message": "Reentrenamiento iniciado", "version_actual": nn_optimizer.version}, status_code=202)
+
+@app.get("/api/modelo/reentrenar")
+async def api_estado_reentrenamiento():
+    """Estado del último reentrenamiento."""
+    return JSONResponse({
+        "en_curso": reentrenamiento_estado["en_curso"],
+        "version_actual": nn_optimizer.version,
+        "ultimo_resultado": reentrenamiento_estado["ultimo_resultado"],
+    })
+
+@app.get("/api/modelo/exportar")
+async def api_exportar_modelo():
+    """Exporta los pesos actuales de la red en JSON (los checkpoints son binarios)."""
+    params, meta = nn_optimizer.snapshot()
+    model_data = dict(meta)
+    model_data.update({k: v.tolist() for k, v in params.items()})
+    return JSONResponse(model_data)
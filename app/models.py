@@ -0,0 +1,62 @@
+# app/models.py
+# Modelos de dominio de la API (usuario, contexto y restaurante).
+#
+# Están separados de main.py para poder validar restaurantes sin levantar la app
+# (importación masiva desde la línea de comandos).
+
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class Usuario(BaseModel):
+    id: str = "u1"
+    cocinas_favoritas: List[str] = ["italiana", "pizza"]
+    picante: str = "bajo"
+    presupuesto: float = 18
+    tiempo_max: float = 15
+    movilidad: str = "a_pie"  # a_pie, auto, moto, bicicleta, transporte_publico
+    restricciones: List[str] = []  # vegano, vegetariano, celiaco, intolerancia_lactosa, kosher, fit
+    diversidad: str = "media"
+    wg: float = 0.35
+    wp: float = 0.20
+    wd: float = 0.25
+    wq: float = 0.15
+    wa: float = 0.05
+    direccion: Optional[str] = None
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    movilidad_reducida: Optional[str] = None  # si, no
+    rating_minimo: Optional[float] = None  # mínimo de estrellas requerido (0-5)
+    requiere_reserva: Optional[str] = None  # si, no
+    solo_abiertos: Optional[str] = None  # si, no
+    tiempo_espera_max: Optional[float] = None  # tiempo máximo de espera aceptable (min)
+    tipo_comida_preferido: Optional[str] = None  # comida_rapida, gourmet, fine_dining, casual, bar, cafeteria
+    estacionamiento_requerido: Optional[str] = None  # si, no
+    ubicacion: Optional[str] = None  # nombre de una ubicación guardada del usuario (casa, trabajo)
+
+class Contexto(BaseModel):
+    clima: str = "lluvia"
+    dia: str = "viernes"
+    franja: str = "cena"
+
+class Restaurante(BaseModel):
+    id: str
+    nombre: str
+    cocinas: List[str]
+    precio_pp: float
+    rating: float
+    n_resenas: float
+    atributos: List[str] = []  # vegano, vegetariano, celiaco, sin_tacc, intolerancia_lactosa, kosher, fit
+    reserva: str = "si"  # si, no
+    abierto: str = "si"  # si, no (actualizado dinámicamente según horarios)
+    direccion: Optional[str] = None
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    tiempo_min: Optional[float] = None  # Se calcula dinámicamente
+    tiempo_espera: Optional[float] = None  # Tiempo promedio de espera en minutos
+    pet_friendly: Optional[str] = None  # si, no
+    estacionamiento_propio: Optional[str] = None  # si, no
+    tipo_comida: Optional[str] = None  # comida_rapida, gourmet, casual, fine_dining
+    horario_apertura: Optional[str] = None  # Formato HH:MM (ej: "09:00")
+    horario_cierre: Optional[str] = None  # Formato HH:MM (ej: "23:00")
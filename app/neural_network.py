@@ -8,13 +8,90 @@ import json
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+from . import checkpoints
+
+# Pesos ideales de partida (wg, wp, wd, wq, wa) antes de aplicar el feedback
+PESOS_BASE = (0.35, 0.20, 0.25, 0.15, 0.05)
+
+# Incrementos con los que el feedback mueve los pesos ideales. Son los valores
+# puestos a mano originalmente; app/tuning.py busca otros a partir del historial.
+INCREMENTOS_IDEALES = {
+    # Razones explícitas del usuario
+    'precio': 0.15,
+    'distancia': 0.15,
+    'calidad': 0.15,
+    'gustos': 0.15,
+    'abierto': 0.10,
+    'reserva': 0.08,
+    'caracteristicas': 0.05,
+    # Seleccionado vs promedio de los rechazados
+    'umbral_diferencia': 0.2,
+    'diferencia_mejor': 0.05,
+    'diferencia_peor': 0.02,
+    # Sin rechazados ni razones: características destacadas del seleccionado
+    'umbral_destacado': 0.7,
+    'destacado_afinidad': 0.1,
+    'destacado': 0.05,
+}
+
+# Razón de preferencia -> índice del peso que aumenta
+_RAZONES = {
+    'precio': 1, 'distancia': 2, 'calidad': 3, 'gustos': 0,
+    'abierto': 4, 'reserva': 4, 'caracteristicas': 4,
+}
+
+
+def pesos_ideales(
+    features_sel: np.ndarray,
+    features_rej: Optional[np.ndarray],
+    razones_preferencia: Optional[List[str]] = None,
+    incrementos: Optional[Dict[str, float]] = None,
+) -> np.ndarray:
+    """
+    Pesos ideales (5,) a partir de las features del seleccionado, el promedio de
+    las de los rechazados (None si no hubo) y las razones explícitas.
+    Es el cálculo de compute_ideal_weights_from_feedback sobre features ya extraídas,
+    para poder reproducirlo desde el historial con otros incrementos.
+    """
+    inc = INCREMENTOS_IDEALES if incrementos is None else incrementos
+    ideal_weights = np.array(PESOS_BASE, dtype=float)
+    
+    # Si hay razones explícitas del usuario, usarlas para ajustar pesos
+    for razon in razones_preferencia or []:
+        if razon in _RAZONES:
+            ideal_weights[_RAZONES[razon]] += inc[razon]
+    
+    features_sel = np.ravel(features_sel)
+    if features_rej is not None:
+        # Dar más peso a características donde el seleccionado es significativamente mejor
+        diffs = features_sel - np.ravel(features_rej)
+        for i, diff in enumerate(diffs):
+            if diff > inc['umbral_diferencia']:
+                ideal_weights[i] += inc['diferencia_mejor']
+            elif diff < -inc['umbral_diferencia']:  # El rechazado era mejor aquí
+                ideal_weights[i] -= inc['diferencia_peor']
+    
+    # Si no hay rechazados y no hay razones explícitas, usar características del seleccionado
+    elif not razones_preferencia:
+        # Alta afinidad: aumentar wg; buen precio, cercanía o rating: wp, wd, wq
+        if features_sel[0] > inc['umbral_destacado']:
+            ideal_weights[0] += inc['destacado_afinidad']
+        for i in (1, 2, 3):
+            if features_sel[i] > inc['umbral_destacado']:
+                ideal_weights[i] += inc['destacado']
+    
+    # Normalizar para que sumen 1.0
+    ideal_weights = np.maximum(ideal_weights, 0.01)  # Evitar pesos negativos o cero
+    return ideal_weights / np.sum(ideal_weights)
+
+
 class WeightOptimizerNN:
     """
     Red Neuronal Simple para aprender y optimizar los pesos del Sistema Experto.
     
     Arquitectura:
     - Capa de entrada: características del usuario y restaurante (5 características principales)
-    - Capa oculta: 8 neuronas con activación ReLU
+    - Capa oculta: `oculta` neuronas (8 por defecto) con activación ReLU
     - Capa de salida: 5 pesos normalizados (wg, wp, wd, wq, wa)
     
     Entrenamiento:
@@ -22,22 +99,38 @@ class WeightOptimizerNN:
     - Ajusta los pesos para mejorar las recomendaciones futuras
     """
     
-    def __init__(self, learning_rate: float = 0.01):
+    def __init__(
+        self,
+        learning_rate: float = 0.01,
+        cargar_modelo: bool = True,
+        oculta: int = 8,
+        incrementos: Optional[Dict[str, float]] = None,
+    ):
         self.learning_rate = learning_rate
+        # Incrementos de los pesos ideales (se guardan en el checkpoint junto con el learning rate)
+        self.incrementos = dict(INCREMENTOS_IDEALES, **(incrementos or {}))
+        self.version = 0  # Versión del modelo publicado (se incrementa al reentrenar)
+        self.revision = 0  # Se incrementa con cada cambio de parámetros (invalida memos de predicción)
+        self.user_heads = None  # UserHeadStore opcional con ajustes por usuario (personalization.py)
+        self.feedback_log = None  # FeedbackLog opcional; si no está se usa history_file (feedback_log.py)
+        self.feature_store = None  # FeatureStore opcional con features estáticas precalculadas (feature_store.py)
         self.history_file = Path(__file__).parent.parent / "user_feedback_history.json"
-        self.model_file = Path(__file__).parent.parent / "nn_model.json"
+        self.model_file = Path(__file__).parent.parent / "nn_model.json"  # Export JSON / migración
+        self.checkpoint_dir = Path(__file__).parent.parent / "checkpoints"
+        self.checkpoints_retenidos = 5
         
         # Inicializar pesos de la red neuronal (Xavier initialization)
-        # Capa oculta: 8 neuronas
-        self.W1 = np.random.randn(5, 8) * np.sqrt(2.0 / 5)  # Input (5 features) -> Hidden (8 neurons)
-        self.b1 = np.zeros((1, 8))
+        # Capa oculta: `oculta` neuronas (al cargar un checkpoint manda su arquitectura)
+        self.W1 = np.random.randn(5, oculta) * np.sqrt(2.0 / 5)  # Input (5 features) -> Hidden
+        self.b1 = np.zeros((1, oculta))
         
         # Capa de salida: 5 pesos
-        self.W2 = np.random.randn(8, 5) * np.sqrt(2.0 / 8)  # Hidden (8) -> Output (5 weights)
+        self.W2 = np.random.randn(oculta, 5) * np.sqrt(2.0 / oculta)  # Hidden -> Output (5 weights)
         self.b2 = np.zeros((1, 5))
         
         # Cargar modelo si existe
-        self.load_model_if_exists()
+        if cargar_modelo:
+            self.load_model_if_exists()
         
     def extract_features(self, usuario: Dict, restaurante: Dict, contexto: Dict) -> np.ndarray:
         """
@@ -46,8 +139,16 @@ class WeightOptimizerNN:
         """
         features = np.zeros(5)
         
+        # Features estáticas precalculadas si el restaurante está en el feature store
+        fila = -1
+        if self.feature_store is not None and restaurante.get('id') is not None:
+            fila = self.feature_store.fila.get(restaurante['id'], -1)
+        
         # Feature 1: Afinidad (coincidencia de cocinas)
-        if usuario.get('cocinas_favoritas') and restaurante.get('cocinas'):
+        if fila >= 0:
+            if usuario.get('cocinas_favoritas'):
+                features[0] = self.feature_store.afinidad(usuario['cocinas_favoritas'], np.array([fila]))[0]
+        elif usuario.get('cocinas_favoritas') and restaurante.get('cocinas'):
             cocinas_comunes = len([c for c in usuario['cocinas_favoritas'] if c in restaurante['cocinas']])
             total_cocinas = len(set(usuario['cocinas_favoritas'] + restaurante['cocinas']))
             features[0] = cocinas_comunes / max(total_cocinas, 1)  # Normalizado [0-1]
@@ -65,7 +166,9 @@ class WeightOptimizerNN:
             features[2] = max(0, min(1, features[2]))  # Clip a [0,1]
         
         # Feature 4: Calidad (rating normalizado)
-        if restaurante.get('rating'):
+        if fila >= 0:
+            features[3] = self.feature_store.rating_norm[fila]
+        elif restaurante.get('rating'):
             features[3] = (restaurante['rating'] - 1) / 4  # Normalizar rating [1-5] a [0-1]
         
         # Feature 5: Disponibilidad y contexto
@@ -81,10 +184,11 @@ class WeightOptimizerNN:
         
         return features.reshape(1, -1)  # Reshape a (1, 5) para batch processing
     
-    def forward(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    def forward(self, X: np.ndarray, delta_b2: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Forward pass de la red neuronal.
         Retorna los 5 pesos optimizados (wg, wp, wd, wq, wa) normalizados.
+        delta_b2: ajuste opcional del bias de salida (head personalizado del usuario).
         """
         # Capa oculta con ReLU
         Z1 = np.dot(X, self.W1) + self.b1
@@ -92,6 +196,8 @@ class WeightOptimizerNN:
         
         # Capa de salida
         Z2 = np.dot(A1, self.W2) + self.b2
+        if delta_b2 is not None:
+            Z2 = Z2 + delta_b2
         
         # Normalizar pesos usando softmax para que sumen 1.0
         # Pero primero aplicar exp para hacer positivos
@@ -104,10 +210,25 @@ class WeightOptimizerNN:
         """
         Predice los pesos óptimos para un usuario dado.
         Usa el restaurante de ejemplo para extraer características representativas.
+        Si hay heads por usuario, aplica el ajuste del usuario (o el modelo global
+        si es un usuario frío) y memoriza el resultado por (usuario, features cuantizadas).
         """
         features = self.extract_features(usuario, restaurante_ejemplo, contexto)
-        weights, _, _ = self.forward(features)
-        
+        if self.user_heads is None:
+            weights, _, _ = self.forward(features)
+            return self._pesos_a_dict(weights)
+        
+        user_id = usuario.get('id')
+        features_q = self.user_heads.cuantizar(features)
+        clave = self.user_heads.memo_clave(user_id, features_q, self.revision)
+        pesos = self.user_heads.memo_get(clave)
+        if pesos is None:
+            weights, _, _ = self.forward(features_q, self.user_heads.delta(user_id))
+            pesos = self._pesos_a_dict(weights)
+            self.user_heads.memo_set(clave, pesos)
+        return dict(pesos)
+    
+    def _pesos_a_dict(self, weights: np.ndarray) -> Dict[str, float]:
         # Retornar como diccionario con nombres
         return {
             'wg': float(weights[0][0]),  # Peso para gustos/afinidad
@@ -142,10 +263,40 @@ class WeightOptimizerNN:
         db1 = (1/m) * np.sum(dZ1, axis=0, keepdims=True)
         
         # Actualizar pesos
-        self.W2 -= self.learning_rate * dW2
-        self.b2 -= self.learning_rate * db2
-        self.W1 -= self.learning_rate * dW1
-        self.b1 -= self.learning_rate * db1
+        # Se reasignan los arrays en lugar de modificarlos in-place: así una predicción
+        # concurrente (el entrenamiento corre en otro hilo) nunca ve una matriz a medio actualizar
+        self.W2 = self.W2 - self.learning_rate * dW2
+        self.b2 = self.b2 - self.learning_rate * db2
+        self.W1 = self.W1 - self.learning_rate * dW1
+        self.b1 = self.b1 - self.learning_rate * db1
+        self.revision += 1
+    
+    def train_batch(self, X: np.ndarray, Y: np.ndarray):
+        """Un paso de descenso por gradiente sobre un mini-batch (X: n x 5, Y: n x 5)."""
+        y_pred, A1, Z1 = self.forward(X)
+        self.backward(X, y_pred, Y, A1, Z1)
+    
+    def loss(self, X: np.ndarray, Y: np.ndarray) -> float:
+        """
+        Entropía cruzada media entre los pesos predichos y los ideales.
+        Es la pérdida cuyo gradiente respecto de Z2 es (y_pred - y_true), el que usa backward().
+        """
+        if len(X) == 0:
+            return 0.0
+        y_pred, _, _ = self.forward(X)
+        return float(-np.mean(np.sum(Y * np.log(y_pred + 1e-12), axis=1)))
+    
+    def get_params(self) -> Dict[str, np.ndarray]:
+        """Copia de los parámetros de la red (para entrenar o publicar en otro proceso)."""
+        return {'W1': self.W1.copy(), 'b1': self.b1.copy(), 'W2': self.W2.copy(), 'b2': self.b2.copy()}
+    
+    def set_params(self, params: Dict[str, np.ndarray]):
+        """Reemplaza los parámetros de la red."""
+        self.W1 = np.array(params['W1'], dtype=float)
+        self.b1 = np.array(params['b1'], dtype=float)
+        self.W2 = np.array(params['W2'], dtype=float)
+        self.b2 = np.array(params['b2'], dtype=float)
+        self.revision += 1
     
     def compute_ideal_weights_from_feedback(
         self, 
@@ -163,69 +314,20 @@ class WeightOptimizerNN:
         deberíamos dar más peso a wp, etc.
         
         Ahora también usa razones_preferencia para ajustar más precisamente los pesos.
+        Los incrementos son los de self.incrementos (ver pesos_ideales()).
         """
-        # Inicializar pesos ideales (empiezan con valores por defecto)
-        ideal_weights = np.array([0.35, 0.20, 0.25, 0.15, 0.05])
-        
-        # Si hay razones explícitas del usuario, usarlas para ajustar pesos
-        if razones_preferencia and len(razones_preferencia) > 0:
-            for razon in razones_preferencia:
-                if razon == 'precio':
-                    ideal_weights[1] += 0.15  # Aumentar peso de precio (wp)
-                elif razon == 'distancia':
-                    ideal_weights[2] += 0.15  # Aumentar peso de distancia (wd)
-                elif razon == 'calidad':
-                    ideal_weights[3] += 0.15  # Aumentar peso de calidad (wq)
-                elif razon == 'gustos':
-                    ideal_weights[0] += 0.15  # Aumentar peso de gustos (wg)
-                elif razon == 'abierto':
-                    ideal_weights[4] += 0.10  # Aumentar peso de disponibilidad (wa)
-                elif razon == 'reserva':
-                    ideal_weights[4] += 0.08  # Aumentar peso de disponibilidad (wa)
-                elif razon == 'caracteristicas':
-                    # Las características pueden afectar varios pesos
-                    ideal_weights[4] += 0.05  # Disponibilidad
-        
         # Analizar restaurante seleccionado
         features_sel = self.extract_features(usuario, restaurante_seleccionado, contexto).flatten()
         
         # Analizar restaurantes rechazados (promedio)
+        features_rej = None
         if restaurantes_rechazados:
             features_rej = np.mean([
                 self.extract_features(usuario, r, contexto).flatten() 
                 for r in restaurantes_rechazados
             ], axis=0)
-            
-            # Ajustar pesos ideales: dar más peso a características donde el seleccionado es mejor
-            diffs = features_sel - features_rej
-            
-            # Aumentar peso de características donde el seleccionado es significativamente mejor
-            for i, diff in enumerate(diffs):
-                if diff > 0.2:  # Diferencia significativa
-                    ideal_weights[i] += 0.05
-                elif diff < -0.2:  # El rechazado era mejor aquí
-                    ideal_weights[i] -= 0.02
-        
-        # Si no hay rechazados y no hay razones explícitas, usar características del seleccionado para ajustar
-        elif not razones_preferencia or len(razones_preferencia) == 0:
-            # Si tiene alta afinidad, aumentar wg
-            if features_sel[0] > 0.7:
-                ideal_weights[0] += 0.1
-            # Si tiene buen precio, aumentar wp
-            if features_sel[1] > 0.7:
-                ideal_weights[1] += 0.05
-            # Si está cerca, aumentar wd
-            if features_sel[2] > 0.7:
-                ideal_weights[2] += 0.05
-            # Si tiene buen rating, aumentar wq
-            if features_sel[3] > 0.7:
-                ideal_weights[3] += 0.05
-        
-        # Normalizar para que sumen 1.0
-        ideal_weights = np.maximum(ideal_weights, 0.01)  # Evitar pesos negativos o cero
-        ideal_weights = ideal_weights / np.sum(ideal_weights)
-        
-        return ideal_weights.reshape(1, -1)
+        
+        return pesos_ideales(features_sel, features_rej, razones_preferencia, self.incrementos).reshape(1, -1)
     
     def train_from_feedback(
         self,
@@ -238,22 +340,62 @@ class WeightOptimizerNN:
         """
         Entrena la red neuronal con feedback del usuario.
         """
-        # Extraer características
-        X = self.extract_features(usuario, restaurante_seleccionado, contexto)
-        
-        # Calcular pesos ideales (ahora con razones de preferencia)
-        y_true = self.compute_ideal_weights_from_feedback(
-            usuario, restaurante_seleccionado, restaurantes_rechazados, contexto, razones_preferencia
-        )
-        
-        # Predecir pesos actuales
-        y_pred, A1, Z1 = self.forward(X)
-        
-        # Backpropagation
-        self.backward(X, y_pred, y_true, A1, Z1)
+        self.train_from_feedback_batch([{
+            'usuario': usuario,
+            'restaurante_seleccionado': restaurante_seleccionado,
+            'restaurantes_rechazados': restaurantes_rechazados,
+            'contexto': contexto,
+            'razones_preferencia': razones_preferencia,
+        }])
+    
+    def train_from_feedback_batch(self, feedbacks: List[Dict]):
+        """
+        Entrena con un micro-batch de feedbacks en un único paso vectorizado y
+        los guarda en el historial con una sola escritura.
         
-        # Guardar feedback en historial
-        self.save_feedback(usuario, restaurante_seleccionado, restaurantes_rechazados, contexto, razones_preferencia)
+        Cada feedback es un dict con las claves usuario, restaurante_seleccionado,
+        restaurantes_rechazados, contexto y razones_preferencia.
+        """
+        if not feedbacks:
+            return
+        X, Y, deltas, user_ids = [], [], [], []
+        for fb in feedbacks:
+            # Extraer características y pesos ideales (con razones de preferencia)
+            X.append(self.extract_features(fb['usuario'], fb['restaurante_seleccionado'], fb['contexto']))
+            Y.append(self.compute_ideal_weights_from_feedback(
+                fb['usuario'], fb['restaurante_seleccionado'], fb['restaurantes_rechazados'],
+                fb['contexto'], fb.get('razones_preferencia')
+            ))
+            user_id = fb['usuario'].get('id')
+            delta = self.user_heads.delta(user_id) if self.user_heads is not None else None
+            deltas.append(delta if delta is not None else np.zeros((1, 5)))
+            user_ids.append(user_id)
+        X = np.vstack(X)
+        Y = np.vstack(Y)
+        
+        # Predecir pesos actuales (con el ajuste de cada usuario si tiene head)
+        y_pred, A1, Z1 = self.forward(X, np.vstack(deltas))
+        
+        # Backpropagation: el error se mide sobre la predicción personalizada, así cuando
+        # el head ya ajustó las preferencias del usuario, el modelo global deja de arrastrarse hacia ellas
+        self.backward(X, y_pred, Y, A1, Z1)
+        if self.user_heads is not None:
+            for i, user_id in enumerate(user_ids):
+                self.user_heads.actualizar(user_id, y_pred[i:i + 1] - Y[i:i + 1])
+        
+        # Guardar feedbacks en historial (con snapshot de features para reentrenar offline)
+        registros = [
+            self._registro_feedback(
+                fb['usuario'], fb['restaurante_seleccionado'], fb['restaurantes_rechazados'],
+                fb['contexto'], fb.get('razones_preferencia'), X[i], Y[i]
+            )
+            for i, fb in enumerate(feedbacks)
+        ]
+        if self.feedback_log is not None:
+            self.feedback_log.append_many(registros)
+        else:
+            for registro in registros:
+                self._guardar_en_historial(registro)
     
     def save_feedback(
         self,
@@ -261,20 +403,64 @@ class WeightOptimizerNN:
         restaurante_seleccionado: Dict,
         restaurantes_rechazados: List[Dict],
         contexto: Dict,
-        razones_preferencia: List[str] = None
+        razones_preferencia: List[str] = None,
+        features: Optional[np.ndarray] = None,
+        pesos_ideales: Optional[np.ndarray] = None
     ):
-        """Guarda el feedback en el historial para análisis posterior."""
+        """
+        Guarda el feedback en el historial para análisis posterior.
+        
+        Además de los ids se guarda un snapshot de las features del restaurante
+        seleccionado y de los rechazados, y los pesos ideales calculados, para que
+        el historial pueda reproducirse en un reentrenamiento offline (ver retraining.py).
+        """
+        registro = self._registro_feedback(
+            usuario, restaurante_seleccionado, restaurantes_rechazados, contexto,
+            razones_preferencia, features, pesos_ideales
+        )
+        if self.feedback_log is not None:
+            # Log append-only: costo constante, sin tope de historial
+            self.feedback_log.append(registro)
+        else:
+            self._guardar_en_historial(registro)
+    
+    def _registro_feedback(
+        self,
+        usuario: Dict,
+        restaurante_seleccionado: Dict,
+        restaurantes_rechazados: List[Dict],
+        contexto: Dict,
+        razones_preferencia: Optional[List[str]],
+        features: Optional[np.ndarray],
+        pesos_ideales: Optional[np.ndarray]
+    ) -> Dict:
         from datetime import datetime
         
+        if features is None:
+            features = self.extract_features(usuario, restaurante_seleccionado, contexto)
+        if pesos_ideales is None:
+            pesos_ideales = self.compute_ideal_weights_from_feedback(
+                usuario, restaurante_seleccionado, restaurantes_rechazados, contexto, razones_preferencia
+            )
+        
         feedback = {
             'usuario_id': usuario.get('id', 'anonymous'),
             'restaurante_seleccionado': restaurante_seleccionado.get('id'),
             'restaurantes_rechazados': [r.get('id') for r in restaurantes_rechazados],
             'contexto': contexto,
             'razones_preferencia': razones_preferencia or [],
+            'features_seleccionado': [round(float(x), 6) for x in np.ravel(features)],
+            'features_rechazados': [
+                [round(float(x), 6) for x in self.extract_features(usuario, r, contexto).flatten()]
+                for r in restaurantes_rechazados
+            ],
+            'pesos_ideales': [round(float(x), 6) for x in np.ravel(pesos_ideales)],
             'timestamp': datetime.now().isoformat()
         }
-        
+        return feedback
+    
+    def _guardar_en_historial(self, feedback: Dict):
+        """Formato histórico: reescribe user_feedback_history.json (sin feedback_log)."""
         history = self.load_history()
         history['feedbacks'].append(feedback)
         
@@ -289,7 +475,9 @@ class WeightOptimizerNN:
             print(f"Error guardando historial: {e}")
     
     def load_history(self) -> Dict:
-        """Carga el historial de feedbacks."""
+        """Carga el historial de feedbacks completo en memoria (para streaming usar feedback_log.leer())."""
+        if self.feedback_log is not None:
+            return {'feedbacks': list(self.feedback_log.leer())}
         if self.history_file.exists():
             try:
                 with open(self.history_file, 'r', encoding='utf-8') as f:
@@ -298,35 +486,91 @@ class WeightOptimizerNN:
                 pass
         return {'feedbacks': []}
     
-    def save_model(self, filepath: str = None):
-        """Guarda los pesos de la red neuronal."""
+    def snapshot(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """
+        Copia de parámetros + metadata para guardar. Se toma en el hilo que entrena,
+        así la escritura puede hacerse en otro hilo sin ver parámetros a medio actualizar.
+        """
+        meta = {
+            'version': self.version,
+            'learning_rate': self.learning_rate,
+            'incrementos': dict(self.incrementos),
+            'arquitectura': {
+                'entrada': int(self.W1.shape[0]),
+                'oculta': int(self.W1.shape[1]),
+                'salida': int(self.W2.shape[1]),
+            },
+        }
+        return self.get_params(), meta
+    
+    def save_model(self, filepath: str = None, snapshot: Optional[Tuple[Dict[str, np.ndarray], Dict]] = None) -> Path:
+        """
+        Guarda los pesos de la red neuronal como checkpoint binario (ver checkpoints.py).
+        Sin filepath, agrega un checkpoint nuevo en checkpoint_dir y conserva los
+        últimos para rollback. La escritura es atómica.
+        """
+        params, meta = snapshot if snapshot is not None else self.snapshot()
+        if filepath is None:
+            path = checkpoints.guardar_checkpoint(self.checkpoint_dir, params, meta, retener=self.checkpoints_retenidos)
+        else:
+            path = Path(filepath)
+            checkpoints.escribir_arrays(path, params, meta)
+        print(f"Modelo guardado en {path} (version {meta['version']})")
+        return path
+    
+    def export_json(self, filepath: str = None):
+        """Exporta los pesos como JSON legible (formato histórico de nn_model.json)."""
         if filepath is None:
             filepath = self.model_file
-            
-        model_data = {
-            'W1': self.W1.tolist(),
-            'b1': self.b1.tolist(),
-            'W2': self.W2.tolist(),
-            'b2': self.b2.tolist()
-        }
-        try:
-            with open(filepath, 'w') as f:
-                json.dump(model_data, f, indent=2)
-            print(f"Modelo guardado en {filepath}")
-        except Exception as e:
-            print(f"Error guardando modelo: {e}")
+        params, meta = self.snapshot()
+        model_data = dict(meta)
+        model_data.update({k: v.tolist() for k, v in params.items()})
+        tmp = Path(filepath).with_suffix('.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(model_data, f, indent=2)
+        tmp.replace(filepath)
+        print(f"Modelo exportado a {filepath}")
+    
+    def _aplicar_checkpoint(self, header: Dict, arrays: Dict[str, np.ndarray], copiar: bool = True):
+        for nombre in ('W1', 'b1', 'W2', 'b2'):
+            if nombre not in arrays:
+                raise checkpoints.CheckpointError(f"falta el array {nombre}")
+            setattr(self, nombre, np.array(arrays[nombre], dtype=float) if copiar else arrays[nombre])
+        self.version = int(header.get('version', 0))
+        # Hiperparámetros guardados con el modelo (por ejemplo los elegidos por app/tuning.py)
+        if header.get('learning_rate'):
+            self.learning_rate = float(header['learning_rate'])
+        if isinstance(header.get('incrementos'), dict):
+            self.incrementos = dict(INCREMENTOS_IDEALES, **header['incrementos'])
+        self.revision += 1
+    
+    def load_checkpoint(self, filepath: str, usar_mmap: bool = False):
+        """
+        Carga un checkpoint binario puntual. Con usar_mmap=True los parámetros quedan
+        mapeados en memoria y son de solo lectura (sirve para inferencia, no para entrenar).
+        """
+        header, arrays = checkpoints.leer_arrays(Path(filepath), usar_mmap=usar_mmap)
+        self._aplicar_checkpoint(header, arrays, copiar=not usar_mmap)
+        print(f"Modelo cargado desde {filepath} (version {self.version})")
     
     def load_model_if_exists(self):
-        """Carga los pesos de la red neuronal si existe el archivo."""
+        """
+        Carga el último checkpoint válido (con rollback si el último está corrupto).
+        Si todavía no hay checkpoints, migra desde el nn_model.json histórico.
+        Un archivo existente pero ilegible es un error: no se sigue con pesos aleatorios.
+        """
+        cargado = checkpoints.cargar_ultimo_checkpoint(self.checkpoint_dir)
+        if cargado is not None:
+            path, header, arrays = cargado
+            self._aplicar_checkpoint(header, arrays)
+            print(f"Modelo cargado desde {path} (version {self.version})")
+            return
+        
         if self.model_file.exists():
             try:
                 with open(self.model_file, 'r') as f:
                     model_data = json.load(f)
-                    self.W1 = np.array(model_data['W1'])
-                    self.b1 = np.array(model_data['b1'])
-                    self.W2 = np.array(model_data['W2'])
-                    self.b2 = np.array(model_data['b2'])
-                print(f"Modelo cargado desde {self.model_file}")
-            except Exception as e:
-                print(f"Error cargando modelo: {e}")
-
+                self._aplicar_checkpoint(model_data, model_data)
+            except (ValueError, KeyError) as e:
+                raise checkpoints.CheckpointError(f"nn_model.json ilegible ({e}); no se cargan pesos aleatorios")
+            print(f"Modelo cargado desde {self.model_file} (version {self.version})")
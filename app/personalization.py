@@ -0,0 +1,168 @@
+# app/personalization.py
+# Ajustes personalizados por usuario sobre la red neuronal global.
+#
+# Cada usuario con feedback tiene un "head" chico: un delta sobre el bias de la
+# capa de salida (5 valores, uno por peso wg/wp/wd/wq/wa). La red global sigue
+# siendo compartida; el head solo desplaza los logits de salida para ese usuario.
+#
+# Los heads viven en un LRU acotado en memoria. Al expulsarse del LRU se guardan
+# en disco (un archivo .npy por usuario, en subdirectorios por hash) y se cargan
+# de forma lazy en el primer request. La memoria queda acotada por la capacidad
+# del LRU sin importar cuántos usuarios haya.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+N_SALIDAS = 5
+
+
+class UserHeadStore:
+    """
+    LRU acotado de heads por usuario con persistencia en disco y memo de predicciones.
+
+    - Usuarios fríos (sin head o con menos de `min_feedbacks`) usan el modelo global.
+    - Las predicciones se memorizan por (usuario, vector de features cuantizado),
+      en un segundo LRU acotado.
+    """
+
+    def __init__(
+        self,
+        directorio: Path,
+        capacidad: int = 10000,
+        memo_capacidad: int = 50000,
+        paso_cuantizacion: float = 0.01,
+        learning_rate: float = 0.05,
+        min_feedbacks: int = 1,
+    ):
+        self.directorio = Path(directorio)
+        self.capacidad = capacidad
+        self.memo_capacidad = memo_capacidad
+        self.paso_cuantizacion = paso_cuantizacion
+        self.learning_rate = learning_rate
+        self.min_feedbacks = min_feedbacks
+
+        # user_id -> array [delta_0..delta_4, n_feedbacks] o None (usuario frío, sin archivo)
+        self._heads: "OrderedDict[str, Optional[np.ndarray]]" = OrderedDict()
+        self._sucios = set()
+        # Generación por usuario: invalida el memo cuando cambia su head
+        self._generacion: Dict[str, int] = {}
+        self._memo: "OrderedDict[Tuple, Dict[str, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    # ---------- Persistencia ----------
+    def _archivo(self, user_id: str) -> Path:
+        h = hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+        return self.directorio / h[:2] / f"{h}.npy"
+
+    def _cargar(self, user_id: str) -> Optional[np.ndarray]:
+        archivo = self._archivo(user_id)
+        if not archivo.exists():
+            return None
+        try:
+            head = np.load(archivo)
+            if head.shape == (N_SALIDAS + 1,):
+                return head.astype(float)
+        except Exception as e:
+            print(f"Error cargando head de usuario {user_id}: {e}")
+        return None
+
+    def _guardar(self, user_id: str, head: np.ndarray):
+        archivo = self._archivo(user_id)
+        try:
+            archivo.parent.mkdir(parents=True, exist_ok=True)
+            tmp = archivo.with_suffix('.tmp.npy')
+            np.save(tmp, head)
+            tmp.replace(archivo)
+        except Exception as e:
+            print(f"Error guardando head de usuario {user_id}: {e}")
+
+    def _insertar(self, user_id: str, head: Optional[np.ndarray]):
+        self._heads[user_id] = head
+        self._heads.move_to_end(user_id)
+        while len(self._heads) > self.capacidad:
+            viejo_id, viejo_head = self._heads.popitem(last=False)
+            if viejo_id in self._sucios:
+                self._sucios.discard(viejo_id)
+                self._guardar(viejo_id, viejo_head)
+            self._generacion.pop(viejo_id, None)
+
+    def _obtener_head(self, user_id: str) -> Optional[np.ndarray]:
+        if user_id in self._heads:
+            self._heads.move_to_end(user_id)
+            return self._heads[user_id]
+        head = self._cargar(user_id)
+        self._insertar(user_id, head)
+        return head
+
+    def flush(self):
+        """Guarda en disco todos los heads modificados que siguen en memoria."""
+        with self._lock:
+            for user_id in list(self._sucios):
+                head = self._heads.get(user_id)
+                if head is not None:
+                    self._guardar(user_id, head)
+            self._sucios.clear()
+
+    # ---------- API ----------
+    def delta(self, user_id: Optional[str]) -> Optional[np.ndarray]:
+        """Delta de bias de salida para el usuario, o None si es un usuario frío."""
+        if not user_id:
+            return None
+        with self._lock:
+            head = self._obtener_head(user_id)
+            if head is None or head[N_SALIDAS] < self.min_feedbacks:
+                return None
+            return head[:N_SALIDAS].reshape(1, -1)
+
+    def actualizar(self, user_id: Optional[str], dZ2: np.ndarray):
+        """Paso de gradiente sobre el head del usuario (dZ2 = y_pred - y_true)."""
+        if not user_id:
+            return
+        with self._lock:
+            head = self._obtener_head(user_id)
+            if head is None:
+                head = np.zeros(N_SALIDAS + 1)
+            else:
+                head = head.copy()
+            head[:N_SALIDAS] -= self.learning_rate * np.mean(dZ2, axis=0)
+            head[N_SALIDAS] += 1
+            self._insertar(user_id, head)
+            self._sucios.add(user_id)
+            self._generacion[user_id] = self._generacion.get(user_id, 0) + 1
+
+    def cuantizar(self, features: np.ndarray) -> np.ndarray:
+        """Redondea las features a la grilla del memo."""
+        return np.round(features / self.paso_cuantizacion) * self.paso_cuantizacion
+
+    def memo_clave(self, user_id: Optional[str], features_q: np.ndarray, revision_modelo: int) -> Tuple:
+        uid = user_id or ""
+        pasos = tuple(np.rint(features_q.ravel() / self.paso_cuantizacion).astype(int).tolist())
+        return (uid, self._generacion.get(uid, 0), revision_modelo, pasos)
+
+    def memo_get(self, clave: Tuple) -> Optional[Dict[str, float]]:
+        with self._lock:
+            pesos = self._memo.get(clave)
+            if pesos is not None:
+                self._memo.move_to_end(clave)
+            return pesos
+
+    def memo_set(self, clave: Tuple, pesos: Dict[str, float]):
+        with self._lock:
+            self._memo[clave] = pesos
+            self._memo.move_to_end(clave)
+            while len(self._memo) > self.memo_capacidad:
+                self._memo.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'heads_en_memoria': len(self._heads),
+                'heads_sucios': len(self._sucios),
+                'memo_entradas': len(self._memo),
+                'capacidad': self.capacidad,
+            }
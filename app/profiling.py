@@ -0,0 +1,283 @@
+# app/profiling.py
+# Perfilado por request con muestreo de pilas.
+#
+# Cuando un request es lento no hay forma de ver por qué sin enganchar un
+# profiler al servidor. Con PROFILE_TOKEN configurado, un request con
+# `?profile=1` (o el header X-Profile: 1) y el header X-Profile-Token se perfila
+# solo; además PROFILE_SAMPLE_RATE perfila al azar una fracción del tráfico.
+#
+# Un hilo aparte toma la pila de la tarea del request cada PROFILE_INTERVALO_MS:
+# si la tarea está corriendo se usa la pila real del hilo del event loop (ahí
+# aparecen las llamadas a clipspy y a NumPy), y si está suspendida se recorre la
+# cadena de corrutinas hasta lo que está esperando (por ejemplo un await de
+# httpx). Cada muestra pesa el tiempo real transcurrido desde la anterior.
+#
+# El perfil se guarda en PROFILE_DIR y se descarga como pilas colapsadas
+# (flamegraph.pl, speedscope) o como JSON de speedscope. Apagado no hay hilo ni
+# hooks: el middleware solo mira la query y los headers.
+
+import asyncio
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+# Categorías del resumen según el paquete del frame más interno que las toca
+CATEGORIAS = (
+    ('clips', (os.sep + 'clips' + os.sep,)),
+    ('httpx', (os.sep + 'httpx' + os.sep, os.sep + 'httpcore' + os.sep)),
+    ('numpy', (os.sep + 'numpy' + os.sep,)),
+)
+ESPERA = '[espera]'
+
+
+def _etiqueta(frame) -> Tuple[str, str, int]:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name})", code.co_filename, code.co_firstlineno
+
+
+def categoria(pila: List[Tuple[str, str, int]]) -> str:
+    for nombre, archivo, _ in reversed(pila):
+        for cat, marcas in CATEGORIAS:
+            if any(m in archivo for m in marcas):
+                return cat
+    if pila and pila[-1][0].startswith(ESPERA):
+        return 'espera'
+    return 'python'
+
+
+class PerfilRequest:
+    """Muestrea la pila de una tarea asyncio desde un hilo aparte."""
+
+    def __init__(self, endpoint: str, motivo: str, intervalo: float):
+        self.id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.motivo = motivo  # pedido o muestreo
+        self.intervalo = intervalo
+        self.muestras: Counter = Counter()  # pila (tupla de frames) -> ms
+        self.cantidad = 0
+        self._raiz = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._hilo_loop = None
+        self._fin = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._inicio = 0.0
+        self.duracion = 0.0
+
+    def iniciar(self, raiz):
+        """`raiz` es el frame desde el que se cortan las pilas (el del middleware)."""
+        self._raiz = raiz
+        self._tarea = asyncio.current_task()
+        self._hilo_loop = threading.get_ident()
+        self._inicio = time.perf_counter()
+        self._hilo = threading.Thread(target=self._muestrear, name=f"perfil-{self.id}", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._fin.set()
+        self._hilo.join()
+        self.duracion = time.perf_counter() - self._inicio
+
+    # ---------- Muestreo ----------
+    def _muestrear(self):
+        ultimo = self._inicio
+        while not self._fin.wait(self.intervalo):
+            pila = self._pila()
+            ahora = time.perf_counter()
+            if pila:
+                self.muestras[tuple(pila)] += (ahora - ultimo) * 1000
+                self.cantidad += 1
+            ultimo = ahora
+
+    def _pila(self) -> Optional[List[Tuple[str, str, int]]]:
+        # Tarea corriendo: la pila del hilo del loop llega hasta el frame raíz
+        frame = sys._current_frames().get(self._hilo_loop)
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            if frame is self._raiz:
+                return [_etiqueta(f) for f in reversed(frames)]
+            frame = frame.f_back
+        # Tarea suspendida: cadena de corrutinas desde la raíz hasta lo que espera
+        pila = []
+        coro = self._tarea.get_coro() if self._tarea is not None else None
+        while coro is not None:
+            frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+            if frame is None:
+                break
+            if frame is self._raiz or pila:
+                pila.append(_etiqueta(frame))
+            coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+            if coro is not None and not hasattr(coro, 'cr_frame') and not hasattr(coro, 'gi_frame'):
+                if pila:
+                    pila.append((f"{ESPERA} {type(coro).__name__}", '', 0))
+                break
+        return pila or None
+
+    # ---------- Resultados ----------
+    def resumen(self) -> Dict[str, float]:
+        """ms por categoría: clips, httpx, numpy, espera (otros awaits) y python."""
+        totales: Counter = Counter()
+        for pila, ms in self.muestras.items():
+            totales[categoria(pila)] += ms
+        return {cat: round(ms, 2) for cat, ms in totales.most_common()}
+
+    def a_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'endpoint': self.endpoint,
+            'motivo': self.motivo,
+            'creado': time.time(),
+            'duracion_ms': round(self.duracion * 1000, 2),
+            'intervalo_ms': self.intervalo * 1000,
+            'muestras': self.cantidad,
+            'resumen_ms': self.resumen(),
+            'pilas': [{'frames': [list(f) for f in pila], 'ms': round(ms, 3)}
+                      for pila, ms in self.muestras.most_common()],
+        }
+
+
+def a_colapsado(perfil: Dict) -> str:
+    """Formato de pilas colapsadas: "a;b;c <peso>" por línea (peso en microsegundos)."""
+    lineas = []
+    for p in perfil['pilas']:
+        lineas.append(";".join(f[0] for f in p['frames']) + f" {max(1, round(p['ms'] * 1000))}")
+    return "\n".join(lineas) + "\n"
+
+
+def a_speedscope(perfil: Dict) -> Dict:
+    """Perfil 'sampled' en el formato de archivo de speedscope."""
+    frames: List[Dict] = []
+    indices: Dict[Tuple, int] = {}
+    muestras, pesos = [], []
+    for p in perfil['pilas']:
+        pila = []
+        for nombre, archivo, linea in p['frames']:
+            clave = (nombre, archivo, linea)
+            if clave not in indices:
+                indices[clave] = len(frames)
+                frames.append({'name': nombre, 'file': archivo, 'line': linea})
+            pila.append(indices[clave])
+        muestras.append(pila)
+        pesos.append(p['ms'])
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': f"{perfil['endpoint']} {perfil['id']}",
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(pesos),
+            'samples': muestras,
+            'weights': pesos,
+        }],
+        'name': f"{perfil['endpoint']} {perfil['id']}",
+        'exporter': 'app.profiling',
+    }
+
+
+class Perfilador:
+    """Decide qué requests perfilar y guarda los perfiles en disco (los últimos `max_perfiles`)."""
+
+    def __init__(self, directorio: Path, token: str = "", sample_rate: float = 0.0,
+                 intervalo_ms: float = 2.0, max_perfiles: int = 200):
+        self.directorio = Path(directorio)
+        self.token = token
+        self.sample_rate = sample_rate
+        self.intervalo = max(0.0005, intervalo_ms / 1000)
+        self.max_perfiles = max_perfiles
+
+    @property
+    def activo(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def autorizado(self, token: Optional[str]) -> bool:
+        return bool(self.token) and token is not None and hmac.compare_digest(token, self.token)
+
+    def motivo(self, pedido: bool, token: Optional[str]) -> Optional[str]:
+        """'pedido' o 'muestreo' si hay que perfilar el request, None si no."""
+        if pedido and self.autorizado(token):
+            return 'pedido'
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return 'muestreo'
+        return None
+
+    def guardar(self, perfil: Dict):
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        path = self.directorio / f"{perfil['id']}.json"
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(perfil, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        viejos = sorted(self.directorio.glob('*.json'), key=lambda p: p.stat().st_mtime)
+        for p in viejos[:max(0, len(viejos) - self.max_perfiles)]:
+            p.unlink(missing_ok=True)
+
+    def obtener(self, perfil_id: str) -> Optional[Dict]:
+        if not perfil_id or Path(perfil_id).name != perfil_id:
+            return None
+        path = self.directorio / f"{perfil_id}.json"
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def listar(self) -> List[Dict]:
+        perfiles = []
+        for path in sorted(self.directorio.glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    perfil = json.load(f)
+            except (OSError, ValueError):
+                continue
+            perfiles.append({k: perfil[k] for k in ('id', 'endpoint', 'motivo', 'creado', 'duracion_ms', 'resumen_ms')})
+        return perfiles
+
+
+class MiddlewarePerfilado:
+    """Middleware ASGI: perfila los requests pedidos o muestreados y agrega X-Profile-Id."""
+
+    def __init__(self, app, perfilador: Perfilador):
+        self.app = app
+        self.perfilador = perfilador
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.perfilador.activo:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get('headers') or [])
+        query = scope.get('query_string', b'')
+        pedido = headers.get(b'x-profile') == b'1' or (
+            b'profile' in query and parse_qs(query.decode('latin-1')).get('profile') == ['1'])
+        token = headers.get(b'x-profile-token')
+        motivo = self.perfilador.motivo(pedido, token.decode('latin-1') if token else None)
+        if motivo is None:
+            await self.app(scope, receive, send)
+            return
+
+        perfil = PerfilRequest(scope.get('path', ''), motivo, self.perfilador.intervalo)
+
+        async def send_con_id(mensaje):
+            if mensaje['type'] == 'http.response.start':
+                mensaje = dict(mensaje)
+                mensaje['headers'] = list(mensaje.get('headers') or []) + [(b'x-profile-id', perfil.id.encode())]
+            await send(mensaje)
+
+        perfil.iniciar(sys._getframe())
+        try:
+            await self.app(scope, receive, send_con_id)
+        finally:
+            perfil.detener()
+            datos = perfil.a_dict()
+            await asyncio.to_thread(self.perfilador.guardar, datos)
+            print(f"DEBUG: Perfil {perfil.id} ({motivo}) de {perfil.endpoint}: "
+                  f"{datos['duracion_ms']:.0f}ms, {perfil.cantidad} muestras, {datos['resumen_ms']}")
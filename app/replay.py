@@ -0,0 +1,219 @@
+# app/replay.py
+# Reproduce el tráfico capturado por capture.py y compara rankings entre builds.
+#
+# Uso:
+#   # Contra un servidor corriendo, al doble de la velocidad original
+#   python -m app.replay run capturas/requests.jsonl --url http://localhost:8000 --speed 2 --out a.jsonl
+#
+#   # En proceso (sin levantar uvicorn), opcionalmente con otro ruleset
+#   python -m app.replay run capturas/requests.jsonl --in-process --clp tpo_gastronomico_v3_2.clp --out b.jsonl
+#
+#   # Diferencias de ranking entre dos corridas (dos builds o dos rulesets)
+#   python -m app.replay diff a.jsonl b.jsonl --k 10
+#
+# --speed 0 dispara todo lo más rápido posible (acotado por --concurrency).
+# Los requests de /api/feedback modifican el modelo del servidor destino; con
+# --solo-recommend se omiten.
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+ENDPOINTS = ("/api/recommend", "/api/feedback")
+
+
+def leer_capturas(path: Path, solo_recommend: bool = False) -> Iterator[Dict]:
+    """Lee un JSONL de capturas (y sus rotaciones .1, .2, ... de la más vieja a la más nueva)."""
+    path = Path(path)
+    rotados = sorted(path.parent.glob(path.name + ".*"), key=lambda p: -int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0)
+    for archivo in rotados + [path]:
+        if not archivo.exists():
+            continue
+        with open(archivo, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue
+                if registro.get("endpoint") not in ENDPOINTS:
+                    continue
+                if solo_recommend and registro["endpoint"] != "/api/recommend":
+                    continue
+                yield registro
+
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = min(len(ordenados) - 1, max(0, int(round(p / 100 * (len(ordenados) - 1)))))
+    return ordenados[k]
+
+
+def reporte_latencias(resultados: List[Dict]) -> str:
+    lineas = []
+    for endpoint in ENDPOINTS:
+        lat = [r["latencia_ms"] for r in resultados if r["endpoint"] == endpoint]
+        if not lat:
+            continue
+        errores = sum(1 for r in resultados if r["endpoint"] == endpoint and not 200 <= r["status"] < 300)
+        lineas.append(
+            f"{endpoint}: n={len(lat)} errores={errores} "
+            f"p50={percentil(lat, 50):.1f}ms p90={percentil(lat, 90):.1f}ms "
+            f"p99={percentil(lat, 99):.1f}ms max={max(lat):.1f}ms"
+        )
+    return "\n".join(lineas)
+
+
+@contextlib.asynccontextmanager
+async def _cliente(url: Optional[str], clp: Optional[str]):
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=60.0) as client:
+            yield client
+        return
+    # En proceso: importar la app con el ruleset pedido y correr su lifespan (cola de feedback, etc.)
+    if clp:
+        os.environ["CLP_PATH"] = str(Path(clp).resolve())
+    with contextlib.redirect_stdout(io.StringIO()):
+        from .main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=60.0) as client:
+            yield client
+
+
+async def _enviar(client: httpx.AsyncClient, i: int, registro: Dict, sem: asyncio.Semaphore) -> Dict:
+    async with sem:
+        inicio = time.perf_counter()
+        try:
+            resp = await client.post(registro["endpoint"], json=registro["body"])
+            status = resp.status_code
+            datos = resp.json() if status == 200 else None
+        except Exception as e:
+            status, datos = 0, None
+            print(f"Error en request {i}: {e}", file=sys.stderr)
+        latencia = (time.perf_counter() - inicio) * 1000
+    resultado = {"i": i, "endpoint": registro["endpoint"], "status": status, "latencia_ms": round(latencia, 3)}
+    if registro["endpoint"] == "/api/recommend" and isinstance(datos, list):
+        resultado["ranking"] = [r.get("id") for r in datos]
+        resultado["U"] = [r.get("U") for r in datos]
+    return resultado
+
+
+async def reproducir(
+    capturas: List[Dict],
+    url: Optional[str] = None,
+    clp: Optional[str] = None,
+    speed: float = 1.0,
+    concurrency: int = 32,
+) -> List[Dict]:
+    """Re-emite las capturas respetando los intervalos originales divididos por `speed`."""
+    sem = asyncio.Semaphore(concurrency)
+    # Con la salida de DEBUG del servidor en proceso, los resultados no se leerían
+    silencio = contextlib.redirect_stdout(io.StringIO()) if not url else contextlib.nullcontext()
+    with silencio:
+        async with _cliente(url, clp) as client:
+            t0_original = capturas[0]["ts"] if capturas else 0.0
+            t0 = time.perf_counter()
+            tareas = []
+            for i, registro in enumerate(capturas):
+                if speed > 0:
+                    espera = (registro["ts"] - t0_original) / speed - (time.perf_counter() - t0)
+                    if espera > 0:
+                        await asyncio.sleep(espera)
+                tareas.append(asyncio.create_task(_enviar(client, i, registro, sem)))
+            resultados = await asyncio.gather(*tareas)
+    return sorted(resultados, key=lambda r: r["i"])
+
+
+def comparar(a: List[Dict], b: List[Dict], k: int = 10) -> Dict:
+    """Compara rankings de dos corridas request por request."""
+    por_i = {r["i"]: r for r in b}
+    comparados = iguales = iguales_topk = 0
+    solapamiento = 0.0
+    diferencias = []
+    for ra in a:
+        rb = por_i.get(ra["i"])
+        if rb is None or "ranking" not in ra or "ranking" not in rb:
+            continue
+        comparados += 1
+        top_a, top_b = ra["ranking"][:k], rb["ranking"][:k]
+        if ra["ranking"] == rb["ranking"]:
+            iguales += 1
+        if top_a == top_b:
+            iguales_topk += 1
+        elif len(diferencias) < 10:
+            diferencias.append({"i": ra["i"], "a": top_a, "b": top_b})
+        if top_a or top_b:
+            solapamiento += len(set(top_a) & set(top_b)) / max(len(top_a), len(top_b))
+        else:
+            solapamiento += 1.0
+    return {
+        "comparados": comparados,
+        "rankings_identicos": iguales,
+        f"top{k}_identicos": iguales_topk,
+        f"solapamiento_medio_top{k}": round(solapamiento / comparados, 4) if comparados else None,
+        "ejemplos_diferencias": diferencias,
+    }
+
+
+def _leer_resultados(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay de tráfico capturado y comparación de rankings")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_run = sub.add_parser("run", help="Reproduce las capturas contra un servidor o en proceso")
+    p_run.add_argument("capturas")
+    destino = p_run.add_mutually_exclusive_group(required=True)
+    destino.add_argument("--url", help="URL base de un servidor corriendo")
+    destino.add_argument("--in-process", action="store_true", help="Usar la app en este proceso")
+    p_run.add_argument("--clp", help="Ruleset a usar en modo --in-process")
+    p_run.add_argument("--speed", type=float, default=1.0, help="Multiplicador de velocidad (0 = sin esperas)")
+    p_run.add_argument("--concurrency", type=int, default=32)
+    p_run.add_argument("--limit", type=int, default=None)
+    p_run.add_argument("--solo-recommend", action="store_true")
+    p_run.add_argument("--out", help="Archivo JSONL con los resultados (para diff)")
+
+    p_diff = sub.add_parser("diff", help="Compara los rankings de dos corridas")
+    p_diff.add_argument("a")
+    p_diff.add_argument("b")
+    p_diff.add_argument("--k", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.comando == "run":
+        capturas = list(leer_capturas(Path(args.capturas), args.solo_recommend))
+        if args.limit:
+            capturas = capturas[:args.limit]
+        if not capturas:
+            print("No hay capturas para reproducir")
+            return
+        inicio = time.perf_counter()
+        resultados = asyncio.run(reproducir(
+            capturas, url=args.url, clp=args.clp, speed=args.speed, concurrency=args.concurrency,
+        ))
+        duracion = time.perf_counter() - inicio
+        print(f"{len(resultados)} requests en {duracion:.2f}s ({len(resultados) / duracion:.1f} req/s)")
+        print(reporte_latencias(resultados))
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                for r in resultados:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    else:
+        print(json.dumps(comparar(_leer_resultados(args.a), _leer_resultados(args.b), args.k), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
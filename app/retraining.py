@@ -0,0 +1,213 @@
+# app/retraining.py
+# Reentrenamiento offline de WeightOptimizerNN a partir del historial de feedback.
+#
+# El entrenamiento online (train_from_feedback) da un solo paso de SGD por feedback.
+# Este job reproduce el historial completo (snapshots de features del seleccionado
+# y de los rechazados, con los pesos ideales recalculados con los incrementos
+# vigentes), entrena varias épocas con mini-batches mezclados y early stopping
+# sobre un holdout de validación, y solo publica una nueva versión del modelo si
+# mejora la pérdida sobre un holdout de test aparte: la validación ya se usó para
+# elegir la época y compararla ahí favorecería siempre al candidato.
+#
+# Mientras corre, el servidor pausa el consumidor de la cola de feedback (ver
+# main._correr_reentrenamiento): el job parte de los parámetros publicados y,
+# si el modelo cambiara en el medio, publicarlo pisaría esos pasos online.
+#
+# Uso como CLI:
+#   python -m app.retraining --epochs 200 --batch-size 32
+
+import argparse
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from .feedback_log import leer_registros
+from .neural_network import WeightOptimizerNN, pesos_ideales
+
+BASE_DIR = Path(__file__).parent.parent
+FEEDBACK_DIR = BASE_DIR / "feedback_log"
+
+
+def cargar_dataset(
+    feedbacks: Iterable[Dict],
+    incrementos: Optional[Dict[str, float]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Arma las matrices X (n x 5) e Y (n x 5) a partir de los feedbacks (se consumen en streaming).
+    Y se recalcula con pesos_ideales() a partir de las features del seleccionado, el
+    promedio de las de los rechazados y las razones, con los incrementos dados (los
+    del modelo), así un cambio de incrementos (ver tuning.py) se aplica a todo el
+    historial. Los feedbacks viejos que solo guardan ids (sin snapshot de features) se ignoran.
+    """
+    X, Y = [], []
+    for fb in feedbacks:
+        features = fb.get('features_seleccionado')
+        if not features or len(features) != 5:
+            continue
+        rechazados = [r for r in fb.get('features_rechazados') or [] if len(r) == 5]
+        X.append(features)
+        Y.append(pesos_ideales(
+            np.array(features, dtype=float),
+            np.mean(np.array(rechazados, dtype=float), axis=0) if rechazados else None,
+            fb.get('razones_preferencia'),
+            incrementos,
+        ))
+    if not X:
+        return np.zeros((0, 5)), np.zeros((0, 5))
+    return np.array(X, dtype=float), np.array(Y, dtype=float)
+
+
+def dividir_holdout(X: np.ndarray, Y: np.ndarray, holdout: float, rng: np.random.Generator):
+    """Separa un holdout aleatorio para validación (al menos 1 muestra en cada lado)."""
+    n = len(X)
+    idx = rng.permutation(n)
+    n_val = min(max(1, int(round(n * holdout))), n - 1)
+    val, train = idx[:n_val], idx[n_val:]
+    return X[train], Y[train], X[val], Y[val]
+
+
+def dividir_train_val_test(X: np.ndarray, Y: np.ndarray, holdout: float, test: float,
+                           rng: np.random.Generator):
+    """
+    Separa train, validación (early stopping) y test (decisión de publicar), con
+    al menos 1 muestra en cada parte. Necesita 3 muestras o más.
+    """
+    X_resto, Y_resto, X_test, Y_test = dividir_holdout(X, Y, test, rng)
+    X_train, Y_train, X_val, Y_val = dividir_holdout(X_resto, Y_resto, holdout / max(1e-9, 1.0 - test), rng)
+    return X_train, Y_train, X_val, Y_val, X_test, Y_test
+
+
+def entrenar(
+    modelo: WeightOptimizerNN,
+    X_train: np.ndarray,
+    Y_train: np.ndarray,
+    X_val: np.ndarray,
+    Y_val: np.ndarray,
+    epochs: int = 200,
+    batch_size: int = 32,
+    patience: int = 15,
+    rng: Optional[np.random.Generator] = None,
+) -> Dict:
+    """
+    Entrenamiento multi-época con mini-batches mezclados y early stopping.
+    Al terminar, el modelo queda con los parámetros de la mejor época de validación.
+    """
+    rng = rng or np.random.default_rng()
+    mejor_loss = modelo.loss(X_val, Y_val)
+    mejores_params = modelo.get_params()
+    mejor_epoch = 0
+    sin_mejora = 0
+    epoch = 0
+
+    for epoch in range(1, epochs + 1):
+        orden = rng.permutation(len(X_train))
+        for inicio in range(0, len(orden), batch_size):
+            batch = orden[inicio:inicio + batch_size]
+            modelo.train_batch(X_train[batch], Y_train[batch])
+
+        val_loss = modelo.loss(X_val, Y_val)
+        if val_loss < mejor_loss - 1e-6:
+            mejor_loss = val_loss
+            mejores_params = modelo.get_params()
+            mejor_epoch = epoch
+            sin_mejora = 0
+        else:
+            sin_mejora += 1
+            if sin_mejora >= patience:
+                break
+
+    modelo.set_params(mejores_params)
+    return {'val_loss': mejor_loss, 'mejor_epoch': mejor_epoch, 'epochs_ejecutadas': epoch}
+
+
+def ejecutar_reentrenamiento(
+    params_actuales: Dict[str, np.ndarray],
+    learning_rate: float = 0.01,
+    feedback_dir: str = str(FEEDBACK_DIR),
+    epochs: int = 200,
+    batch_size: int = 32,
+    holdout: float = 0.2,
+    test: float = 0.2,
+    patience: int = 15,
+    min_muestras: int = 10,
+    seed: Optional[int] = None,
+    incrementos: Optional[Dict[str, float]] = None,
+) -> Dict:
+    """
+    Job de reentrenamiento. Pensado para correr en un proceso aparte
+    (ProcessPoolExecutor), por eso recibe y devuelve solo datos serializables.
+
+    Devuelve un dict con 'publicar' (bool), las métricas y, si mejoró,
+    los nuevos parámetros en 'params'. Quien lo llama decide cómo publicarlos.
+    """
+    X, Y = cargar_dataset(leer_registros(Path(feedback_dir)), incrementos)
+    if len(X) < max(3, min_muestras):
+        return {
+            'publicar': False,
+            'motivo': f"muestras insuficientes ({len(X)} < {max(3, min_muestras)})",
+            'muestras': int(len(X)),
+        }
+
+    rng = np.random.default_rng(seed)
+    X_train, Y_train, X_val, Y_val, X_test, Y_test = dividir_train_val_test(X, Y, holdout, test, rng)
+
+    # Referencia: el modelo actualmente publicado, evaluado sobre el test
+    actual = WeightOptimizerNN(learning_rate=learning_rate, cargar_modelo=False)
+    actual.set_params(params_actuales)
+    test_loss_actual = actual.loss(X_test, Y_test)
+
+    # Se parte del modelo actual (warm start); la validación solo elige la época
+    candidato = WeightOptimizerNN(learning_rate=learning_rate, cargar_modelo=False)
+    candidato.set_params(params_actuales)
+    resultado = entrenar(candidato, X_train, Y_train, X_val, Y_val, epochs, batch_size, patience, rng)
+    resultado['test_loss'] = candidato.loss(X_test, Y_test)
+
+    mejora = resultado['test_loss'] < test_loss_actual - 1e-6
+    resultado.update({
+        'publicar': bool(mejora),
+        'motivo': "mejora en test" if mejora else "sin mejora en test",
+        'test_loss_actual': test_loss_actual,
+        'muestras': int(len(X)),
+        'muestras_validacion': int(len(X_val)),
+        'muestras_test': int(len(X_test)),
+    })
+    if mejora:
+        resultado['params'] = candidato.get_params()
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reentrena la red neuronal con el historial de feedback")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--test", type=float, default=0.2)
+    parser.add_argument("--patience", type=int, default=15)
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    modelo = WeightOptimizerNN(learning_rate=args.learning_rate)
+    resultado = ejecutar_reentrenamiento(
+        modelo.get_params(),
+        learning_rate=args.learning_rate,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        holdout=args.holdout,
+        test=args.test,
+        patience=args.patience,
+        seed=args.seed,
+        incrementos=modelo.incrementos,
+    )
+    print(f"Reentrenamiento: {resultado['motivo']} (muestras: {resultado['muestras']})")
+    if resultado['publicar']:
+        print(f"  test_loss {resultado['test_loss_actual']:.4f} -> {resultado['test_loss']:.4f} "
+              f"(mejor época {resultado['mejor_epoch']}, val_loss {resultado['val_loss']:.4f})")
+        modelo.set_params(resultado['params'])
+        modelo.version += 1
+        modelo.save_model()
+
+
+if __name__ == "__main__":
+    main()
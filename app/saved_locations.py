@@ -0,0 +1,412 @@
+# app/saved_locations.py
+# Ubicaciones guardadas por usuario con tiempos de viaje precalculados.
+#
+# La mayoría de los usuarios recomienda siempre desde las mismas una o dos
+# direcciones (casa, trabajo), y cada /api/recommend con `direccion` volvía a
+# mandar esa dirección a Distance Matrix una vez por restaurante. Acá cada
+# usuario (por Usuario.id) guarda sus ubicaciones con un nombre; se geocodifican
+# una sola vez al guardarlas y se mantiene en segundo plano un perfil por modo
+# de Google Maps: los minutos de viaje desde la ubicación hasta cada
+# restaurante del catálogo al alcance (tiempo_max de referencia por la
+# velocidad del modo, como en el índice espacial). Un request desde una
+# ubicación guardada toma los tiempos del perfil sin consultar a Google.
+#
+# El perfil se mantiene incrementalmente: es listener del catálogo, así un
+# restaurante nuevo o con otra dirección queda pendiente, y cada tiempo se
+# vuelve a consultar cuando pasa el TTL (el tránsito cambia). Las consultas van
+# de a DESTINOS_POR_CONSULTA destinos por request a Distance Matrix, con un
+# máximo de consultas por ciclo.
+#
+# En disco: `ubicaciones.json` con las ubicaciones y un archivo por perfil en
+# `perfiles/` con el formato de checkpoints.py. Solo el proceso que mantiene el
+# catálogo actualiza los perfiles; los demás workers releen los archivos cuando
+# cambian.
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from .bulk_import import normalizar_direccion
+from .catalog import CatalogListener
+from .checkpoints import CheckpointError, escribir_arrays, leer_arrays
+from .spatial import distancias_km, radio_alcance_km
+
+DISTANCE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+DESTINOS_POR_CONSULTA = 25  # máximo de destinos por request de Distance Matrix
+REINTENTOS_DISTANCE_MATRIX = 3
+SIN_RUTA = 999.0  # mismo valor que usa /api/recommend cuando Google no da un tiempo
+ESTADOS_SIN_RUTA = ("NOT_FOUND", "ZERO_RESULTS")
+ARCHIVO = "ubicaciones.json"
+
+
+async def consultar_tiempos(client: httpx.AsyncClient, api_key: str, origen: str,
+                            destinos: List[str], modo: str) -> List[Optional[float]]:
+    """
+    Minutos de viaje de `origen` a cada destino (una consulta a Distance Matrix).
+    SIN_RUTA si Google no encuentra la ruta; None si la consulta falló y hay que reintentar.
+    """
+    for intento in range(REINTENTOS_DISTANCE_MATRIX):
+        try:
+            response = await client.get(DISTANCE_MATRIX_URL, params={
+                "origins": origen,
+                "destinations": "|".join(destinos),
+                "mode": modo,
+                "key": api_key,
+                "language": "es",
+            })
+            data = response.json()
+        except Exception as e:
+            print(f"DEBUG: Error consultando Distance Matrix desde '{origen}': {e}")
+            await asyncio.sleep(2 ** intento)
+            continue
+        status = data.get("status")
+        if status == "OK" and data.get("rows"):
+            tiempos = []
+            for elemento in data["rows"][0].get("elements", []):
+                if elemento.get("status") == "OK":
+                    tiempos.append(elemento.get("duration", {}).get("value", 0) / 60)
+                else:
+                    tiempos.append(SIN_RUTA if elemento.get("status") in ESTADOS_SIN_RUTA else None)
+            return (tiempos + [None] * len(destinos))[:len(destinos)]
+        if status in ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR"):
+            await asyncio.sleep(2 ** intento)
+            continue
+        print(f"DEBUG: Error en Distance Matrix - Status: {status}, Error: {data.get('error_message', 'N/A')}")
+        break
+    return [None] * len(destinos)
+
+
+class PerfilTiempos:
+    """Minutos de viaje desde una ubicación guardada a los restaurantes al alcance, con un modo."""
+
+    def __init__(self, modo: str):
+        self.modo = modo
+        self.tiempos: Dict[str, float] = {}
+        self.destinos: Dict[str, str] = {}  # dirección del restaurante con la que se calculó cada tiempo
+        self.calculados: Dict[str, float] = {}  # momento de cada consulta (epoch)
+
+    def __len__(self) -> int:
+        return len(self.tiempos)
+
+    def tiempo(self, rest_id: str, direccion: Optional[str]) -> Optional[float]:
+        """Tiempo guardado, solo si se calculó con la dirección actual del restaurante."""
+        if direccion is None or self.destinos.get(rest_id) != direccion:
+            return None
+        return self.tiempos.get(rest_id)
+
+    def asignar(self, rest_id: str, direccion: str, minutos: float, momento: float):
+        self.tiempos[rest_id] = minutos
+        self.destinos[rest_id] = direccion
+        self.calculados[rest_id] = momento
+
+    def quitar(self, rest_id: str):
+        self.tiempos.pop(rest_id, None)
+        self.destinos.pop(rest_id, None)
+        self.calculados.pop(rest_id, None)
+
+
+class UbicacionGuardada:
+    """Dirección con nombre de un usuario y sus perfiles de tiempos por modo."""
+
+    def __init__(self, usuario_id: str, nombre: str, direccion: str,
+                 latitud: Optional[float] = None, longitud: Optional[float] = None,
+                 modos: Optional[List[str]] = None):
+        self.usuario_id = usuario_id
+        self.nombre = nombre
+        self.direccion = direccion
+        self.latitud = latitud
+        self.longitud = longitud
+        self.modos: List[str] = list(dict.fromkeys(modos or []))
+        self.perfiles: Dict[str, PerfilTiempos] = {}
+
+    @property
+    def clave(self) -> Tuple[str, str]:
+        return self.usuario_id, self.nombre
+
+    def a_dict(self) -> Dict:
+        return {
+            'usuario_id': self.usuario_id,
+            'nombre': self.nombre,
+            'direccion': self.direccion,
+            'latitud': self.latitud,
+            'longitud': self.longitud,
+            'modos': self.modos,
+        }
+
+    @classmethod
+    def desde_dict(cls, d: Dict) -> 'UbicacionGuardada':
+        return cls(d['usuario_id'], d['nombre'], d['direccion'], d.get('latitud'), d.get('longitud'), d.get('modos'))
+
+
+class UbicacionesGuardadas(CatalogListener):
+    """Ubicaciones guardadas de todos los usuarios, persistidas en `directorio`."""
+
+    def __init__(
+        self,
+        directorio: Path,
+        tiempo_max: float = 60.0,
+        margen: float = 2.0,
+        ttl: float = 7 * 24 * 3600,
+        consultas_por_ciclo: int = 40,
+    ):
+        self.directorio = Path(directorio)
+        self.archivo = self.directorio / ARCHIVO
+        self.tiempo_max = tiempo_max  # minutos que cubre cada perfil
+        self.margen = margen
+        self.ttl = ttl
+        self.consultas_por_ciclo = consultas_por_ciclo
+        self.consultas = 0
+        self._ubicaciones: Dict[Tuple[str, str], UbicacionGuardada] = {}
+        self._mtime: Optional[float] = None
+        self._perfiles_mtime: Dict[Tuple[str, str, str], float] = {}
+        # Catálogo visto como listener: id -> (dirección, lat, lon); columnas armadas en el primer uso
+        self._catalogo: Dict[str, Tuple[Optional[str], float, float]] = {}
+        self._columnas = None
+        self.recargar_si_cambio()
+
+    # ---------- Persistencia ----------
+    def recargar_si_cambio(self):
+        """Relee ubicaciones.json si otro proceso lo modificó (conserva los perfiles cargados)."""
+        try:
+            mtime = self.archivo.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.archivo, "r", encoding="utf-8") as f:
+                registros = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: no se pudo leer {self.archivo}: {e}")
+            return
+        anteriores = self._ubicaciones
+        self._ubicaciones = {}
+        for d in registros:
+            ubic = UbicacionGuardada.desde_dict(d)
+            previa = anteriores.get(ubic.clave)
+            if previa is not None and previa.direccion == ubic.direccion:
+                ubic.perfiles = previa.perfiles
+            self._ubicaciones[ubic.clave] = ubic
+        self._mtime = mtime
+
+    def _guardar_indice(self):
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        tmp = self.archivo.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump([u.a_dict() for u in self._ubicaciones.values()], f, ensure_ascii=False)
+        os.replace(tmp, self.archivo)
+        self._mtime = self.archivo.stat().st_mtime
+
+    def _path_perfil(self, ubic: UbicacionGuardada, modo: str) -> Path:
+        h = hashlib.sha1(f"{ubic.usuario_id}\0{ubic.nombre}\0{modo}".encode("utf-8")).hexdigest()
+        return self.directorio / "perfiles" / f"{h}.bin"
+
+    def _escribir_perfil(self, path: Path, arrays: Dict[str, np.ndarray], meta: Dict):
+        escribir_arrays(path, arrays, meta)
+
+    def _exportar_perfil(self, ubic: UbicacionGuardada, perfil: PerfilTiempos) -> Tuple[Dict[str, np.ndarray], Dict]:
+        ids = list(perfil.tiempos)
+        arrays = {
+            'tiempos': np.array([perfil.tiempos[i] for i in ids], dtype=np.float32),
+            'calculados': np.array([perfil.calculados[i] for i in ids], dtype=np.float64),
+        }
+        meta = {
+            'usuario_id': ubic.usuario_id,
+            'nombre': ubic.nombre,
+            'direccion': ubic.direccion,
+            'modo': perfil.modo,
+            'ids': ids,
+            'destinos': [perfil.destinos[i] for i in ids],
+        }
+        return arrays, meta
+
+    def perfil(self, ubic: UbicacionGuardada, modo: str) -> Optional[PerfilTiempos]:
+        """Perfil de la ubicación para el modo (releído del disco si cambió). None si todavía no hay."""
+        path = self._path_perfil(ubic, modo)
+        clave = ubic.clave + (modo,)
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return ubic.perfiles.get(modo)
+        if self._perfiles_mtime.get(clave) != mtime:
+            try:
+                meta, arrays = leer_arrays(path)
+            except (CheckpointError, OSError) as e:
+                print(f"WARNING: no se pudo leer el perfil de tiempos {path.name}: {e}")
+                return ubic.perfiles.get(modo)
+            if meta.get('direccion') == ubic.direccion:
+                perfil = PerfilTiempos(modo)
+                for rest_id, destino, minutos, momento in zip(
+                        meta['ids'], meta['destinos'], arrays['tiempos'].tolist(), arrays['calculados'].tolist()):
+                    perfil.asignar(rest_id, destino, minutos, momento)
+                ubic.perfiles[modo] = perfil
+            self._perfiles_mtime[clave] = mtime
+        return ubic.perfiles.get(modo)
+
+    # ---------- Ubicaciones ----------
+    def obtener(self, usuario_id: str, nombre: str) -> Optional[UbicacionGuardada]:
+        return self._ubicaciones.get((usuario_id, nombre))
+
+    def por_direccion(self, usuario_id: str, direccion: str) -> Optional[UbicacionGuardada]:
+        """Ubicación del usuario con la misma dirección (sin distinguir mayúsculas ni espacios)."""
+        buscada = normalizar_direccion(direccion)
+        for ubic in self._ubicaciones.values():
+            if ubic.usuario_id == usuario_id and normalizar_direccion(ubic.direccion) == buscada:
+                return ubic
+        return None
+
+    def de_usuario(self, usuario_id: str) -> List[UbicacionGuardada]:
+        return [u for u in self._ubicaciones.values() if u.usuario_id == usuario_id]
+
+    def guardar(self, ubic: UbicacionGuardada) -> UbicacionGuardada:
+        """Alta o modificación. Con la misma dirección se conservan los perfiles y se suman los modos."""
+        self.recargar_si_cambio()
+        previa = self._ubicaciones.get(ubic.clave)
+        if previa is not None and previa.direccion == ubic.direccion:
+            ubic.perfiles = previa.perfiles
+            ubic.modos = list(dict.fromkeys(previa.modos + ubic.modos))
+        elif previa is not None:
+            self._borrar_perfiles(previa)
+        self._ubicaciones[ubic.clave] = ubic
+        self._guardar_indice()
+        return ubic
+
+    def agregar_modo(self, ubic: UbicacionGuardada, modo: str):
+        """Suma un modo a mantener (el perfil se calcula en el próximo ciclo)."""
+        if modo not in ubic.modos:
+            ubic.modos.append(modo)
+            self._guardar_indice()
+
+    def eliminar(self, usuario_id: str, nombre: str) -> bool:
+        self.recargar_si_cambio()
+        ubic = self._ubicaciones.pop((usuario_id, nombre), None)
+        if ubic is None:
+            return False
+        self._borrar_perfiles(ubic)
+        self._guardar_indice()
+        return True
+
+    def _borrar_perfiles(self, ubic: UbicacionGuardada):
+        for modo in ubic.modos:
+            self._path_perfil(ubic, modo).unlink(missing_ok=True)
+            self._perfiles_mtime.pop(ubic.clave + (modo,), None)
+        ubic.perfiles = {}
+
+    def estado(self, ubic: UbicacionGuardada) -> Dict:
+        ahora = time.time()
+        perfiles = {}
+        for modo in ubic.modos:
+            perfil = self.perfil(ubic, modo)
+            calculados = list(perfil.calculados.values()) if perfil is not None else []
+            perfiles[modo] = {
+                'restaurantes': len(calculados),
+                'antiguedad_max_s': round(ahora - min(calculados)) if calculados else None,
+            }
+        return dict(ubic.a_dict(), perfiles=perfiles)
+
+    # ---------- Listener del catálogo ----------
+    def al_reiniciar(self, restaurantes: List[Dict]):
+        self._catalogo = {}
+        for r in restaurantes:
+            self.al_actualizar(r)
+
+    def al_actualizar(self, restaurante: Dict):
+        lat, lon = restaurante.get('latitud'), restaurante.get('longitud')
+        coords = (float(lat), float(lon)) if lat and lon else (math.nan, math.nan)
+        self._catalogo[restaurante['id']] = (restaurante.get('direccion'),) + coords
+        self._columnas = None
+
+    def al_eliminar(self, rest_id: str):
+        self._catalogo.pop(rest_id, None)
+        self._columnas = None
+
+    def _alcanzables(self, ubic: UbicacionGuardada, modo: str) -> Dict[str, str]:
+        """
+        id -> dirección de los restaurantes al alcance de la ubicación con el
+        modo, del más cercano al más lejano; al final los que no tienen coordenadas.
+        """
+        if self._columnas is None:
+            ids = [i for i, (direccion, _, _) in self._catalogo.items() if direccion]
+            self._columnas = (
+                ids,
+                np.array([self._catalogo[i][1] for i in ids], dtype=float),
+                np.array([self._catalogo[i][2] for i in ids], dtype=float),
+            )
+        ids, lats, lons = self._columnas
+        radio = radio_alcance_km(self.tiempo_max, modo, self.margen)
+        if not ubic.latitud or not ubic.longitud or radio is None:
+            orden = np.arange(len(ids))
+        else:
+            dist = distancias_km(ubic.latitud, ubic.longitud, lats, lons)
+            sin_coordenadas = np.isnan(dist)
+            cerca = np.flatnonzero(dist <= radio)
+            orden = np.concatenate((cerca[np.argsort(dist[cerca], kind='stable')], np.flatnonzero(sin_coordenadas)))
+        return {ids[i]: self._catalogo[ids[i]][0] for i in orden.tolist()}
+
+    # ---------- Mantenimiento ----------
+    async def actualizar(self, api_key: str) -> int:
+        """
+        Un ciclo de mantenimiento: consulta (a lo sumo consultas_por_ciclo
+        veces) los tiempos que faltan, cuya dirección cambió o que pasaron el
+        TTL, y quita los de restaurantes que ya no están al alcance. Devuelve
+        la cantidad de consultas hechas.
+        """
+        self.recargar_si_cambio()
+        restantes = self.consultas_por_ciclo
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            for ubic in list(self._ubicaciones.values()):
+                for modo in list(ubic.modos):
+                    if restantes <= 0:
+                        return self.consultas_por_ciclo
+                    perfil = self.perfil(ubic, modo)
+                    if perfil is None:
+                        perfil = ubic.perfiles[modo] = PerfilTiempos(modo)
+                    alcanzables = self._alcanzables(ubic, modo)
+                    ahora = time.time()
+                    sobrantes = [i for i in perfil.tiempos if i not in alcanzables]
+                    faltan = [(i, d) for i, d in alcanzables.items()
+                              if perfil.destinos.get(i) != d or ahora - perfil.calculados[i] > self.ttl]
+                    if not faltan and not sobrantes:
+                        continue
+                    for rest_id in sobrantes:
+                        perfil.quitar(rest_id)
+                    for inicio in range(0, len(faltan), DESTINOS_POR_CONSULTA):
+                        if restantes <= 0:
+                            break
+                        lote = faltan[inicio:inicio + DESTINOS_POR_CONSULTA]
+                        tiempos = await consultar_tiempos(client, api_key, ubic.direccion, [d for _, d in lote], modo)
+                        restantes -= 1
+                        self.consultas += 1
+                        momento = time.time()
+                        for (rest_id, direccion), minutos in zip(lote, tiempos):
+                            if minutos is not None:
+                                perfil.asignar(rest_id, direccion, minutos, momento)
+                    print(f"DEBUG: Perfil de tiempos '{ubic.nombre}' de {ubic.usuario_id} ({modo}): "
+                          f"{len(perfil)} de {len(alcanzables)} restaurantes al alcance")
+                    path = self._path_perfil(ubic, modo)
+                    await asyncio.to_thread(self._escribir_perfil, path, *self._exportar_perfil(ubic, perfil))
+                    self._perfiles_mtime[ubic.clave + (modo,)] = path.stat().st_mtime
+        return self.consultas_por_ciclo - restantes
+
+    # ---------- Requests ----------
+    def completar(self, ubic: UbicacionGuardada, modo: str, restaurantes: List[Dict]) -> int:
+        """Pone el tiempo_min del perfil en los restaurantes con tiempo_min None. Devuelve cuántos completó."""
+        perfil = self.perfil(ubic, modo)
+        if perfil is None:
+            return 0
+        completados = 0
+        for r in restaurantes:
+            if r.get("tiempo_min") is None:
+                minutos = perfil.tiempo(r["id"], r.get("direccion"))
+                if minutos is not None:
+                    r["tiempo_min"] = minutos
+                    completados += 1
+        return completados
@@ -0,0 +1,287 @@
+# app/scoring.py
+# Espejo en Python (vectorizado con NumPy) de los filtros y la puntuación del .clp.
+#
+# CLIPS sigue siendo la fuente de verdad del ranking; este módulo sirve para
+# razonar sobre U antes de llamar al motor: descartar lo que CLIPS descartaría,
+# calcular los criterios baratos y acotar los caros (cercanía necesita
+# tiempo_min, que puede requerir una consulta a Google Maps).
+#
+# U = wg*afinidad + wp*(precio - penalizacion_presupuesto) + wd*cercania
+#     + wq*calidad + wa*disp - penalizacion_estacionamiento
+#
+# Cada criterio está en [0, 1] (las penalizaciones en [0, 0.3] y {0, 0.15}).
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .context_table import componentes
+from .feature_store import PENALIZACION_ESTACIONAMIENTO, calidad_estatica, disponibilidad_cena, penalizacion_estacionamiento
+
+CRITERIOS = ('afinidad', 'precio', 'cercania', 'calidad', 'disp')
+PESOS = ('wg', 'wp', 'wd', 'wq', 'wa')
+
+PENALIZACION_PRESUPUESTO_MAX = 0.3
+
+
+def normalizar_inversa(x: np.ndarray, maximo: np.ndarray) -> np.ndarray:
+    """normalizar-inversa del .clp, vectorizada."""
+    x = np.asarray(x, dtype=float)
+    maximo = np.asarray(maximo, dtype=float)
+    return np.where(x <= 0, 1.0, np.where(x <= maximo, 1.0 - x / (maximo + 0.0001), 0.0))
+
+
+def valor_cercania(tiempo_min: np.ndarray, tiempo_max: float) -> np.ndarray:
+    """puntuar-cercania: NaN donde tiempo_min todavía no se conoce."""
+    tiempo_min = np.asarray(tiempo_min, dtype=float)
+    valor = np.where(tiempo_min <= tiempo_max, normalizar_inversa(tiempo_min, tiempo_max), 0.0)
+    valor[np.isnan(tiempo_min)] = np.nan
+    return valor
+
+
+def valor_precio(precio_pp: np.ndarray, presupuesto: float):
+    """puntuar-precio y penalizacion-presupuesto: (precio, penalizacion_presupuesto)."""
+    precio_pp = np.asarray(precio_pp, dtype=float)
+    dentro = precio_pp <= presupuesto
+    precio = np.where(dentro, normalizar_inversa(precio_pp, presupuesto), 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exceso = (precio_pp - presupuesto) / presupuesto if presupuesto else np.full(len(precio_pp), np.inf)
+    return precio, np.where(dentro, 0.0, np.minimum(PENALIZACION_PRESUPUESTO_MAX, exceso * 0.5))
+
+
+def precios(restaurantes: List[Dict]) -> np.ndarray:
+    return np.array([float(r.get('precio_pp') or 0.0) for r in restaurantes])
+
+
+def tiempos(restaurantes: List[Dict]) -> np.ndarray:
+    return np.array([np.nan if r.get('tiempo_min') is None else float(r['tiempo_min']) for r in restaurantes])
+
+
+def pesos_efectivos(usuario: Dict, contexto: Dict) -> Dict[str, float]:
+    """
+    Pesos con los que puntúa CLIPS. contexto-lluvia-aumenta-cercania se vuelve a
+    activar con cada modify del usuario hasta que wd llega al tope, así que con
+    lluvia wd termina siempre en 1.0 (ver context_table.py).
+    """
+    pesos = {w: float(usuario.get(w) or 0.0) for w in PESOS}
+    pesos.update(componentes(contexto).pesos_fijos)
+    return pesos
+
+
+def razones_descarte(usuario: Dict, restaurante: Dict) -> List[str]:
+    """Razones por las que los filtros (salience 50) del .clp descartan al restaurante."""
+    razones = []
+    restricciones = usuario.get('restricciones') or []
+    atributos = restaurante.get('atributos') or []
+    if usuario.get('solo_abiertos') == 'si' and restaurante.get('abierto') == 'no':
+        razones.append("cerrado en esta franja")
+    if 'sin_tacc' in restricciones and 'sin_tacc' not in atributos:
+        razones.append("no apto sin TACC")
+    if usuario.get('movilidad_reducida') == 'si' and 'accesible' not in atributos:
+        razones.append("no es accesible para movilidad reducida")
+    if 'pet_friendly' in restricciones and restaurante.get('pet_friendly') != 'si':
+        razones.append("no es pet friendly")
+    if 'vegano' in restricciones and 'vegano' not in atributos:
+        razones.append("no tiene opciones veganas")
+    if 'vegetariano' in restricciones and not ('vegetariano' in atributos or 'vegano' in atributos):
+        razones.append("no tiene opciones vegetarianas")
+    if 'celiaco' in restricciones and not ('celiaco' in atributos or 'sin_tacc' in atributos):
+        razones.append("no apto para celiacos")
+    if 'intolerancia_lactosa' in restricciones and 'sin_lactosa' not in atributos:
+        razones.append("no apto para intolerancia a la lactosa")
+    if usuario.get('requiere_reserva') == 'si' and restaurante.get('reserva') != 'si':
+        razones.append("no requiere reserva")
+    if usuario.get('requiere_reserva') == 'no' and restaurante.get('reserva') == 'si':
+        razones.append("requiere reserva")
+    return razones
+
+
+def razones_filtro_previo(usuario: Dict, restaurante: Dict) -> List[str]:
+    """Razones de los filtros que main aplica antes de llamar a CLIPS."""
+    razones = []
+    if usuario.get('rating_minimo') is not None and restaurante.get('rating', 0) < float(usuario['rating_minimo']):
+        razones.append("rating menor al mínimo pedido")
+    if usuario.get('solo_abiertos') == 'si' and restaurante.get('abierto') != 'si':
+        razones.append("cerrado en esta franja")
+    if (usuario.get('tiempo_espera_max') is not None and restaurante.get('tiempo_espera') is not None
+            and restaurante['tiempo_espera'] > float(usuario['tiempo_espera_max'])):
+        razones.append("tiempo de espera mayor al máximo")
+    if usuario.get('tipo_comida_preferido') and restaurante.get('tipo_comida') != usuario['tipo_comida_preferido']:
+        razones.append("no es del tipo de comida preferido")
+    if usuario.get('estacionamiento_requerido') == 'si' and restaurante.get('estacionamiento_propio') != 'si':
+        razones.append("no tiene estacionamiento propio")
+    if usuario.get('estacionamiento_requerido') == 'no' and restaurante.get('estacionamiento_propio') == 'si':
+        razones.append("tiene estacionamiento propio")
+    return razones
+
+
+def _afinidad_listas(favoritas: Sequence[str], cocinas: Sequence[str]) -> float:
+    # Mismo cálculo que puntuar-afinidad cuando no hay afinidad precalculada
+    favoritas = favoritas or []
+    cocinas = cocinas or []
+    i = sum(1 for x in favoritas if x in cocinas)
+    union = len(favoritas) + len(cocinas) - i
+    return 0.0 if union == 0 else i / union
+
+
+def criterios(
+    usuario: Dict,
+    contexto: Dict,
+    restaurantes: List[Dict],
+    afinidad: Optional[np.ndarray] = None,
+    calidad: Optional[np.ndarray] = None,
+    contextuales: Optional[Dict[str, np.ndarray]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Valor de cada criterio por restaurante. `afinidad`/`calidad` son las del
+    feature store (NaN donde no haya); si faltan se usan los slots precalculados
+    (afinidad, calidad, disp)
+    del restaurante o se calculan como en el .clp. `contextuales` son las
+    columnas de la tabla de contexto (ComponentesContexto.columnas), con el
+    mismo criterio para los NaN.
+    cercania es NaN para los restaurantes sin tiempo_min (todavía sin consultar).
+    """
+    contextuales = contextuales or {}
+    n = len(restaurantes)
+    favoritas = usuario.get('cocinas_favoritas') or []
+    if afinidad is None:
+        afinidad = np.full(n, np.nan)
+    afinidad = np.array(afinidad, dtype=float)
+    for i in np.flatnonzero(np.isnan(afinidad)):
+        r = restaurantes[i]
+        if r.get('afinidad') is not None and r['afinidad'] >= 0:
+            afinidad[i] = r['afinidad']
+        else:
+            afinidad[i] = _afinidad_listas(favoritas, r.get('cocinas'))
+    if calidad is None:
+        calidad = contextuales.get('calidad', np.full(n, np.nan))
+    calidad = np.array(calidad, dtype=float)
+    for i in np.flatnonzero(np.isnan(calidad)):
+        r = restaurantes[i]
+        if r.get('calidad') is not None and r['calidad'] >= 0:
+            calidad[i] = r['calidad']
+        else:
+            calidad[i] = calidad_estatica(r.get('rating'), r.get('n_resenas'))
+
+    precio, penalizacion_presupuesto = valor_precio(precios(restaurantes), float(usuario.get('presupuesto') or 0.0))
+
+    cercania = valor_cercania(tiempos(restaurantes), float(usuario.get('tiempo_max') or 0.0))
+
+    if componentes(contexto).columna_disp is not None:
+        disp = np.array(contextuales.get('disp', np.full(n, np.nan)), dtype=float)
+        for i in np.flatnonzero(np.isnan(disp)):
+            r = restaurantes[i]
+            if r.get('disp') is not None and r['disp'] >= 0:
+                disp[i] = r['disp']
+            else:
+                disp[i] = disponibilidad_cena(r.get('reserva'))
+    else:
+        disp = np.zeros(n)
+
+    if usuario.get('movilidad') in ('auto', 'moto'):
+        penalizacion = np.array(contextuales.get('penalizacion_estacionamiento', np.full(n, np.nan)), dtype=float)
+        for i in np.flatnonzero(np.isnan(penalizacion)):
+            penalizacion[i] = penalizacion_estacionamiento(restaurantes[i].get('estacionamiento_propio'))
+    else:
+        penalizacion = np.zeros(n)
+
+    return {
+        'afinidad': afinidad,
+        'precio': precio,
+        'cercania': cercania,
+        'calidad': calidad,
+        'disp': disp,
+        'penalizacion_presupuesto': penalizacion_presupuesto,
+        'penalizacion_estacionamiento': penalizacion,
+    }
+
+
+def matriz_criterios(crit: Dict[str, np.ndarray]) -> np.ndarray:
+    """Matriz (n, 5) tal que U = M @ [wg, wp, wd, wq, wa] - penalizacion_estacionamiento."""
+    return np.column_stack([
+        crit['afinidad'],
+        crit['precio'] - crit['penalizacion_presupuesto'],
+        crit['cercania'],
+        crit['calidad'],
+        crit['disp'],
+    ])
+
+
+def utilidad(pesos: Dict[str, float], crit: Dict[str, np.ndarray], cercania_optimista: bool = False) -> np.ndarray:
+    """
+    U por restaurante. Con cercania_optimista=True la cercanía desconocida (NaN)
+    se reemplaza por el extremo de [0, 1] que más suma, lo que da una cota
+    superior de U.
+    """
+    m = matriz_criterios(crit)
+    if cercania_optimista:
+        m[:, 2] = np.where(np.isnan(m[:, 2]), 1.0 if pesos['wd'] >= 0 else 0.0, m[:, 2])
+    w = np.array([pesos[p] for p in PESOS])
+    return m @ w - crit['penalizacion_estacionamiento']
+
+
+
+def ranking(usuario: Dict, contexto: Dict, restaurantes: List[Dict],
+            contextuales: Optional[Dict[str, np.ndarray]] = None) -> List[Dict]:
+    """
+    Lo mismo que devuelve ClipsRecommender.recommend ([{id, nombre, U}] por U
+    decreciente, sin los descartados), calculado con el espejo. Se usa cuando
+    no queda plazo para correr CLIPS. La cercanía desconocida vale 0.
+    """
+    vivos = [i for i, r in enumerate(restaurantes) if not razones_descarte(usuario, r)]
+    if not vivos:
+        return []
+    if contextuales is not None:
+        contextuales = {nombre: np.asarray(valores)[vivos] for nombre, valores in contextuales.items()}
+    vivos = [restaurantes[i] for i in vivos]
+    crit = criterios(usuario, contexto, vivos, contextuales=contextuales)
+    crit['cercania'] = np.nan_to_num(crit['cercania'], nan=0.0)
+    us = utilidad(pesos_efectivos(usuario, contexto), crit)
+    orden = np.argsort(-us, kind='stable')
+    return [{'id': vivos[i]['id'], 'nombre': vivos[i].get('nombre', vivos[i]['id']), 'U': float(us[i])} for i in orden]
+
+
+def explicar(usuario: Dict, contexto: Dict, restaurantes: List[Dict]) -> List[Dict]:
+    """
+    Desglose de U por criterio (valor, peso y aporte) y razones de descarte,
+    para los restaurantes pedidos. `justifs` reproduce el formato que armaban
+    las reglas del .clp ("afinidad=0.5", "precio=0.3", ...).
+    """
+    if not restaurantes:
+        return []
+    pesos = pesos_efectivos(usuario, contexto)
+    crit = criterios(usuario, contexto, restaurantes)
+    us = utilidad(pesos, crit)
+    cena = contexto.get('franja') == 'cena'
+    explicaciones = []
+    for i, r in enumerate(restaurantes):
+        razones = list(dict.fromkeys(razones_filtro_previo(usuario, r) + razones_descarte(usuario, r)))
+        valores = {nombre: float(crit[nombre][i]) for nombre in crit}
+        aportes = {
+            'afinidad': pesos['wg'] * valores['afinidad'],
+            'precio': pesos['wp'] * valores['precio'],
+            'cercania': pesos['wd'] * valores['cercania'],
+            'calidad': pesos['wq'] * valores['calidad'],
+            'disp': pesos['wa'] * valores['disp'],
+            'penalizacion_presupuesto': -pesos['wp'] * valores['penalizacion_presupuesto'],
+            'penalizacion_estacionamiento': -valores['penalizacion_estacionamiento'],
+        }
+        justifs = [f"{c}={valores[c]!r}" for c in ('afinidad', 'precio', 'cercania', 'calidad')]
+        if cena:
+            justifs.append(f"disp={valores['disp']!r}")
+        if valores['penalizacion_presupuesto'] > 0:
+            justifs.append(f"penalizacion_presupuesto={valores['penalizacion_presupuesto']:.2f}")
+        if valores['penalizacion_estacionamiento'] > 0:
+            justifs.append(f"penalizacion_estacionamiento=-{PENALIZACION_ESTACIONAMIENTO}")
+        explicaciones.append({
+            'id': r.get('id'),
+            'descartado': bool(razones),
+            'razones_descarte': razones,
+            'U': None if razones else float(us[i]),
+            'pesos': pesos,
+            'criterios': valores,
+            'aportes': aportes,
+            'justifs': [] if razones else justifs,
+            'tiempo_min': r.get('tiempo_min'),
+        })
+    return explicaciones
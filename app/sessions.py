@@ -0,0 +1,130 @@
+# app/sessions.py
+# Sesiones de re-ranking interactivo.
+#
+# En una visita el usuario mueve varias veces los sliders (presupuesto,
+# tiempo_max, wg/wp/wd/wq/wa, diversidad) y cada ajuste era un /api/recommend
+# completo: filtros, tiempos de viaje, red neuronal y CLIPS otra vez. Los
+# filtros dependen de restricciones, rating, horarios, etc., así que la sesión
+# guarda los candidatos que sobreviven a los filtros, sus tiempos de viaje y la
+# matriz de criterios M (n, 5) del espejo de scoring.py:
+#
+#   - pesos o diversidad:  U = M @ w - penalizacion_estacionamiento (nada más)
+#   - presupuesto:         se recalcula solo la columna de precio
+#   - tiempo_max:          se recalcula solo la columna de cercanía
+#
+# Con el catálogo y coordenadas del usuario, los candidatos se acotan con el
+# índice espacial al radio de `alcance` minutos (SESION_TIEMPO_MAX o el
+# tiempo_max del request si es mayor), no al del tiempo_max inicial. Un ajuste
+# de tiempo_max por encima del alcance necesita candidatos nuevos
+# (supera_alcance) y main.py vuelve a armar la sesión.
+#
+# Las sesiones viven en un CacheLRU: vencen SESION_TTL segundos después del
+# último uso y, pasadas SESION_MAX, se descarta la usada hace más tiempo.
+
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .admission import CacheLRU
+from .diversity import bitsets, lambda_diversidad, seleccionar_diversos, tamano_pool
+from .scoring import PESOS, criterios, matriz_criterios, pesos_efectivos, precios, tiempos, valor_cercania, valor_precio
+
+# Campos del usuario que se pueden ajustar dentro de una sesión
+AJUSTABLES = PESOS + ('presupuesto', 'tiempo_max', 'diversidad')
+COLUMNA_PRECIO, COLUMNA_CERCANIA = 1, 2
+
+
+class Sesion:
+    """Candidatos de un request con sus criterios precalculados."""
+
+    def __init__(self, usuario: Dict, contexto: Dict, restaurantes: List[Dict], top_k: int,
+                 contextuales: Optional[Dict[str, np.ndarray]] = None, alcance: Optional[float] = None):
+        self.id = uuid.uuid4().hex
+        self.alcance = alcance  # minutos que cubren los candidatos (None = sin acotar por distancia)
+        self.usuario = usuario
+        self.contexto = contexto
+        self.restaurantes = restaurantes  # ya filtrados, con tiempo_min resuelto
+        self.top_k = top_k
+        self.creada = time.time()
+        self.ajustes = 0
+        crit = criterios(usuario, contexto, restaurantes, contextuales=contextuales)
+        self.m = matriz_criterios(crit)
+        self.penalizacion_estacionamiento = crit['penalizacion_estacionamiento']
+        self.precio_pp = precios(restaurantes)
+        self.tiempo_min = tiempos(restaurantes)
+        self._bits: Optional[np.ndarray] = None
+
+    def supera_alcance(self, cambios: Dict) -> bool:
+        """True si el tiempo_max pedido deja afuera candidatos que la sesión no tiene."""
+        tiempo_max = cambios.get('tiempo_max')
+        return self.alcance is not None and tiempo_max is not None and float(tiempo_max) > self.alcance
+
+    def ajustar(self, cambios: Dict) -> List[str]:
+        """Aplica los cambios del usuario y devuelve los criterios que hubo que recalcular."""
+        self.usuario.update(cambios)
+        self.ajustes += 1
+        recalculados = []
+        if 'presupuesto' in cambios:
+            precio, penalizacion = valor_precio(self.precio_pp, float(self.usuario.get('presupuesto') or 0.0))
+            self.m[:, COLUMNA_PRECIO] = precio - penalizacion
+            recalculados.append('precio')
+        if 'tiempo_max' in cambios:
+            self.m[:, COLUMNA_CERCANIA] = valor_cercania(self.tiempo_min, float(self.usuario.get('tiempo_max') or 0.0))
+            recalculados.append('cercania')
+        return recalculados
+
+    def utilidades(self) -> np.ndarray:
+        pesos = pesos_efectivos(self.usuario, self.contexto)
+        return self.m @ np.array([pesos[p] for p in PESOS]) - self.penalizacion_estacionamiento
+
+    def ranking(self, k: Optional[int] = None) -> List[Tuple[Dict, float]]:
+        """Los K mejores (restaurante, U), con el re-ranking por diversidad sobre el pool como en /api/recommend."""
+        k = min(k or self.top_k, len(self.restaurantes))
+        if k <= 0:
+            return []
+        us = self.utilidades()
+        lam = lambda_diversidad(self.usuario.get('diversidad'))
+        n_pool = k if lam >= 1.0 else min(tamano_pool(k), len(us))
+        # Solo se ordena el pool: argpartition deja los n_pool mejores adelante
+        pool = np.argpartition(-us, n_pool - 1)[:n_pool] if n_pool < len(us) else np.arange(len(us))
+        pool = pool[np.argsort(-us[pool], kind='stable')]
+        if lam < 1.0:
+            if self._bits is None:
+                self._bits = bitsets(self.restaurantes)
+            pool = pool[seleccionar_diversos(us[pool], self._bits[pool], k, lam)]
+        return [(self.restaurantes[i], float(us[i])) for i in pool[:k]]
+
+    def estado(self) -> Dict:
+        return {
+            'id': self.id,
+            'candidatos': len(self.restaurantes),
+            'ajustes': self.ajustes,
+            'creada': self.creada,
+            'usuario': {campo: self.usuario.get(campo) for campo in AJUSTABLES},
+        }
+
+
+class Sesiones:
+    """Sesiones activas, con vencimiento por inactividad y tope de cantidad."""
+
+    def __init__(self, capacidad: int = 1000, ttl: float = 900.0):
+        self._cache = CacheLRU(capacidad=capacidad, ttl=ttl)
+
+    def crear(self, sesion: Sesion) -> Sesion:
+        self._cache.guardar(sesion.id, sesion)
+        return sesion
+
+    def obtener(self, sesion_id: str) -> Optional[Sesion]:
+        sesion = self._cache.obtener(sesion_id)
+        if sesion is not None:
+            # Renovar el vencimiento: la sesión vence por inactividad
+            self._cache.guardar(sesion_id, sesion)
+        return sesion
+
+    def eliminar(self, sesion_id: str) -> bool:
+        return self._cache.eliminar(sesion_id)
+
+    def __len__(self) -> int:
+        return len(self._cache)
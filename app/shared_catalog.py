@@ -0,0 +1,182 @@
+# app/shared_catalog.py
+# Catálogo y feature store compartidos entre procesos por un archivo mapeado.
+#
+# Con varios workers de uvicorn cada proceso cargaba su propia copia del
+# catálogo (dicts) y del feature store (arrays). Con CATALOGO_COMPARTIDO_DIR
+# configurado, uno solo de los procesos, el publicador, mantiene el catálogo
+# en memoria. Cada vez que cambia la versión, escribe en el directorio un
+# archivo con el formato de checkpoints.py que contiene:
+#
+#   - las columnas del feature store (rating, horarios, bitsets, ...)
+#   - los restaurantes serializados en JSON, uno detrás del otro, formando el
+#     listado completo de GET /api/restaurantes
+#   - en el header: versión del catálogo, ids, vocabularios y registro de cambios
+#
+# El resto de los procesos mapea el archivo en modo solo lectura (mmap). Los
+# arrays son vistas sobre las páginas del archivo, sin copias, y la memoria es
+# la misma con 1 o 16 workers. Si el directorio está en /dev/shm, el archivo ni
+# siquiera toca el disco.
+#
+# La publicación se hace con un temporal + os.replace: los lectores que todavía
+# tienen mapeado el archivo anterior lo siguen viendo entero. En el próximo
+# request notan el cambio por un stat y remapean la versión nueva.
+#
+# El publicador se elige con un flock sobre `publicador.lock`. Si el proceso
+# muere, el lock se libera y el primer lector que lo toma pasa a publicar.
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .catalog import CatalogStore, cambios_posteriores
+from .checkpoints import CheckpointError, escribir_arrays, leer_arrays
+from .feature_store import FeatureStore
+from .spatial import IndiceEspacial
+
+try:
+    import fcntl
+except ImportError:  # Windows: no hay flock y no se puede reemplazar un archivo mapeado
+    fcntl = None
+
+ARCHIVO = "catalogo.shm"
+LOCK_PUBLICADOR = "publicador.lock"
+
+
+def disponible() -> bool:
+    return fcntl is not None
+
+
+class VistaCatalogo:
+    """Una versión publicada del catálogo, de solo lectura y sin copias."""
+
+    def __init__(self, header: Dict, arrays: Dict[str, np.ndarray]):
+        self.version = header['catalogo_version']
+        self.features = FeatureStore.desde_exportado(arrays, header['features'])
+        self._listado = arrays['registros']  # uint8: JSON del listado completo
+        self._inicio = arrays['registro_inicio']
+        self._fin = arrays['registro_fin']
+        self._posicion = {rest_id: i for i, rest_id in enumerate(header['ids'])}
+        self._cubre_desde = header['cubre_desde']
+        self._cambios = header['cambios']
+        self._espacial: Optional[IndiceEspacial] = None
+
+    def __len__(self) -> int:
+        return len(self._posicion)
+
+    @property
+    def espacial(self) -> IndiceEspacial:
+        """Índice espacial de esta versión, armado en el primer uso desde las coordenadas del feature store."""
+        if self._espacial is None:
+            fs = self.features
+            self._espacial = IndiceEspacial.desde_columnas(fs.ids, fs.latitud, fs.longitud)
+        return self._espacial
+
+    def _registro(self, i: int) -> Dict:
+        return json.loads(self._listado[self._inicio[i]:self._fin[i]].tobytes())
+
+    def obtener(self, rest_id: str) -> Optional[Dict]:
+        i = self._posicion.get(rest_id)
+        return self._registro(i) if i is not None else None
+
+    def obtener_muchos(self, rest_ids) -> List[Dict]:
+        """Restaurantes pedidos, en el orden pedido (se omiten los que no están)."""
+        return [self._registro(self._posicion[i]) for i in rest_ids if i in self._posicion]
+
+    def todos(self) -> List[Dict]:
+        return [self._registro(i) for i in range(len(self._posicion))]
+
+    def instantanea(self) -> Tuple[int, memoryview]:
+        """(versión, JSON del listado completo) directo del archivo mapeado."""
+        return self.version, memoryview(self._listado)
+
+    def cambios_desde(self, version: int) -> Optional[Tuple[int, List[Dict], List[str]]]:
+        """Igual que CatalogStore.cambios_desde, con el registro publicado."""
+        if version < self._cubre_desde or version > self.version:
+            return None
+        cambios = cambios_posteriores(self._cambios, version)
+        upserts = [self.obtener(i) for i, eliminado in cambios if not eliminado]
+        return self.version, upserts, [i for i, eliminado in cambios if eliminado]
+
+
+class CatalogoCompartido:
+    """Publica o mapea el catálogo en `directorio` según este proceso tenga el lock de publicador."""
+
+    def __init__(self, directorio: Path):
+        self.directorio = Path(directorio)
+        self.path = self.directorio / ARCHIVO
+        self.publicador = False
+        self.version_publicada: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._vista: Optional[VistaCatalogo] = None
+        self._firma = None
+
+    # ---------- Publicador ----------
+    def tomar_publicacion(self) -> bool:
+        """Intenta ser el publicador (no bloquea). True si este proceso publica."""
+        if self.publicador:
+            return True
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.directorio / LOCK_PUBLICADOR, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        self.publicador = True
+        self._vista = None
+        self._firma = None
+        return True
+
+    def exportar(self, catalogo: CatalogStore, feature_store: FeatureStore) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """Arrays y header de la versión actual (se toma en el event loop, sin escrituras en el medio)."""
+        arrays, meta_features = feature_store.exportar()
+        estado = catalogo.exportar()
+        registros = estado['registros']
+        largos = np.array([len(r) for r in registros], dtype=np.int64)
+        # Entre registros va una coma; el listado empieza con "["
+        inicio = 1 + np.concatenate(([0], np.cumsum(largos + 1)[:-1])) if len(registros) else np.zeros(0, dtype=np.int64)
+        listado = b"[" + b",".join(registros) + b"]"
+        arrays['registros'] = np.frombuffer(listado, dtype=np.uint8)
+        arrays['registro_inicio'] = inicio.astype(np.int64)
+        arrays['registro_fin'] = (inicio + largos).astype(np.int64)
+        header = {
+            'catalogo_version': estado['version'],
+            'ids': estado['ids'],
+            'cubre_desde': estado['cubre_desde'],
+            'cambios': estado['cambios'],
+            'features': meta_features,
+        }
+        return arrays, header
+
+    def escribir(self, arrays: Dict[str, np.ndarray], header: Dict):
+        """Publica una versión (temporal + rename atómico); se puede llamar fuera del event loop."""
+        escribir_arrays(self.path, arrays, header)
+        self.version_publicada = header['catalogo_version']
+        print(f"DEBUG: Catálogo compartido publicado: versión {self.version_publicada}, "
+              f"{len(header['ids'])} restaurantes, {os.path.getsize(self.path) / 1e6:.1f} MB")
+
+    # ---------- Lectores ----------
+    def vista(self) -> Optional[VistaCatalogo]:
+        """
+        Versión publicada vigente, remapeando si el archivo cambió desde la
+        última vez. None si todavía no hay nada publicado.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._vista
+        firma = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if firma != self._firma:
+            try:
+                header, arrays = leer_arrays(self.path, usar_mmap=True)
+            except (CheckpointError, OSError) as e:
+                print(f"WARNING: no se pudo mapear el catálogo compartido: {e}")
+                return self._vista
+            self._vista = VistaCatalogo(header, arrays)
+            self._firma = firma
+            print(f"DEBUG: Catálogo compartido mapeado: versión {self._vista.version}, {len(self._vista)} restaurantes")
+        return self._vista
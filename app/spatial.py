@@ -0,0 +1,164 @@
+# app/spatial.py
+# Índice espacial del catálogo para acotar candidatos por distancia.
+#
+# Sin índice, /api/recommend filtra y puntúa todos los restaurantes de la ciudad
+# aunque el usuario solo pueda llegar a los de su barrio. El índice es una
+# grilla uniforme sobre (latitud, longitud): cada celda guarda los restaurantes
+# que caen en ella, así "todos a menos de R km" recorre solo las celdas que
+# cubre el círculo y mide la distancia exacta (haversine) de esos. El costo
+# depende de la densidad local, no del tamaño del catálogo.
+#
+# Las celdas son cuadradas en grados (CELDA_KM de lado en latitud; en longitud
+# son más angostas lejos del ecuador, lo que solo agrega celdas a recorrer).
+# Se mantiene incrementalmente como listener del CatalogStore. Los restaurantes
+# sin coordenadas quedan aparte en `sin_coordenadas`.
+
+import math
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .admission import FACTOR_RECORRIDO, VELOCIDADES_KMH
+from .catalog import CatalogListener
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+CELDA_KM = 1.0
+
+
+def distancias_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Distancia haversine (km) de (lat, lon) a cada punto."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radio_alcance_km(tiempo_max: float, modo: str, margen: float) -> Optional[float]:
+    """
+    Distancia en línea recta alcanzable en tiempo_max minutos con el modo de
+    Google Maps (velocidad media de admission.py), multiplicada por `margen`
+    para cubrir viajes más rápidos que el promedio. None si no hay tiempo_max.
+    """
+    if not tiempo_max or tiempo_max <= 0 or margen <= 0:
+        return None
+    velocidad = VELOCIDADES_KMH.get(modo, VELOCIDADES_KMH['walking'])
+    return tiempo_max / 60 * velocidad / FACTOR_RECORRIDO * margen
+
+
+def _coordenadas(r: Dict) -> Optional[Tuple[float, float]]:
+    lat, lon = r.get('latitud'), r.get('longitud')
+    if not lat or not lon:  # mismo criterio que el resto del backend: 0 es "sin coordenadas"
+        return None
+    return float(lat), float(lon)
+
+
+class IndiceEspacial(CatalogListener):
+    """Grilla uniforme de restaurantes por coordenadas."""
+
+    def __init__(self, celda_km: float = CELDA_KM):
+        self._lock = threading.RLock()
+        self.celda = celda_km / KM_POR_GRADO  # lado de la celda en grados
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._celdas: Dict[Tuple[int, int], Dict[str, Tuple[float, float]]] = {}
+        self._celda_de: Dict[str, Tuple[int, int]] = {}
+        self.sin_coordenadas: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._celda_de)
+
+    def _clave(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.celda), math.floor(lon / self.celda)
+
+    # ---------- Mantenimiento ----------
+    def _agregar(self, rest_id: str, coords: Optional[Tuple[float, float]]):
+        if coords is None:
+            self.sin_coordenadas.add(rest_id)
+            return
+        clave = self._clave(*coords)
+        self._celdas.setdefault(clave, {})[rest_id] = coords
+        self._celda_de[rest_id] = clave
+
+    def _quitar(self, rest_id: str):
+        self.sin_coordenadas.discard(rest_id)
+        clave = self._celda_de.pop(rest_id, None)
+        if clave is not None:
+            celda = self._celdas[clave]
+            del celda[rest_id]
+            if not celda:
+                del self._celdas[clave]
+
+    def al_reiniciar(self, restaurantes: List[Dict]):
+        with self._lock:
+            self._reiniciar()
+            for r in restaurantes:
+                self._agregar(r['id'], _coordenadas(r))
+
+    def al_actualizar(self, restaurante: Dict):
+        with self._lock:
+            self._quitar(restaurante['id'])
+            self._agregar(restaurante['id'], _coordenadas(restaurante))
+
+    def al_eliminar(self, rest_id: str):
+        with self._lock:
+            self._quitar(rest_id)
+
+    @classmethod
+    def desde_columnas(cls, ids: List[str], latitud: np.ndarray, longitud: np.ndarray,
+                       celda_km: float = CELDA_KM) -> 'IndiceEspacial':
+        """Índice armado de una vez desde columnas (por ejemplo las del feature store compartido)."""
+        indice = cls(celda_km)
+        for rest_id, lat, lon in zip(ids, latitud.tolist(), longitud.tolist()):
+            sin_coordenadas = math.isnan(lat) or math.isnan(lon) or not lat or not lon
+            indice._agregar(rest_id, None if sin_coordenadas else (lat, lon))
+        return indice
+
+    # ---------- Consultas ----------
+    def _en_celdas(self, lat: float, lon: float, radio_km: float):
+        """Ids y coordenadas de las celdas que toca el círculo (antes del filtro por distancia)."""
+        dlat = radio_km / KM_POR_GRADO
+        dlon = radio_km / (KM_POR_GRADO * max(math.cos(math.radians(lat)), 0.01))
+        i0, j0 = self._clave(lat - dlat, lon - dlon)
+        i1, j1 = self._clave(lat + dlat, lon + dlon)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self._celdas):
+            celdas = (self._celdas.get((i, j)) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+        else:
+            # Radio grande: es más barato recorrer las celdas ocupadas
+            celdas = (c for (i, j), c in self._celdas.items() if i0 <= i <= i1 and j0 <= j <= j1)
+        ids, coords = [], []
+        for celda in celdas:
+            if celda:
+                ids.extend(celda.keys())
+                coords.extend(celda.values())
+        return ids, np.array(coords, dtype=float).reshape(-1, 2)
+
+    def en_radio(self, lat: float, lon: float, radio_km: float) -> List[Tuple[str, float]]:
+        """(id, km) de los restaurantes a menos de radio_km, del más cercano al más lejano."""
+        with self._lock:
+            ids, coords = self._en_celdas(lat, lon, radio_km)
+        if not ids:
+            return []
+        dist = distancias_km(lat, lon, coords[:, 0], coords[:, 1])
+        dentro = np.flatnonzero(dist <= radio_km)
+        dentro = dentro[np.argsort(dist[dentro], kind='stable')]
+        return [(ids[i], float(dist[i])) for i in dentro]
+
+    def cercanos(self, lat: float, lon: float, n: int, radio_max_km: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        (id, km) de los n restaurantes más cercanos (opcionalmente sin pasar de
+        radio_max_km). Busca en radios crecientes hasta juntar n.
+        """
+        if n <= 0:
+            return []
+        radio = self.celda * KM_POR_GRADO
+        while True:
+            if radio_max_km is not None:
+                radio = min(radio, radio_max_km)
+            encontrados = self.en_radio(lat, lon, radio)
+            # Todo lo que está a menos de `radio` ya está: los n primeros son los n más cercanos
+            if len(encontrados) >= n or len(encontrados) >= len(self) or radio == radio_max_km:
+                return encontrados[:n]
+            radio *= 2
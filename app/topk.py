@@ -0,0 +1,99 @@
+# app/topk.py
+# Selección de contendientes para el top-K con poda por cota superior.
+#
+# Como U es una suma ponderada de criterios acotados, se puede calcular primero
+# lo barato (afinidad, precio, calidad, disponibilidad y penalizaciones salen del
+# catálogo y del feature store) y acotar lo caro: la cercanía necesita tiempo_min,
+# que puede requerir una consulta a Google Maps. Se recorren los restaurantes por
+# cota superior decreciente y solo se resuelve el tiempo de viaje de los que
+# todavía pueden superar al K-ésimo puntaje exacto encontrado hasta el momento.
+# El resto queda podado sin consultar nada.
+#
+# El resultado son los contendientes: CLIPS los puntúa y sigue siendo el que
+# decide el ranking final.
+
+import heapq
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .scoring import criterios, pesos_efectivos, razones_descarte, tiempos, utilidad, valor_cercania
+
+# Tolerancia para las diferencias de redondeo entre la suma en Python y en CLIPS
+EPSILON = 1e-9
+
+
+async def seleccionar_contendientes(
+    usuario: Dict,
+    contexto: Dict,
+    restaurantes: List[Dict],
+    k: int,
+    resolver_tiempos: Optional[Callable[[List[Dict]], Awaitable[None]]] = None,
+    afinidad: Optional[np.ndarray] = None,
+    calidad: Optional[np.ndarray] = None,
+    lote: Optional[int] = None,
+    contextuales: Optional[Dict[str, np.ndarray]] = None,
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Devuelve los restaurantes que pueden estar en el top-K y estadísticas de la poda.
+
+    Los restaurantes con tiempo_min None son los que necesitan consulta:
+    `resolver_tiempos` recibe una lista de ellos y les completa tiempo_min.
+    Los que CLIPS descartaría por filtros no se devuelven.
+    """
+    stats = {'candidatos': len(restaurantes), 'descartados': 0, 'evaluados': 0,
+             'consultas_tiempo': 0, 'contendientes': 0}
+    vivos = [i for i, r in enumerate(restaurantes) if not razones_descarte(usuario, r)]
+    stats['descartados'] = len(restaurantes) - len(vivos)
+    if not vivos or k <= 0:
+        return [], stats
+    rs = [restaurantes[i] for i in vivos]
+    if afinidad is not None:
+        afinidad = np.asarray(afinidad)[vivos]
+    if calidad is not None:
+        calidad = np.asarray(calidad)[vivos]
+    if contextuales is not None:
+        contextuales = {nombre: np.asarray(valores)[vivos] for nombre, valores in contextuales.items()}
+
+    pesos = pesos_efectivos(usuario, contexto)
+    crit = criterios(usuario, contexto, rs, afinidad, calidad, contextuales)
+    cota = utilidad(pesos, crit, cercania_optimista=True)
+    orden = np.argsort(-cota, kind='stable')
+    tiempo_max = float(usuario.get('tiempo_max') or 0.0)
+    lote = max(1, lote or k)
+
+    mejores: List[float] = []   # min-heap con los K mejores U exactos
+    exactos: Dict[int, float] = {}
+    pos = 0
+    while pos < len(orden):
+        umbral = mejores[0] - EPSILON if len(mejores) >= k else -np.inf
+        if cota[orden[pos]] < umbral:
+            break  # ningún restaurante restante puede entrar al top-K
+        bloque = []
+        while pos < len(orden) and len(bloque) < lote and cota[orden[pos]] >= umbral:
+            bloque.append(int(orden[pos]))
+            pos += 1
+
+        pendientes = [i for i in bloque if np.isnan(crit['cercania'][i])]
+        if pendientes and resolver_tiempos is not None:
+            await resolver_tiempos([rs[i] for i in pendientes])
+            stats['consultas_tiempo'] += len(pendientes)
+        for i in pendientes:
+            if rs[i].get('tiempo_min') is None:
+                rs[i]['tiempo_min'] = 999  # mismo valor que usa main cuando no hay tiempo
+        if pendientes:
+            crit['cercania'][pendientes] = valor_cercania(tiempos([rs[i] for i in pendientes]), tiempo_max)
+
+        sub = {nombre: valores[bloque] for nombre, valores in crit.items()}
+        for i, u in zip(bloque, utilidad(pesos, sub)):
+            exactos[i] = float(u)
+            if len(mejores) < k:
+                heapq.heappush(mejores, float(u))
+            elif u > mejores[0]:
+                heapq.heapreplace(mejores, float(u))
+        stats['evaluados'] += len(bloque)
+
+    umbral = mejores[0] - EPSILON if len(mejores) >= k else -np.inf
+    contendientes = [rs[i] for i in sorted(exactos) if exactos[i] >= umbral]
+    stats['contendientes'] = len(contendientes)
+    return contendientes, stats
@@ -0,0 +1,330 @@
+# app/tuning.py
+# Búsqueda offline de hiperparámetros de WeightOptimizerNN.
+#
+# El tamaño de la capa oculta, el learning rate y los incrementos con los que
+# compute_ideal_weights_from_feedback arma los pesos ideales estaban puestos a
+# mano. Este job reproduce el historial de feedback y prueba combinaciones al
+# azar (más la configuración actual como referencia) en un pool de procesos, uno
+# por core:
+#
+#   - los pesos ideales se recalculan con los incrementos del candidato a partir
+#     de los snapshots de features y las razones guardadas en cada feedback
+#   - la red se entrena desde cero con early stopping sobre un holdout (el mismo
+#     para todos los candidatos)
+#
+# Como cada candidato tiene sus propios pesos ideales, la pérdida de validación
+# no sirve para compararlos. Se compara con métricas de ranking sobre el holdout:
+# con los pesos que predice la red (entrada: promedio de las features de los
+# candidatos mostrados) se ordenan el seleccionado y los rechazados por
+# U = w · features y se mide si el seleccionado queda en el top K (hit rate) y
+# su rango recíproco (MRR). Entre los candidatos a menos de `tolerancia` del
+# mejor hit rate gana el de menor latencia de inferencia, medida después en el
+# proceso principal sin competir por CPU.
+#
+# El ganador se exporta como checkpoint, con sus hiperparámetros en el header
+# (learning rate, incrementos, arquitectura). Con --publicar además se agrega
+# como checkpoint nuevo del servidor, que lo carga al reiniciar.
+#
+# Uso como CLI:
+#   python -m app.tuning --pruebas 64 --top-k 3
+#   python -m app.tuning --pruebas 64 --publicar
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .checkpoints import escribir_arrays, guardar_checkpoint
+from .feedback_log import leer_registros
+from .neural_network import INCREMENTOS_IDEALES, WeightOptimizerNN, pesos_ideales
+from .retraining import BASE_DIR, FEEDBACK_DIR, entrenar
+
+SALIDA = BASE_DIR / "tuning" / "mejor.ckpt"
+
+# Espacio de búsqueda. Las escalas multiplican los incrementos de INCREMENTOS_IDEALES.
+ESPACIO = {
+    'oculta': (4, 8, 16, 32, 64),
+    'learning_rate': (0.001, 0.003, 0.01, 0.03, 0.1, 0.3),
+    'batch_size': (8, 16, 32, 64, 128),
+    'escala_razones': (0.5, 0.75, 1.0, 1.5, 2.0),
+    'escala_diferencias': (0.5, 1.0, 1.5, 2.0, 3.0),
+    'umbral_diferencia': (0.1, 0.2, 0.3),
+}
+ACTUAL = {
+    'oculta': 8, 'learning_rate': 0.01, 'batch_size': 32,
+    'escala_razones': 1.0, 'escala_diferencias': 1.0, 'umbral_diferencia': 0.2,
+}
+_INCREMENTOS_RAZONES = ('precio', 'distancia', 'calidad', 'gustos', 'abierto', 'reserva', 'caracteristicas')
+_INCREMENTOS_DIFERENCIAS = ('diferencia_mejor', 'diferencia_peor', 'destacado_afinidad', 'destacado')
+
+
+def incrementos_de(hiper: Dict) -> Dict[str, float]:
+    """Incrementos de pesos ideales de un candidato."""
+    inc = dict(INCREMENTOS_IDEALES)
+    for clave in _INCREMENTOS_RAZONES:
+        inc[clave] = round(inc[clave] * hiper['escala_razones'], 6)
+    for clave in _INCREMENTOS_DIFERENCIAS:
+        inc[clave] = round(inc[clave] * hiper['escala_diferencias'], 6)
+    inc['umbral_diferencia'] = hiper['umbral_diferencia']
+    return inc
+
+
+def cargar_historial(feedbacks: Iterable[Dict]) -> List[Dict]:
+    """
+    Feedbacks reproducibles: con snapshot de features del seleccionado (los
+    viejos que solo guardan ids se ignoran). Los rechazados pueden faltar.
+    """
+    historial = []
+    for fb in feedbacks:
+        sel = fb.get('features_seleccionado')
+        if not sel or len(sel) != 5:
+            continue
+        rechazados = [r for r in fb.get('features_rechazados') or [] if len(r) == 5]
+        historial.append({
+            'seleccionado': np.array(sel, dtype=float),
+            'rechazados': np.array(rechazados, dtype=float).reshape(-1, 5),
+            'razones': list(fb.get('razones_preferencia') or []),
+        })
+    return historial
+
+
+def armar_dataset(historial: List[Dict], incrementos: Dict[str, float]):
+    """X (features del seleccionado) e Y (pesos ideales con los incrementos dados)."""
+    X = np.array([h['seleccionado'] for h in historial]).reshape(-1, 5)
+    Y = np.array([
+        pesos_ideales(h['seleccionado'], h['rechazados'].mean(axis=0) if len(h['rechazados']) else None,
+                      h['razones'], incrementos)
+        for h in historial
+    ]).reshape(-1, 5)
+    return X, Y
+
+
+def metricas_ranking(modelo: WeightOptimizerNN, historial: List[Dict], top_k: int) -> Dict:
+    """
+    Hit rate del seleccionado en el top K y MRR, sobre los feedbacks con rechazados.
+    El hit rate solo cuenta los feedbacks con más de K candidatos (con menos, es trivial).
+    """
+    con_rechazados = [h for h in historial if len(h['rechazados'])]
+    if not con_rechazados:
+        return {'hit_rate': 0.0, 'mrr': 0.0, 'evaluados': 0, 'evaluados_hit': 0}
+    entradas = np.array([np.vstack([h['seleccionado'], h['rechazados']]).mean(axis=0) for h in con_rechazados])
+    pesos, _, _ = modelo.forward(entradas)
+    hits, evaluados_hit, reciprocos = 0, 0, []
+    for h, w in zip(con_rechazados, pesos):
+        u_sel = h['seleccionado'] @ w
+        rango = 1 + int(np.sum(h['rechazados'] @ w > u_sel))
+        reciprocos.append(1.0 / rango)
+        if len(h['rechazados']) + 1 > top_k:
+            evaluados_hit += 1
+            hits += rango <= top_k
+    return {
+        'hit_rate': hits / evaluados_hit if evaluados_hit else 1.0,
+        'mrr': float(np.mean(reciprocos)),
+        'evaluados': len(con_rechazados),
+        'evaluados_hit': evaluados_hit,
+    }
+
+
+def medir_latencia_us(modelo: WeightOptimizerNN, repeticiones: int = 2000) -> float:
+    """Mediana (µs) de un forward de una fila, como en predict_weights."""
+    x = np.random.default_rng(0).random((1, 5))
+    for _ in range(50):
+        modelo.forward(x)
+    tiempos = np.empty(repeticiones)
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        modelo.forward(x)
+        tiempos[i] = time.perf_counter() - inicio
+    return float(np.median(tiempos) * 1e6)
+
+
+# ---------- Workers ----------
+
+_historial: List[Dict] = []
+_entrenamiento: List[int] = []
+_validacion: List[int] = []
+
+
+def _iniciar_worker(historial: List[Dict], entrenamiento: List[int], validacion: List[int]):
+    # El historial se manda una sola vez por proceso, no con cada candidato
+    global _historial, _entrenamiento, _validacion
+    _historial, _entrenamiento, _validacion = historial, entrenamiento, validacion
+
+
+def evaluar_candidato(hiper: Dict, epochs: int, patience: int, top_k: int, seed: int) -> Dict:
+    """Entrena un candidato desde cero y lo evalúa sobre el holdout. Corre en un proceso del pool."""
+    inicio = time.perf_counter()
+    incrementos = incrementos_de(hiper)
+    X, Y = armar_dataset(_historial, incrementos)
+    np.random.seed(seed)  # inicialización de la red
+    modelo = WeightOptimizerNN(learning_rate=hiper['learning_rate'], cargar_modelo=False,
+                               oculta=hiper['oculta'], incrementos=incrementos)
+    entrenamiento = entrenar(
+        modelo, X[_entrenamiento], Y[_entrenamiento], X[_validacion], Y[_validacion],
+        epochs=epochs, batch_size=hiper['batch_size'], patience=patience,
+        rng=np.random.default_rng(seed),
+    )
+    resultado = metricas_ranking(modelo, [_historial[i] for i in _validacion], top_k)
+    resultado.update({
+        'hiper': hiper,
+        'incrementos': incrementos,
+        'val_loss': entrenamiento['val_loss'],
+        'mejor_epoch': entrenamiento['mejor_epoch'],
+        'segundos': round(time.perf_counter() - inicio, 3),
+        'params': modelo.get_params(),
+    })
+    return resultado
+
+
+# ---------- Búsqueda ----------
+
+def sortear_candidatos(cantidad: int, rng: np.random.Generator) -> List[Dict]:
+    """La configuración actual más `cantidad - 1` combinaciones al azar distintas."""
+    candidatos = [dict(ACTUAL)]
+    vistos = {tuple(sorted(ACTUAL.items()))}
+    intentos = 0
+    while len(candidatos) < cantidad and intentos < cantidad * 20:
+        intentos += 1
+        hiper = {clave: valores[rng.integers(len(valores))] for clave, valores in ESPACIO.items()}
+        firma = tuple(sorted(hiper.items()))
+        if firma not in vistos:
+            vistos.add(firma)
+            candidatos.append(hiper)
+    return candidatos
+
+
+def elegir_ganador(resultados: List[Dict], tolerancia: float, latencia_max_us: Optional[float] = None) -> Optional[Dict]:
+    """
+    Entre los que están a menos de `tolerancia` del mejor hit rate, los más
+    rápidos (hasta 10% más lentos que el más rápido, por el ruido de la medición),
+    y de esos el de mejor hit rate y MRR.
+    """
+    validos = [r for r in resultados if latencia_max_us is None or r['latencia_us'] <= latencia_max_us]
+    if not validos:
+        return None
+    mejor = max(r['hit_rate'] for r in validos)
+    cercanos = [r for r in validos if r['hit_rate'] >= mejor - tolerancia]
+    mas_rapido = min(r['latencia_us'] for r in cercanos)
+    rapidos = [r for r in cercanos if r['latencia_us'] <= mas_rapido * 1.1]
+    return max(rapidos, key=lambda r: (r['hit_rate'], r['mrr']))
+
+
+def buscar(
+    historial: List[Dict],
+    pruebas: int = 64,
+    workers: Optional[int] = None,
+    epochs: int = 200,
+    patience: int = 15,
+    holdout: float = 0.2,
+    top_k: int = 3,
+    seed: int = 0,
+) -> Dict:
+    """
+    Corre la búsqueda y devuelve {'resultados': [...], 'referencia': {...}}.
+    `referencia` es la configuración actual, entrenada igual que el resto.
+    """
+    rng = np.random.default_rng(seed)
+    idx = rng.permutation(len(historial))
+    n_val = min(max(1, int(round(len(historial) * holdout))), len(historial) - 1)
+    validacion, entrenamiento = idx[:n_val].tolist(), idx[n_val:].tolist()
+    candidatos = sortear_candidatos(pruebas, rng)
+    workers = workers or os.cpu_count() or 1
+
+    print(f"Búsqueda: {len(candidatos)} candidatos, {workers} procesos, "
+          f"{len(entrenamiento)} feedbacks de entrenamiento y {len(validacion)} de validación")
+    resultados = []
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker,
+                             initargs=(historial, entrenamiento, validacion)) as pool:
+        futuros = [pool.submit(evaluar_candidato, hiper, epochs, patience, top_k, seed + i)
+                   for i, hiper in enumerate(candidatos)]
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            resultados.append(resultado)
+            print(f"  [{len(resultados)}/{len(candidatos)}] hit@{top_k} {resultado['hit_rate']:.3f} "
+                  f"mrr {resultado['mrr']:.3f} ({resultado['segundos']:.1f}s) {resultado['hiper']}")
+    print(f"Búsqueda terminada en {time.perf_counter() - inicio:.1f}s")
+
+    # La latencia se mide acá, de a un candidato: en el pool todos compiten por CPU
+    for resultado in resultados:
+        modelo = WeightOptimizerNN(cargar_modelo=False)
+        modelo.set_params(resultado['params'])
+        resultado['latencia_us'] = medir_latencia_us(modelo)
+
+    referencia = next(r for r in resultados if r['hiper'] == ACTUAL)
+    return {'resultados': resultados, 'referencia': referencia}
+
+
+def checkpoint_ganador(ganador: Dict, version: int, top_k: int):
+    """(params, meta) del checkpoint del ganador, con hiperparámetros y métricas en el header."""
+    modelo = WeightOptimizerNN(learning_rate=ganador['hiper']['learning_rate'], cargar_modelo=False,
+                               incrementos=ganador['incrementos'])
+    modelo.set_params(ganador['params'])
+    modelo.version = version
+    params, meta = modelo.snapshot()
+    meta['tuning'] = {
+        'hiperparametros': ganador['hiper'],
+        'hit_rate': ganador['hit_rate'],
+        'top_k': top_k,
+        'mrr': ganador['mrr'],
+        'latencia_us': round(ganador['latencia_us'], 3),
+    }
+    return params, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Búsqueda de hiperparámetros de la red neuronal sobre el historial de feedback")
+    parser.add_argument("--pruebas", type=int, default=64, help="candidatos a evaluar (incluye la configuración actual)")
+    parser.add_argument("--workers", type=int, default=None, help="procesos del pool (por defecto, uno por core)")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--patience", type=int, default=15)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--tolerancia", type=float, default=0.01, help="margen de hit rate dentro del cual se prefiere el más rápido")
+    parser.add_argument("--latencia-max-us", type=float, default=None, help="descarta candidatos más lentos")
+    parser.add_argument("--min-muestras", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--feedback-dir", default=str(FEEDBACK_DIR))
+    parser.add_argument("--salida", default=str(SALIDA))
+    parser.add_argument("--publicar", action="store_true", help="agregar el ganador como checkpoint nuevo del servidor")
+    args = parser.parse_args()
+
+    historial = cargar_historial(leer_registros(Path(args.feedback_dir)))
+    if len(historial) < args.min_muestras:
+        print(f"Muestras insuficientes ({len(historial)} < {args.min_muestras})")
+        return
+
+    busqueda = buscar(historial, args.pruebas, args.workers, args.epochs, args.patience,
+                      args.holdout, args.top_k, args.seed)
+    ganador = elegir_ganador(busqueda['resultados'], args.tolerancia, args.latencia_max_us)
+    if ganador is None:
+        print("Ningún candidato cumple la latencia máxima")
+        return
+
+    ref = busqueda['referencia']
+    ranking = sorted(busqueda['resultados'], key=lambda r: (-r['hit_rate'], -r['mrr']))
+    print(f"\nMejores 5 (hit@{args.top_k} / mrr / latencia):")
+    for r in ranking[:5]:
+        print(f"  {r['hit_rate']:.3f}  {r['mrr']:.3f}  {r['latencia_us']:.1f}µs  {r['hiper']}")
+    print(f"Configuración actual: hit@{args.top_k} {ref['hit_rate']:.3f}, mrr {ref['mrr']:.3f}, "
+          f"{ref['latencia_us']:.1f}µs")
+    print(f"Ganador:              hit@{args.top_k} {ganador['hit_rate']:.3f}, mrr {ganador['mrr']:.3f}, "
+          f"{ganador['latencia_us']:.1f}µs  {ganador['hiper']}")
+
+    actual = WeightOptimizerNN()
+    params, meta = checkpoint_ganador(ganador, actual.version + 1, args.top_k)
+    salida = Path(args.salida)
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    escribir_arrays(salida, params, meta)
+    print(f"Checkpoint del ganador en {salida}")
+    if args.publicar:
+        path = guardar_checkpoint(actual.checkpoint_dir, params, meta, retener=actual.checkpoints_retenidos)
+        print(f"Publicado como {path} (versión {meta['version']}); el servidor lo carga al reiniciar")
+
+
+if __name__ == "__main__":
+    main()
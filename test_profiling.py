@@ -0,0 +1,55 @@
+"""
+Prueba del perfilado por request sobre /api/recommend
+Ejecutar: python test_profiling.py  (o con pytest)
+
+Perfila un /api/recommend con ?profile=1 y verifica que el perfil vea el
+trabajo del pipeline (en particular el tiempo en CLIPS) y no solo la espera
+del middleware.
+"""
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+TOKEN = "token-de-prueba"
+DIRECTORIO = Path(tempfile.mkdtemp(prefix="perfiles-"))
+os.environ.update(
+    PROFILE_TOKEN=TOKEN,
+    PROFILE_INTERVALO_MS="1",
+    PROFILE_DIR=str(DIRECTORIO / "perfiles"),
+    UBICACIONES_DIR=str(DIRECTORIO / "ubicaciones"),
+    GOOGLE_MAPS_API_KEY="",
+)
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from test_ruleset_v4 import generar_caso, generar_restaurantes, silenciar
+
+
+def test_recommend_perfilado_incluye_clips():
+    rnd = random.Random(7)
+    usuario, contexto = generar_caso(rnd)
+    usuario.update(tiempo_max=40, restricciones=[], solo_abiertos=None)
+    body = {
+        "usuario": usuario,
+        "contexto": contexto,
+        "restaurantes": generar_restaurantes(1500, rnd),
+        "usar_pesos_optimizados": False,
+    }
+    with silenciar(), TestClient(app) as client:
+        respuesta = client.post("/api/recommend?profile=1", json=body, headers={"X-Profile-Token": TOKEN})
+        perfil_id = respuesta.headers.get("x-profile-id")
+        perfil = client.get(f"/api/perfiles/{perfil_id}?formato=json", headers={"X-Profile-Token": TOKEN})
+    assert respuesta.status_code == 200
+    assert perfil_id
+    resumen = perfil.json()["resumen_ms"]
+    print(f"Resumen del perfil: {resumen}")
+    assert resumen.get("clips", 0) > 0, f"el perfil no muestra tiempo en CLIPS: {resumen}"
+
+
+if __name__ == "__main__":
+    test_recommend_perfilado_incluye_clips()
+    print("OK")
+    sys.exit(0)
@@ -0,0 +1,182 @@
+"""
+Script para comparar tpo_gastronomico_v4.clp contra tpo_gastronomico_v3_2.clp
+Ejecutar: python test_ruleset_v4.py [--restaurantes 300] [--casos 30]
+     o pytest test_ruleset_v4.py (catálogo chico con semilla fija)
+
+Verifica que ambos rulesets den el mismo ranking (mismo orden y mismo U) sobre
+un catálogo sintético y usuarios/contextos al azar, y compara cantidad de reglas
+disparadas y tiempo de env.run().
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from app.engine import MAX_PASOS, ClipsRecommender
+
+BASE_DIR = Path(__file__).parent
+CLP_V3 = BASE_DIR / "tpo_gastronomico_v3_2.clp"
+CLP_V4 = BASE_DIR / "tpo_gastronomico_v4.clp"
+
+TOLERANCIA = 1e-9  # la suma de U se hace en distinto orden en cada ruleset
+
+COCINAS = ["italiana", "pizza", "japonesa", "sushi", "mexicana", "parrilla", "fusion", "vegana", "peruana", "china"]
+ATRIBUTOS = ["vegano", "vegetariano", "celiaco", "sin_tacc", "sin_lactosa", "accesible", "kosher", "fit"]
+
+
+@contextlib.contextmanager
+def silenciar():
+    """Descarta stdout a nivel de descriptor (los printout de CLIPS no pasan por sys.stdout)."""
+    sys.stdout.flush()
+    original = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(original, 1)
+            os.close(original)
+
+
+def generar_restaurantes(n, rnd):
+    restaurantes = []
+    for i in range(n):
+        restaurantes.append({
+            "id": f"r{i}",
+            "nombre": f"Resto_{i}",
+            "cocinas": rnd.sample(COCINAS, rnd.randint(1, 3)),
+            "precio_pp": rnd.choice([5000, 8000, 12000, 15000, 18000, 22000, 30000, 45000]),
+            "rating": round(rnd.uniform(2.5, 5.0), 1),
+            "n_resenas": rnd.randint(0, 800),
+            "atributos": rnd.sample(ATRIBUTOS, rnd.randint(0, 4)),
+            "reserva": rnd.choice(["si", "no"]),
+            "abierto": rnd.choice(["si", "si", "no"]),
+            "tiempo_min": rnd.choice([0, 5, 8, 12, 15, 20, 25, 35, 999]),
+            "pet_friendly": rnd.choice(["si", "no", None]),
+            "estacionamiento_propio": rnd.choice(["si", "no", None]),
+        })
+    return restaurantes
+
+
+def generar_caso(rnd):
+    usuario = {
+        "id": "u1",
+        "cocinas_favoritas": rnd.sample(COCINAS, rnd.randint(0, 3)),
+        "presupuesto": rnd.choice([8000, 15000, 25000, 40000]),
+        "tiempo_max": rnd.choice([10, 15, 20, 30]),
+        "movilidad": rnd.choice(["a_pie", "auto", "moto", "bicicleta"]),
+        "restricciones": rnd.choice([[], [], ["vegano"], ["vegetariano"], ["celiaco"], ["sin_tacc"],
+                                     ["pet_friendly"], ["intolerancia_lactosa"]]),
+        "wg": 0.35, "wp": 0.20, "wd": 0.25, "wq": 0.15, "wa": 0.05,
+        "movilidad_reducida": rnd.choice([None, None, "si"]),
+        "requiere_reserva": rnd.choice([None, None, "si", "no"]),
+        "solo_abiertos": rnd.choice([None, "si", "no"]),
+    }
+    contexto = {
+        "clima": rnd.choice(["lluvia", "templado", "soleado"]),
+        "dia": "viernes",
+        "franja": rnd.choice(["cena", "almuerzo"]),
+    }
+    return usuario, contexto
+
+
+def ejecutar(engine, usuario, contexto, restaurantes):
+    """Mismos pasos que engine.recommend (con su límite de disparos), midiendo solo env.run()."""
+    with silenciar():
+        engine.reset_env()
+        engine.assert_fact("usuario", usuario)
+        engine.assert_fact("contexto", contexto)
+        for r in restaurantes:
+            engine.assert_fact("restaurante", r)
+        inicio = time.perf_counter()
+        disparos = engine.env.run(MAX_PASOS)
+        duracion = time.perf_counter() - inicio
+        recs = engine.get_recommendations()
+    return recs, disparos, duracion
+
+
+def mismo_ranking(a, b):
+    """Mismo U por restaurante y mismo orden salvo empates (dentro de la tolerancia)."""
+    if len(a) != len(b):
+        return False, f"cantidad distinta: {len(a)} vs {len(b)}"
+    u_b = {r["id"]: r["U"] for r in b}
+    for r in a:
+        if r["id"] not in u_b:
+            return False, f"{r['id']} falta en v4"
+        if abs(r["U"] - u_b[r["id"]]) > TOLERANCIA:
+            return False, f"U distinto para {r['id']}: {r['U']} vs {u_b[r['id']]}"
+    for i, (ra, rb) in enumerate(zip(a, b)):
+        if ra["id"] != rb["id"] and abs(ra["U"] - rb["U"]) > TOLERANCIA:
+            return False, f"posición {i}: {ra['id']} vs {rb['id']}"
+    return True, ""
+
+
+def test_mismo_ranking_v3_v4():
+    rnd = random.Random(11)
+    restaurantes = generar_restaurantes(60, rnd)
+    with silenciar():
+        v3 = ClipsRecommender(str(CLP_V3))
+        v4 = ClipsRecommender(str(CLP_V4))
+    for caso in range(8):
+        usuario, contexto = generar_caso(rnd)
+        recs3, d3, _ = ejecutar(v3, usuario, contexto, restaurantes)
+        recs4, _, _ = ejecutar(v4, usuario, contexto, restaurantes)
+        assert d3 < MAX_PASOS, f"caso {caso}: v3_2 llegó al límite de disparos"
+        ok, detalle = mismo_ranking(recs3, recs4)
+        assert ok, f"caso {caso}: {detalle}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara los rulesets v3_2 y v4")
+    parser.add_argument("--restaurantes", type=int, default=300)
+    parser.add_argument("--casos", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    restaurantes = generar_restaurantes(args.restaurantes, rnd)
+    with silenciar():
+        v3 = ClipsRecommender(str(CLP_V3))
+        v4 = ClipsRecommender(str(CLP_V4))
+
+    print("=" * 60)
+    print(f"COMPARACION v3_2 vs v4 ({args.restaurantes} restaurantes, {args.casos} casos)")
+    print("=" * 60)
+
+    fallas = 0
+    disparos = {"v3_2": 0, "v4": 0}
+    tiempos = {"v3_2": 0.0, "v4": 0.0}
+    max_disparos_v3 = 0
+    for caso in range(args.casos):
+        usuario, contexto = generar_caso(rnd)
+        recs3, d3, t3 = ejecutar(v3, usuario, contexto, restaurantes)
+        recs4, d4, t4 = ejecutar(v4, usuario, contexto, restaurantes)
+        disparos["v3_2"] += d3
+        disparos["v4"] += d4
+        tiempos["v3_2"] += t3
+        tiempos["v4"] += t4
+        max_disparos_v3 = max(max_disparos_v3, d3)
+        ok, detalle = mismo_ranking(recs3, recs4)
+        if not ok:
+            fallas += 1
+            print(f"   [FALLA] caso {caso}: {detalle}")
+
+    print(f"\n   Rankings identicos: {args.casos - fallas}/{args.casos}")
+    print(f"   Reglas disparadas (promedio): v3_2={disparos['v3_2'] / args.casos:.0f}  v4={disparos['v4'] / args.casos:.0f}")
+    print(f"   Tiempo de env.run (promedio): v3_2={tiempos['v3_2'] / args.casos * 1000:.1f}ms  "
+          f"v4={tiempos['v4'] / args.casos * 1000:.1f}ms")
+    if max_disparos_v3 >= MAX_PASOS:
+        print(f"   [INFO] v3_2 llego al limite de {MAX_PASOS} disparos de engine.recommend: "
+              f"el ranking de ese caso quedo incompleto")
+    print("=" * 60)
+    print("RESULTADO:", "[OK]" if fallas == 0 else "[FALLA]")
+    return 0 if fallas == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())